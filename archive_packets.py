@@ -0,0 +1,57 @@
+import argparse
+import logging
+import datetime
+from configparser import ConfigParser
+
+from db_handlers import connect_packet_db, checkpoint_packet_db
+from db_connections import close_connections
+from packet_archive import archive_packets, vacuum_packet_db
+from time_handlers import SECONDS_PER_DAY, unix_to_datetime
+
+
+def archive(db_name, days, processed_only=True, vacuum=True):
+    ''' Move the packets in the packet database at db_name which are more than days old (by header
+        timestamp) into its cold archive, and free up the space. Returns the number of packets archived. '''
+    conn = connect_packet_db(db_name)
+    before = datetime.datetime.now().timestamp() - days*SECONDS_PER_DAY
+    logging.info(f'{db_name}: archiving packets from before {unix_to_datetime(before)}')
+    try:
+        num_archived = archive_packets(conn, before, processed_only=processed_only)
+        logging.info(f'archived {num_archived} packets')
+        if vacuum and num_archived > 0:
+            vacuum_packet_db(conn)
+        checkpoint_packet_db(conn)
+    finally:
+        close_connections(db_name)
+    return num_archived
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="VPM Ground Support Software -- Move old packets into the cold archive")
+    parser.add_argument("--db", required=False, type=str, default=None,
+                        help="path to the packet database. Defaults to packet_db_file, from GSS_settings.conf")
+    parser.add_argument("--days", required=False, type=float, default=None,
+                        help="archive packets older than this many days. Defaults to archive_after_days, from GSS_settings.conf")
+    parser.add_argument("--all", action='store_true', default=False,
+                        help="archive old packets even if the processing scripts haven't got to them yet")
+    parser.add_argument("--no_vacuum", action='store_true', default=False,
+                        help="don't vacuum the database afterwards")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(name)s]\t%(levelname)s\t%(message)s')
+
+    config = ConfigParser()
+    with open('GSS_settings.conf') as fp:
+        config.read_file(fp)
+
+    db_name = args.db
+    if db_name is None:
+        db_name = config['db_locations']['packet_db_file']
+    days = args.days
+    if days is None:
+        days = float(config.get('packet_config', 'archive_after_days', fallback='0'))
+
+    if days <= 0:
+        logging.info('archiving is switched off (archive_after_days = 0)')
+    else:
+        archive(db_name, days, processed_only=not args.all, vacuum=not args.no_vacuum)
@@ -5,4 +5,5 @@ python process_packets.py
 python process_status_data.py
 python process_survey_data.py
 python generate_survey_quicklooks.py
-python process_burst_data.py
\ No newline at end of file
+python process_burst_data.py
+python archive_packets.py
\ No newline at end of file
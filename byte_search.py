@@ -0,0 +1,96 @@
+# Byte-sequence search kernels.
+# These replace the sliding-window find_sequence (which builds an N x len(seq) index
+# matrix on every call) with a candidate-filtering search: we make a single pass over
+# the buffer to find every position matching the first byte of any pattern, and then
+# check the remaining bytes at those positions only. Work and memory scale with the
+# buffer length plus the number of candidates -- and patterns sharing a first byte
+# (e.g., the 7D escape sequences, or the Novatel sync words) share that one pass.
+
+import numpy as np
+
+
+def find_sequences(arr, seqs):
+    '''
+    Find all instances of several byte sequences within a 1d array, in one pass.
+    inputs:
+        arr:    1d array to search (uint8, or float with NaNs for missing data)
+        seqs:   a list of sequences (lists or arrays of byte values)
+    outputs:
+        A list of arrays -- one per sequence -- of the indexes corresponding
+        to the first value of each match, in increasing order.
+    '''
+    arr = np.asarray(arr).ravel()
+    seqs = [np.asarray(seq).ravel() for seq in seqs]
+
+    if len(seqs) == 0:
+        return []
+
+    # Every position which could start any of the sequences
+    first_bytes = np.unique([seq[0] for seq in seqs if seq.size])
+    if np.issubdtype(arr.dtype, np.integer) and arr.dtype.itemsize == 1:
+        lookup = np.zeros(256, dtype=bool)
+        lookup[first_bytes.astype(np.uint8)] = True
+        candidates = np.flatnonzero(lookup[arr.view(np.uint8)])
+    elif len(first_bytes) == 1:
+        candidates = np.flatnonzero(arr == first_bytes[0])
+    else:
+        candidates = np.flatnonzero(np.isin(arr, first_bytes))
+
+    leads = arr[candidates]
+
+    outs = []
+    for seq in seqs:
+        if seq.size == 0 or seq.size > arr.size:
+            outs.append(np.zeros(0, dtype=np.int64))
+            continue
+        inds = candidates[leads == seq[0]]
+        inds = inds[inds <= arr.size - seq.size]
+        # Narrow down the candidates, one byte at a time
+        for k in range(1, seq.size):
+            if inds.size == 0:
+                break
+            inds = inds[arr[inds + k] == seq[k]]
+        outs.append(inds)
+
+    return outs
+
+
+def find_sequence(arr, seq):
+    '''
+    Find any instances of a sequence seq in 1d array arr.
+    Returns an array of indexes corresponding to the first value in the sequence.
+    '''
+    return find_sequences(arr, [seq])[0]
+
+
+def find_sequences_batch(buffers, seqs):
+    '''
+    Find all instances of several byte sequences within many buffers at once.
+    Matches never span two buffers.
+    inputs:
+        buffers:    either a 2d array (one buffer per row), or a list of 1d arrays
+        seqs:       a list of sequences (lists or arrays of byte values)
+    outputs:
+        A list -- one entry per sequence -- of (buffer_index, offset) tuples;
+        buffer_index and offset are arrays, giving the buffer containing each match
+        and the index of the match within that buffer. Sorted by buffer, then offset.
+    '''
+    if isinstance(buffers, np.ndarray) and buffers.ndim == 2:
+        lengths = np.full(buffers.shape[0], buffers.shape[1], dtype=np.int64)
+        flat = buffers.ravel()
+    else:
+        buffers = [np.asarray(b).ravel() for b in buffers]
+        lengths = np.array([len(b) for b in buffers], dtype=np.int64)
+        flat = np.concatenate(buffers) if buffers else np.zeros(0, dtype=np.uint8)
+
+    starts = np.cumsum(lengths) - lengths
+
+    outs = []
+    for seq, inds in zip(seqs, find_sequences(flat, seqs)):
+        buffer_index = np.searchsorted(starts, inds, side='right') - 1
+        offset = inds - starts[buffer_index]
+        # Drop any matches which ran off the end of their buffer
+        fits = offset + len(seq) <= lengths[buffer_index]
+        outs.append((buffer_index[fits], offset[fits]))
+
+    return outs
@@ -0,0 +1,132 @@
+import numpy as np
+import logging
+import datetime
+from collections import Counter
+
+from db_connections import get_connection, read_snapshot, table_exists
+from packet_identity import float_timestamps
+from time_handlers import unix_to_datetime, merge_intervals
+
+# Every write to the packets table is recorded in the changes table, as the (dtype, time bucket)
+# pairs which got new packets, in order (seq). Each pipeline stage keeps a cursor -- the last
+# change it has dealt with -- in the stage_cursors table; it asks for the buckets which have
+# changed since (get_dirty_buckets), processes just those, and then moves its cursor on
+# (acknowledge_changes). So ingesting one old file only costs the stages the hours it covers.
+
+# Width of the time buckets (in seconds, by header_timestamp)
+BUCKET_SECONDS = 60*60
+# (The start of the bucket of each packet, in SQL)
+BUCKET_SQL = f'CAST(header_timestamp / {BUCKET_SECONDS} AS INTEGER) * {BUCKET_SECONDS}'
+
+def record_changes(conn, added, feed=None):
+    ''' Enter the packets added to the packets table of conn at time added (i.e., in one
+        write_to_db) in the change feed -- of feed, if conn is a shard's connection. Doesn't
+        commit, so the changes go in with the packets. '''
+    counts = conn.execute(f'''SELECT dtype, {BUCKET_SQL}, COUNT(*) FROM packets
+                              WHERE added = ? AND header_timestamp IS NOT NULL GROUP BY 1, 2''', (added,)).fetchall()
+    (feed or conn).executemany('INSERT INTO changes (dtype, bucket, count, added) VALUES (?, ?, ?, ?)',
+                               [(d, b, n, added) for d, b, n in counts])
+
+def record_table_changes(conn, packets, added):
+    ''' Enter packets (a PacketTable, written at time added) in the change feed, as record_changes
+        does for packets in a table. Doesn't commit. '''
+    t = float_timestamps(packets)
+    valid = np.isfinite(t)
+    buckets = (t[valid] // BUCKET_SECONDS).astype(np.int64) * BUCKET_SECONDS
+    counts = Counter(zip(packets['dtype'][valid].tolist(), buckets.tolist()))
+    conn.executemany('INSERT INTO changes (dtype, bucket, count, added) VALUES (?, ?, ?, ?)',
+                     [(d, b, n, added) for (d, b), n in sorted(counts.items())])
+
+# The stages which read the change feed (each acknowledges it under its script's name)
+PROCESSING_STAGES = ['process_status_data', 'process_survey_data', 'process_burst_data']
+
+def get_stage_cursor(db_name, stage):
+    ''' The last change stage has dealt with (or None, if the stage has never acknowledged any) '''
+    conn = get_connection(db_name, readonly=True)
+    if not table_exists(conn, 'stage_cursors'):
+        return None
+    row = conn.execute('SELECT seq FROM stage_cursors WHERE stage=?', (stage,)).fetchone()
+    return row[0] if row else None
+
+def get_dirty_buckets(db_name, stage, dtypes=None, since=0):
+    '''
+    Find the time buckets with new packets (of types in dtypes; default all of them)
+    since stage last acknowledged the change feed. A stage without a cursor gets
+    the buckets with packets added after Unix timestamp since (e.g., its last run time).
+    outputs:
+        buckets:    sorted list of the start times of the changed buckets (Unix timestamps)
+        seq:        the latest change seen -- pass it to acknowledge_changes once the buckets are done
+    '''
+    logger = logging.getLogger('get_dirty_buckets')
+
+    # (The cursor, and the changes since, from the same snapshot)
+    with read_snapshot(db_name) as conn:
+        if not table_exists(conn, 'changes'):
+            logger.warning(f'no change feed in {db_name}; run process_packets.py (or migrate_packet_db.py) first')
+            return [], None
+
+        cursor = get_stage_cursor(conn, stage)
+        seq = conn.execute('SELECT MAX(seq) FROM changes').fetchone()[0] or 0
+
+        sql = 'SELECT DISTINCT bucket FROM changes WHERE seq <= ?'
+        params = [seq]
+        if cursor is None:
+            logger.info(f'no cursor for {stage}; using changes since {unix_to_datetime(since)}')
+            sql += ' AND added > ?'
+            params.append(since)
+        else:
+            sql += ' AND seq > ?'
+            params.append(cursor)
+        if dtypes:
+            sql += f" AND dtype IN ({', '.join('?'*len(dtypes))})"
+            params.extend(dtypes)
+        sql += ' ORDER BY bucket'
+
+        buckets = [r[0] for r in conn.execute(sql, params).fetchall()]
+    return buckets, seq
+
+def acknowledge_changes(db_name, stage, seq):
+    ''' Move stage's cursor in the change feed on to seq (from get_dirty_buckets), and commit '''
+    if seq is None:
+        return
+    conn = get_connection(db_name)
+    conn.execute('INSERT OR REPLACE INTO stage_cursors (stage, seq, updated) VALUES(?, ?, ?)',
+                 (stage, seq, datetime.datetime.now().timestamp()))
+    conn.commit()
+
+def bucket_spans(buckets, margin=0):
+    '''
+    Merge time buckets (start times, from get_dirty_buckets), each widened by margin seconds
+    on both sides, into non-overlapping spans. Returns a list of (t1, t2) Unix timestamps.
+    '''
+    return merge_intervals([(b - margin, b + BUCKET_SECONDS + margin) for b in buckets])
+
+def create_change_feed(conn):
+    ''' The change feed (which time buckets have new packets), and the stage cursors into it.
+        Existing packets are entered as one change per bucket, as of the last packet added
+        to it -- so stages without a cursor yet can pick out what's new since their last run. '''
+    conn.execute(''' CREATE TABLE IF NOT EXISTS changes (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        dtype TEXT,
+                        bucket INTEGER,
+                        count INTEGER,
+                        added REAL
+                    ); ''')
+    conn.execute(''' CREATE TABLE IF NOT EXISTS stage_cursors (
+                        stage TEXT PRIMARY KEY,
+                        seq INTEGER,
+                        updated REAL
+                    ); ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS changes_added ON changes (added)')
+    if conn.execute('SELECT COUNT(*) FROM changes').fetchone()[0] == 0:
+        conn.execute(f'''INSERT INTO changes (dtype, bucket, count, added)
+                         SELECT dtype, {BUCKET_SQL}, COUNT(*), MAX(added) FROM packets
+                         WHERE header_timestamp IS NOT NULL GROUP BY 1, 2 ORDER BY MAX(added)''')
+
+def processed_until(conn, stages=PROCESSING_STAGES):
+    ''' The time up to which every one of stages has dealt with the change feed: packets added by
+        then have been made into products. None if any of the stages hasn't got a cursor yet. '''
+    cursors = [get_stage_cursor(conn, stage) for stage in stages]
+    if any(seq is None for seq in cursors):
+        return None
+    return conn.execute('SELECT MAX(added) FROM changes WHERE seq <= ?', (min(cursors),)).fetchone()[0] or 0.0
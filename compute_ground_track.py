@@ -3,7 +3,8 @@ import os
 import ephem
 import datetime
 import json
-import bisect
+from time_handlers import unix_to_datetime64
+from survey_frame import SurveyFrame
 
 
 # Helper functions
@@ -95,17 +96,19 @@ def get_position_from_TLE_library(timestamps, TLE_lib=None):
     sat = Satellite(TLE_lib[0]['TLE_LINE1'], TLE_lib[0]['TLE_LINE2'],'VPM')
     
     # Sorted vector of TLE times
-    db_tvec = [x['DATETIME'] for x in TLE_lib]
+    db_tvec = np.array([x['DATETIME'] for x in TLE_lib], dtype='datetime64[us]')
     
+    # Convert all the timestamps at once, and grab the closest TLE for each
+    # (without looking into the future)
+    curtimes = unix_to_datetime64(np.asarray(timestamps, dtype=np.float64).ravel())
+    TLE_inds = np.searchsorted(db_tvec, curtimes, side='left')
+    curtimes = curtimes.astype(object)
+
     # Output space
     traj = []
     tvec = []
     # Get the appropriate TLE:
-    for t in timestamps:
-        curtime = datetime.datetime.utcfromtimestamp(t)
-        
-        # Grab the closest TLE (without looking into the future)
-        ind = bisect.bisect_left(db_tvec, curtime)
+    for curtime, ind in zip(curtimes, TLE_inds):
         TLE = [TLE_lib[ind]['TLE_LINE1'],TLE_lib[ind]['TLE_LINE2']]
     
         # Update the satellite, if needed:
@@ -127,8 +130,8 @@ def fill_missing_GPS_entries(G_data, TLE_lib=None):
         elements with synthesized values, using an appropriate TLE
         from the TLE library.
         
-        For survey data ("S_data"), you can get a list of the GPS entries by:
-        [x['GPS'][0] for x in S_data]
+        For survey data ("S_data"), pass the SurveyFrame itself; its GPS
+        columns are updated in place.
         
         For burst data, it's probably already a list of GPS entries:
         Burst_data['G']
@@ -136,42 +139,52 @@ def fill_missing_GPS_entries(G_data, TLE_lib=None):
     if not TLE_lib:
         TLE_lib = load_TLE_library('resources/VPM_TLEs.json')
 
+    if isinstance(G_data, SurveyFrame):
+        # Same test as below, on the whole columns at once
+        bad = (G_data.gps('solution_status', fill=0) != 0) & (G_data.gps('time_status', fill=0) > 20)
+        if np.any(bad):
+            coords, _ = get_position_from_TLE_library(G_data.gps('timestamp')[bad], TLE_lib)
+            G_data.set_gps('lon', bad, coords[:, 0])
+            G_data.set_gps('lat', bad, coords[:, 1])
+            G_data.set_gps('alt', bad, coords[:, 2])
+        return
+
     # Instantiate the Satellite object
     sat = Satellite(TLE_lib[0]['TLE_LINE1'], TLE_lib[0]['TLE_LINE2'],'VPM')
     
     # Sorted vector of TLE times
-    db_tvec = [x['DATETIME'] for x in TLE_lib]
-    
-    # Output space
-    traj = []
-    tvec = []
+    db_tvec = np.array([x['DATETIME'] for x in TLE_lib], dtype='datetime64[us]')
+
+    # "solution_status" is defined by Novatel OEM7 manual, table 80.
+    # 0 = good solution, anything else is problematic
+    # time status > 20 = at least a coarse time lock
+    bad_entries = [G for G in G_data if (G['solution_status']!=0) and (G['time_status'] > 20)]
+    if not bad_entries:
+        return
+
+    # Convert all the timestamps at once, and grab the closest TLE for each
+    # (without looking into the future)
+    curtimes = unix_to_datetime64([G['timestamp'] for G in bad_entries])
+    TLE_inds = np.searchsorted(db_tvec, curtimes, side='left')
+    curtimes = curtimes.astype(object)
+
     # Get the appropriate TLE:
-    for G in G_data:
-        
-        # "solution_status" is defined by Novatel OEM7 manual, table 80.
-        # 0 = good solution, anything else is problematic
-        # time status > 20 = at least a coarse time lock
-        if (G['solution_status']!=0) and (G['time_status'] > 20): 
-
-            # Bad GPS entry! We can rebuild him... we have the technology
-            t = G['timestamp']
-            curtime = datetime.datetime.utcfromtimestamp(t)
-
-            # Grab the closest TLE (without looking into the future)
-            ind = bisect.bisect_left(db_tvec, curtime)
-            TLE = [TLE_lib[ind]['TLE_LINE1'],TLE_lib[ind]['TLE_LINE2']]
-
-            # Update the satellite, if needed:
-            sat.update_TLEs(TLE[0],TLE[1],'VPM')
-
-            # Get the position
-            sat.compute(curtime)    
-            coords = [sat.coords_3d_at(curtime)][0]
-
-            # Write the new coordinates back to the GPS object
-            # Python does everything by reference, so the S_data
-            # elements are all in-place -- no returning necessary
-            G['lon'] = coords[0]
-            G['lat'] = coords[1]
-            G['alt'] = coords[2]
+    for G, curtime, ind in zip(bad_entries, curtimes, TLE_inds):
+
+        # Bad GPS entry! We can rebuild him... we have the technology
+        TLE = [TLE_lib[ind]['TLE_LINE1'],TLE_lib[ind]['TLE_LINE2']]
+
+        # Update the satellite, if needed:
+        sat.update_TLEs(TLE[0],TLE[1],'VPM')
+
+        # Get the position
+        sat.compute(curtime)    
+        coords = [sat.coords_3d_at(curtime)][0]
+
+        # Write the new coordinates back to the GPS object
+        # Python does everything by reference, so the S_data
+        # elements are all in-place -- no returning necessary
+        G['lon'] = coords[0]
+        G['lat'] = coords[1]
+        G['alt'] = coords[2]
 
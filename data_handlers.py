@@ -8,7 +8,14 @@ import struct
 import csv
 import scipy.stats
 import itertools
+import collections
+import hashlib
+import multiprocessing
 import psutil
+from byte_search import find_sequences, find_sequences_batch
+from packet_table import PacketTable, pack_payloads, select_packets, rebatch, concatenate_columns
+from survey_frame import SurveyFrame, gps_columns
+from time_handlers import gps_to_unix, gps_week_to_unix, iso_to_unix
 # global console_log
 
 def decode_status(packets):
@@ -33,9 +40,9 @@ def decode_status(packets):
     out_data = []
 
     # get status packets    
-    for p in filter(lambda packet: packet['dtype'] == 'I', packets):
+    for p in select_packets(packets, ['I']):
         try:
-            data = p['data'][:p['bytecount']]
+            data = np.asarray(p['data'][:p['bytecount']]).tolist()
 
             source = chr(data[3])
             prev_command = np.array(np.flip(data[0:3]), dtype=np.uint8)
@@ -336,25 +343,272 @@ def decode_uBBR_command(cmd):
     
     return out
 
-def find_sequence(arr,seq):
+# Packet indices and lengths (set in payload firmware)
+PACKET_SIZE = 512
+DATA_SEGMENT_LENGTH = PACKET_SIZE - 8
+PACKET_COUNT_INDEX = 1
+DATA_TYPE_INDEX = 5
+EXPERIMENT_INDEX = 6
+DATA_START_INDEX = 7
+DATA_END_INDEX = DATA_START_INDEX + DATA_SEGMENT_LENGTH
+CHECKSUM_INDEX = PACKET_SIZE - 2
+
+CCSDS_HEADER_LEN = 26
+
+# Escape sequences: [7D, 5E] -> 7E, [7D, 5D] -> 7D
+ESCAPE_SEQUENCES = [[0x7D, 0x5E], [0x7D, 0x5D]]
+
+# Sync bytes + message IDs of the Novatel BESTPOS and BESTVEL logs
+BESTPOS_SYNC = [0xAA, 0x44, 0x12, 0x1C, 0x2A]
+BESTVEL_SYNC = [0xAA, 0x44, 0x12, 0x1C, 0x63]
+
+# Layouts of the Novatel OEM7 binary logs (little-endian, packed). See page 47 of the
+# OEM7 Firmware Reference Manual for the header, and page 443 for BESTPOS / BESTVEL.
+OEM7_HEADER_DTYPE = np.dtype([
+    ('sync', 'u1', 3), ('header_length', 'u1'), ('message_id', '<u2'), ('message_type', 'u1'),
+    ('port_address', 'u1'), ('message_length', '<u2'), ('sequence', '<u2'), ('idle_time', 'u1'),
+    ('time_status', 'u1'), ('week', '<u2'), ('ms', '<u4'), ('receiver_status', '<u4'),
+    ('reserved', '<u2'), ('sw_version', '<u2')])
+BESTPOS_DTYPE = np.dtype([
+    ('header', OEM7_HEADER_DTYPE),
+    ('sol_status', '<u4'), ('pos_type', '<u4'), ('lat', '<f8'), ('lon', '<f8'), ('hgt', '<f8'),
+    ('undulation', '<f4'), ('datum_id', '<u4'), ('lat_sd', '<f4'), ('lon_sd', '<f4'), ('hgt_sd', '<f4'),
+    ('stn_id', 'S4'), ('diff_age', '<f4'), ('sol_age', '<f4'), ('tracked_sats', 'u1'), ('used_sats', 'u1'),
+    ('used_sats_L1', 'u1'), ('used_sats_multi', 'u1'), ('reserved', 'u1'), ('ext_sol_stat', 'u1'),
+    ('galileo_beidou_sig_mask', 'u1'), ('gps_glonass_sig_mask', 'u1'),
+    ('crc', '<u4')])
+BESTVEL_DTYPE = np.dtype([
+    ('header', OEM7_HEADER_DTYPE),
+    ('sol_status', '<u4'), ('vel_type', '<u4'), ('latency', '<f4'), ('age', '<f4'),
+    ('hor_spd', '<f8'), ('trk_gnd', '<f8'), ('vert_spd', '<f8'), ('reserved', '<f4'),
+    ('crc', '<u4')])
+# In survey mode, the GPS block of each product is one BESTPOS log, then one BESTVEL log
+SURVEY_GPS_DTYPE = np.dtype([('pos', BESTPOS_DTYPE), ('vel', BESTVEL_DTYPE)])
+
+# Number of packets handed to decode_frames at once, when decoding a whole file.
+# (Bounds the size of the temporary arrays to a few tens of MB)
+FRAME_BLOCK_SIZE = 8192
+
+# Default number of bytes to read at once, when streaming a .TLM file with iter_packets_TLM
+TLM_WINDOW_SIZE = 16*1024*1024
+
+# Default number of bytes per shard, when decoding a single .TLM file on several processes
+TLM_SHARD_SIZE = 64*1024*1024
+
+# Number of bytes at the start of a file which go into its content digest (see file_digest)
+DIGEST_BYTES = 1024*1024
+
+# Default number of packets per batch, from the streaming decoders (iter_packets_TLM, iter_packets_CSV)
+PACKET_BATCH_SIZE = 8192
+
+# Number of rows to decode at once, when reading a .CSV file
+CSV_CHUNK_ROWS = 2048
+
+def find_packet_starts(data):
     '''
-    Find any instances of a sequence seq in 1d array arr.
-    Returns an array of indexes corresponding to the first value in the sequence.
+    Locates the start index of every packet within a raw byte array.
+    A packet is a 0x7E delimiter, followed by another 0x7E exactly PACKET_SIZE - 1 bytes
+    later, with no other 0x7E in between (escaping guarantees there are none within a packet).
     '''
-    # Store sizes of input array and sequence
-    Na, Nseq = arr.size, seq.size
-    # Range of sequence
-    r_seq = np.arange(Nseq)
-    # Create a 2D array of sliding indices across the entire length of input array.
-    # Match up with the input sequence & get the matching starting indices.
-    M = (arr[np.arange(Na-Nseq+1)[:,None] + r_seq] == seq).all(1)
-    inds = np.where(M)[0]
-    return(inds)
-
-def decode_packets_TLM(data_root, fname):
+    flags = np.flatnonzero(data == 0x7E)
+    return flags[:-1][np.diff(flags) == (PACKET_SIZE - 1)]
+
+def unescape_frames(frames):
+    '''
+    Un-escapes a stack of raw packets, all at once.
+    [7D, 5E] -> 7E, and [7D, 5D] -> 7D. Both substitutions are resolved on the
+    raw packet (neither one can create or destroy an instance of the other).
+    inputs:
+        frames:     2d uint8 array of raw packets (num_packets x PACKET_SIZE, usually)
+    outputs:
+        unescaped:  1d uint8 array; the un-escaped packets, end to end
+        offsets:    start index of each packet within unescaped
+        lengths:    length of each un-escaped packet
+    '''
+    escaped = frames[:, :-1] == 0x7D
+    esc1 = escaped & (frames[:, 1:] == 0x5E)
+    esc2 = escaped & (frames[:, 1:] == 0x5D)
+
+    # Swap in the 7E's, and drop the second byte of each escape sequence
+    subbed = frames.copy()
+    subbed[:, :-1][esc1] = 0x7E
+    drop = np.zeros(frames.shape, dtype=bool)
+    drop[:, 1:] = esc1 | esc2
+
+    unescaped = subbed.ravel()[~drop.ravel()]
+    lengths = frames.shape[1] - np.bincount(np.nonzero(drop)[0], minlength=len(frames))
+    offsets = np.cumsum(lengths) - lengths
+
+    return unescaped, offsets, lengths
+
+def decode_frames(data, p_start_inds):
+    '''
+    Vectorized packet decoder: frames, un-escapes, checksums, and decodes the headers
+    of a set of packets all at once.
+    inputs:
+        data:           1d uint8 array of raw bytes (e.g., the contents of a .TLM file)
+        p_start_inds:   start indices of packets within data, from find_packet_starts.
+                        Each one must be preceded by a CCSDS header.
+    outputs:
+        A dictionary of per-packet columns (one entry for each start index), plus:
+        payload:            1d uint8 array of the un-escaped packets, end to end
+        payload_offset:     index of each packet's data segment within payload
+        payload_length:     number of valid bytes in each data segment
+        start_ind, dtype, exp_num, bytecount, packet_length,
+        header_epoch_sec, header_ns, header_reboots, header_timestamp:
+                            as in the packet dictionaries from decode_packets_TLM
+                            (dtype is returned as uint8 character codes)
+        checksum_verify:    received checksum == calculated checksum
+    '''
+    # A (read-only) view of every PACKET_SIZE-long window in data, so we can grab
+    # whole packets (and the CCSDS headers in front of them) by their start index.
+    windows = np.lib.stride_tricks.as_strided(data, shape=(len(data) - PACKET_SIZE + 1, PACKET_SIZE),
+                                              strides=(data.strides[0], data.strides[0]), writeable=False)
+    ccsds_header = windows[p_start_inds - CCSDS_HEADER_LEN, :CCSDS_HEADER_LEN].astype(np.uint32)
+
+    # grab data from the CCSDS header (big-endian)
+    C_epoch_seconds = (ccsds_header[:, 8] << 24) | (ccsds_header[:, 9] << 16) | (ccsds_header[:, 10] << 8) | ccsds_header[:, 11]
+    C_nanoseconds   = (ccsds_header[:, 12] << 24) | (ccsds_header[:, 13] << 16) | (ccsds_header[:, 14] << 8) | ccsds_header[:, 15]
+    C_reboot_count  = (ccsds_header[:, 16] << 8) | ccsds_header[:, 17]
+
+    cols = decode_frame_stack(windows[p_start_inds])
+    cols['header_ns'] = C_nanoseconds
+    cols['header_epoch_sec'] = C_epoch_seconds
+    cols['header_reboots'] = C_reboot_count
+    cols['header_timestamp'] = gps_to_unix(C_epoch_seconds, C_nanoseconds)
+
+    return cols
+
+def decode_frame_stack(frames):
+    '''
+    Un-escapes, checksums, and decodes the metadata of a stack of raw packets
+    (the part of decode_frames shared by the TLM and CSV decoders).
+    inputs:
+        frames:     2d uint8 array of raw packets, one per row, from the opening
+                    0x7E to the closing one (num_packets x PACKET_SIZE, usually)
+    outputs:
+        A dictionary of per-packet columns, as in decode_frames (less the CCSDS header fields)
+    '''
+    # Check if the bytecount or checksum fields were escaped
+    check_escaped = (frames[:, PACKET_SIZE - 2] != 0)*1
+    count_escaped = (frames[:, PACKET_SIZE - 4] != 0)*1
+
+    # Calculate the checksum (on the unescaped data):
+    checksum_calc = frames[:, 2:CHECKSUM_INDEX - 1].sum(axis=1, dtype=np.int64)%256
+
+    # Un-escape the packets
+    cur_packets, offsets, packet_length_post_escape = unescape_frames(frames)
+
+    # Get the new indices of the checksum and bytecount fields
+    checksum_index  = offsets + packet_length_post_escape + check_escaped - 3
+    bytecount_index = offsets + packet_length_post_escape + check_escaped + count_escaped - 6
+
+    # Decode metadata fields
+    start_field = [cur_packets[offsets + PACKET_COUNT_INDEX + k].astype(np.uint32) for k in range(4)]
+    packet_start_index = (start_field[0] << 24) | (start_field[1] << 16) | (start_field[2] << 8) | start_field[3]
+    bytecount = 256*cur_packets[bytecount_index].astype(np.int64) + cur_packets[bytecount_index + 1]
+    checksum = cur_packets[checksum_index]
+
+    cols = dict()
+    cols['payload'] = cur_packets
+    cols['payload_offset'] = offsets + DATA_START_INDEX
+    cols['payload_length'] = np.clip(np.minimum(bytecount, packet_length_post_escape - DATA_START_INDEX), 0, None)
+    cols['start_ind'] = packet_start_index
+    cols['dtype'] = cur_packets[offsets + DATA_TYPE_INDEX]
+    cols['exp_num'] = cur_packets[offsets + EXPERIMENT_INDEX]
+    cols['bytecount'] = bytecount
+    cols['checksum_verify'] = (checksum == checksum_calc)
+    cols['packet_length'] = packet_length_post_escape
+
+    return cols
+
+def packets_from_frames(data, p_start_inds, fname, first_packet_num=0):
+    '''
+    Decodes the packets at p_start_inds within data (see decode_frames), and collects
+    them into a PacketTable. Packets which fail their checksum, or which are missing
+    a CCSDS header, are logged and skipped.
+    inputs:
+        data:               1d uint8 array of raw bytes
+        p_start_inds:       start indices of packets within data, from find_packet_starts
+        fname:              source file name, to tag each packet with
+        first_packet_num:   packet number of p_start_inds[0] (for log messages)
+    outputs:
+        packets:            a PacketTable of the decoded packets (as in decode_packets_TLM)
+        checksum_failures:  the number of packets with failed checksums
+    '''
+    packets, no_header, bad_checksum = frames_to_table(data, p_start_inds, fname)
+    log_frame_errors(no_header, bad_checksum, first_packet_num)
+
+    return packets, len(bad_checksum)
+
+def log_frame_errors(no_header, bad_checksum, first_packet_num=0):
+    ''' Log the packets rejected by frames_to_table '''
+    logger = logging.getLogger(__name__ + '.packets_from_frames')
+
+    for x in no_header:
+        logger.warning('exception at packet # %d', x + first_packet_num)
+    for x in bad_checksum:
+        logger.warning('invalid checksum at packet # %d -- skipping'%(x + first_packet_num))
+
+def frames_to_table(data, p_start_inds, fname):
+    '''
+    The (silent) decoder behind packets_from_frames.
+    outputs:
+        packets:            a PacketTable of the decoded packets
+        no_header:          indices (within p_start_inds) of the packets missing a CCSDS header
+        bad_checksum:       indices (within p_start_inds) of the packets with failed checksums
+    '''
+    # Packets need a complete CCSDS header in front of them
+    no_header = np.flatnonzero(p_start_inds < CCSDS_HEADER_LEN)
+
+    tables = []
+    bad_checksum = []
+
+    for block_start in range(0, len(p_start_inds), FRAME_BLOCK_SIZE):
+        block_inds = p_start_inds[block_start:block_start + FRAME_BLOCK_SIZE]
+        valid = block_inds >= CCSDS_HEADER_LEN
+        cols = decode_frames(data, block_inds[valid])
+        packet_nums = np.flatnonzero(valid) + block_start
+
+        bad_checksum.append(packet_nums[~cols['checksum_verify']])
+
+        # Keep the good packets, with their data segments packed end to end
+        good = np.flatnonzero(cols['checksum_verify'])
+        payload, bounds = pack_payloads(cols['payload'], cols['payload_offset'][good], cols['payload_length'][good])
+
+        columns = dict()
+        columns['start_ind'] = cols['start_ind'][good].astype(np.int64)
+        columns['dtype'] = cols['dtype'][good].view('S1').astype('U1')
+        columns['exp_num'] = cols['exp_num'][good]
+        columns['bytecount'] = cols['bytecount'][good]
+        columns['checksum_verify'] = cols['checksum_verify'][good]
+        columns['packet_length'] = cols['packet_length'][good].astype(np.int64)
+        columns['fname'] = np.full(len(good), fname, dtype=object)
+        columns['header_ns'] = cols['header_ns'][good].astype(np.int64)
+        columns['header_epoch_sec'] = cols['header_epoch_sec'][good].astype(np.int64)
+        columns['header_reboots'] = cols['header_reboots'][good].astype(np.int64)
+        columns['header_timestamp'] = cols['header_timestamp'][good]
+        tables.append(PacketTable(columns, payload, bounds))
+
+    bad_checksum = np.concatenate(bad_checksum) if bad_checksum else np.zeros(0, dtype=np.int64)
+
+    return PacketTable.concatenate(tables), no_header, bad_checksum
+
+def decode_packets_TLM(data_root, fname, num_workers=1, shard_size=TLM_SHARD_SIZE):
     '''
     Author:     Austin Sousa
                 austin.sousa@colorado.edu
+    Version:    2.1
+        Date:   10.17.2026
+        - Optionally decodes large files in parallel: with num_workers > 1, the
+          file is split into shards of ~shard_size bytes, at packet boundaries,
+          and the shards are decoded on a pool of processes (see iter_shards_TLM).
+          The output is identical to the serial decoder.
+    Version:    2.0
+        Date:   10.17.2026
+        - Vectorized: packets are framed, un-escaped, checksummed and decoded
+          in blocks of FRAME_BLOCK_SIZE, using decode_frames.
+        - Returns a PacketTable, rather than a list of dictionaries.
     Version:    1.0
         Date:   10.10.2019
     Description:
@@ -363,9 +617,11 @@ def decode_packets_TLM(data_root, fname):
     inputs: 
         data_root:          Root directory of the data file
         fname:              file name to load. Should end with .TLM
+        num_workers:        number of processes to decode with
+        shard_size:         approximate number of bytes per process task (with num_workers > 1)
     outputs:
-        a list of decoded packets:
-        Each packet is a dictionary with the following fields:
+        a PacketTable of decoded packets (which iterates as a list of packet dictionaries):
+        Each packet has the following fields:
         packet_data:        2d array of packet data (num_packets x data_segment_length)
         packet_start_index: Start index of the current data segment
         datatype:           Channel label. (Ascii 'S','E','B','L','G','I')
@@ -379,124 +635,288 @@ def decode_packets_TLM(data_root, fname):
     '''
     logger = logging.getLogger(__name__ + '.decode_packets_TLM')
 
-    logger.info(f'Loading file {fname}')
     fpath = os.path.join(data_root, fname)
+    if num_workers > 1 and os.path.getsize(fpath) > shard_size:
+        return PacketTable.concatenate(list(iter_shards_TLM(data_root, fname, num_workers, shard_size)))
+
+    logger.info(f'Loading file {fname}')
     with open(fpath,'rb') as f:
         data = np.fromfile(f,dtype='uint8')
 
-    # Packet indices and lengths (set in payload firmware)
-    PACKET_SIZE = 512
-    DATA_SEGMENT_LENGTH = PACKET_SIZE - 8
-    PACKET_COUNT_INDEX = 1
-    DATA_TYPE_INDEX = 5
-    EXPERIMENT_INDEX = 6
-    DATA_START_INDEX = 7
-    DATA_END_INDEX = DATA_START_INDEX + DATA_SEGMENT_LENGTH
-    CHECKSUM_INDEX = PACKET_SIZE - 2
+    # Find all packet start indices
+    p_start_inds = find_packet_starts(data)
+    logger.info(f"found {len(p_start_inds)} valid packets")
 
-    CCSDS_HEADER_LEN = 26
+    packets, checksum_failure_counter = packets_from_frames(data, p_start_inds, fname)
 
-    leap_seconds = 18  # GPS time does not account for leap seconds; as of ~2019, GPS leads UTC by 18 seconds.
-    reference_date = datetime.datetime(1980,1,6,0,0, tzinfo=datetime.timezone.utc) - datetime.timedelta(seconds=leap_seconds)
+    if checksum_failure_counter > 0:
+        logger.warning(f'--------------- {checksum_failure_counter} failed checksums ---------------')
 
+    logger.info(f'decoded {len(packets)} packets')
 
-    # Find all packet start indices
-    p_inds_pre_escape = np.array(sorted(np.where(data==0x7E)))
-    p_length_pre_escape = np.diff(p_inds_pre_escape)
+    return packets
 
-    # Select only the valid packet start indices
-    p_start_inds = p_inds_pre_escape[np.where(p_length_pre_escape == (PACKET_SIZE - 1))]
-    logger.info(f"found {len(p_start_inds)} valid packets")
-    # Escape characters, and move packets into a list (since their length now varies)
-    packets = [];
+def iter_packets_TLM(data_root, fname, window_size=TLM_WINDOW_SIZE, batch_size=PACKET_BATCH_SIZE, num_workers=1, state=None):
+    '''
+    Streaming version of decode_packets_TLM, for very large .TLM files.
+    The file is memory-mapped, and decoded in windows of window_size bytes.
+    Windows overlap by one packet + CCSDS header, so that packets which span a
+    window boundary are carried over into the next window (and each packet is
+    decoded exactly once). Memory use is bounded by the window size, rather than
+    the file size.
+    inputs:
+        data_root:          Root directory of the data file
+        fname:              file name to load. Should end with .TLM
+        window_size:        number of bytes to read at once
+        batch_size:         number of packets per batch. If None, yields one batch per window.
+        num_workers:        if > 1, decode the file in shards of window_size bytes on a
+                            pool of processes (see iter_shards_TLM)
+        state:              optional ingest state dictionary, for picking up where a previous
+                            run left off in a file which is still growing (see new_ingest_state)
+    outputs:
+        A generator, yielding PacketTables of batch_size decoded packets
+        (the same packets, in the same order, as decode_packets_TLM)
+    '''
+    if num_workers > 1:
+        windows = iter_shards_TLM(data_root, fname, num_workers, window_size, state=state)
+    else:
+        windows = iter_windows_TLM(data_root, fname, window_size, state=state)
+    if batch_size is not None:
+        windows = rebatch(windows, batch_size)
+    yield from tally_ingest_state(windows, state)
+
+def new_ingest_state(fpath):
+    '''
+    A fresh ingest state for a telemetry file (this is also its entry in the packet
+    database's file registry). The streaming decoders (iter_packets_TLM, iter_packets_CSV)
+    start reading from byte_offset, and update the state as they go:
+        path, size, mtime:  the file (absolute path), and its size and modification time when we last read it
+        digest:             file_digest of the file, when we last read it
+        byte_offset:        where to pick up reading the file next time. Anything from here
+                            on -- e.g., a partial packet at the end of a file which was still
+                            being written -- hasn't been decoded yet.
+        count:              number of packets (TLM) or rows (CSV) read so far; keeps the
+                            packet numbers and file indexes running on from the last read
+        packet_count:       number of packets decoded from the file so far
+        t_min, t_max:       range of header_timestamps of those packets
+    '''
+    return dict(path=os.path.abspath(fpath), size=0, mtime=0, digest=None, byte_offset=0, count=0,
+                packet_count=0, t_min=None, t_max=None)
+
+def update_ingest_state(state, fpath):
+    ''' Record the file's current size, modification time and digest in state. Returns the size. '''
+    stat = os.stat(fpath)
+    if state is not None:
+        state['path'] = os.path.abspath(fpath)
+        state['size'] = stat.st_size
+        state['mtime'] = stat.st_mtime
+        state['digest'] = file_digest(fpath, min(stat.st_size, DIGEST_BYTES))
+    return stat.st_size
+
+def file_digest(fpath, num_bytes=DIGEST_BYTES):
+    '''
+    A digest (SHA-1, in hex) of the first num_bytes of a file. Telemetry files only
+    ever grow, so the first part of the file is enough to tell whether it's the same
+    file we read last time, without reading the whole thing again.
+    '''
+    with open(fpath, 'rb') as f:
+        return hashlib.sha1(f.read(num_bytes)).hexdigest()
+
+def tally_ingest_state(batches, state):
+    ''' Pass a stream of PacketTables through, counting the packets and their time range in state '''
+    for batch in batches:
+        if state is not None and len(batch):
+            t = np.asarray(batch['header_timestamp'], dtype=np.float64)
+            state['packet_count'] += len(batch)
+            state['t_min'] = float(np.nanmin(t)) if state['t_min'] is None else min(state['t_min'], float(np.nanmin(t)))
+            state['t_max'] = float(np.nanmax(t)) if state['t_max'] is None else max(state['t_max'], float(np.nanmax(t)))
+        yield batch
+
+def iter_windows_TLM(data_root, fname, window_size=TLM_WINDOW_SIZE, state=None):
+    '''
+    The windowed decoder behind iter_packets_TLM: yields a PacketTable of the
+    packets decoded from each window of the file.
+    '''
+    logger = logging.getLogger(__name__ + '.iter_packets_TLM')
+
+    logger.info(f'Streaming file {fname}')
+    fpath = os.path.join(data_root, fname)
+    file_size = update_ingest_state(state, fpath)
+
+    window_size = max(int(window_size), 2*(PACKET_SIZE + CCSDS_HEADER_LEN))
+
+    next_start = state['byte_offset'] if state else 0                   # first packet start index not yet handled
+    window_start = max(next_start - CCSDS_HEADER_LEN, 0)                # file index of the start of the current window
+    packet_num = state['count'] if state else 0                         # running count of packets found
+    total_packets = 0
     checksum_failure_counter = 0
 
-    # for k in np.arange(-6, 20):
-    for x, pind in enumerate(p_start_inds):
-        try:
-            cur_packet = np.copy(data[pind:pind+PACKET_SIZE].astype('uint8'))
-            # cur_packet   = data[pind:pind+PACKET_SIZE]
-            ccsds_header = np.copy(data[pind-CCSDS_HEADER_LEN:pind]).astype('uint8')
-            # print(['{0:X}'.format(x) for x in data[pind:pind + EXPERIMENT_INDEX + 3]])
-
-            # grab data from the CTCSS header
-            C_packet_length = struct.unpack('>I', ccsds_header[0:4].tobytes())[0] # 534
-            C_component_ID  = struct.unpack('>B', ccsds_header[5:6].tobytes())[0] # 34
-            C_interface_ID  = struct.unpack('>B', ccsds_header[6:7].tobytes())[0] # 1
-            C_message_ID    = struct.unpack('>B', ccsds_header[7:8].tobytes())[0] # 2
-            C_epoch_seconds = struct.unpack('>I', ccsds_header[8:12].tobytes())[0]
-            C_nanoseconds   = struct.unpack('>I', ccsds_header[12:16].tobytes())[0]
-            C_reboot_count  = struct.unpack('>H', ccsds_header[16:18].tobytes())[0]
-
-
-            # Check if the bytecount or checksum fields were escaped
-            check_escaped = (cur_packet[PACKET_SIZE - 2]!=0)*1
-            count_escaped = (cur_packet[PACKET_SIZE - 4]!=0)*1
-
-            # Calculate the checksum (on the unescaped data):
-            checksum_calc = sum(cur_packet[2:CHECKSUM_INDEX - 1])%256
-
-            # Un-escape the packet (Destructive)
-            esc1_inds = find_sequence(cur_packet,np.array([0x7D, 0x5E])) # [7D, 5E] -> 7E
-            cur_packet[esc1_inds] =  0x7E
-            cur_packet = np.delete(cur_packet, esc1_inds + 1) 
-            esc2_inds = find_sequence(cur_packet,np.array([0x7D, 0x5D])) # [7D, 5D] -> 7D
-            cur_packet = np.delete(cur_packet, esc2_inds + 1)
-
-
-            # Get the new indices of the checksum and bytecount fields
-            packet_length_post_escape = len(cur_packet)
-            checksum_index = packet_length_post_escape + check_escaped - 3
-            bytecount_index= packet_length_post_escape + check_escaped + count_escaped - 6
-     
-            # Decode metadata fields
-            packet_start_index = struct.unpack('>L',cur_packet[PACKET_COUNT_INDEX:(PACKET_COUNT_INDEX + 4)])[0]
-
-            datatype = chr(cur_packet[DATA_TYPE_INDEX]) # works!
-            experiment_number = cur_packet[EXPERIMENT_INDEX]
-            # print(experiment_number)
-            # bytecount = 256*cur_packet[bytecount_index] + cur_packet[bytecount_index + 1]
-            bytecount = struct.unpack('>H', cur_packet[bytecount_index:(bytecount_index + 2)])[0]
-
-            checksum = cur_packet[checksum_index]
-
-            if (checksum - checksum_calc) != 0:
-                checksum_failure_counter += 1
-                logger.warning('invalid checksum at packet # %d -- skipping'%x)
-                continue
-            # Pack the decoded packet into a dictionary, and add it to the list
-            # (maybe there's a nicer data structure for this - but this is probably the most general case)
-            p = dict()
-            p['data'] = np.array(cur_packet[DATA_START_INDEX:(bytecount + DATA_START_INDEX)], dtype='uint8').tolist()
-            p['start_ind'] = packet_start_index
-            p['dtype'] = datatype
-            p['exp_num'] = experiment_number
-            p['bytecount'] = bytecount
-            p['checksum_verify'] = (checksum - checksum_calc)==0
-            p['packet_length'] = packet_length_post_escape
-            p['fname'] = fname
-            p['header_ns'] = C_nanoseconds
-            p['header_epoch_sec'] = C_epoch_seconds
-            p['header_reboots'] = C_reboot_count
-            p['header_timestamp'] = (reference_date + datetime.timedelta(seconds=C_epoch_seconds + C_nanoseconds*1e-9)).timestamp()
-                
-            packets.append(p)
+    while next_start < file_size:
+        window_stop = min(window_start + window_size, file_size)
 
+        # Map just this window of the file, and copy it out. (Dropping the map each
+        # time keeps the pages we've already read from piling up in memory)
+        mm = np.memmap(fpath, dtype=np.uint8, mode='r', offset=window_start, shape=(window_stop - window_start,))
+        data = np.array(mm)
+        del mm
+
+        # Packets which start in this window, but which we haven't already decoded.
+        # (find_packet_starts only returns packets which end within the window, too)
+        p_start_inds = find_packet_starts(data)
+        p_start_inds = p_start_inds[p_start_inds + window_start >= next_start]
+
+        packets, failures = packets_from_frames(data, p_start_inds, fname, first_packet_num=packet_num)
+        logger.debug(f'bytes {window_start} to {window_stop}: {len(packets)} packets')
+        packet_num += len(p_start_inds)
+        total_packets += len(packets)
+        checksum_failure_counter += failures
+
+        if packets:
+            yield packets
+
+        if window_stop == file_size:
+            break
+
+        # Anything starting from here on might not have fit in this window.
+        # Back up far enough to catch its CCSDS header, too.
+        next_start = window_stop - PACKET_SIZE + 1
+        window_start = next_start - CCSDS_HEADER_LEN
+
+    if state is not None:
+        # Any packet starting before this has been decoded; anything after may be incomplete
+        state['byte_offset'] = max(next_start, file_size - PACKET_SIZE + 1)
+        state['count'] = packet_num
 
-        except:
-            logger.warning('exception at packet # %d',x)
-        
     if checksum_failure_counter > 0:
         logger.warning(f'--------------- {checksum_failure_counter} failed checksums ---------------')
 
-    logger.info(f'decoded {len(packets)} packets')
+    logger.info(f'decoded {total_packets} packets')
 
-    return packets
+def find_shard_boundaries(fpath, shard_size=TLM_SHARD_SIZE, start=0, file_size=None):
+    '''
+    Splits a .TLM file into shards of roughly shard_size bytes, for decoding in parallel.
+    Each shard boundary (after the first) is the start of a verified packet: a 0x7E
+    followed by another exactly PACKET_SIZE - 1 bytes later, with no 0x7E in between.
+    Every packet then falls within exactly one shard, and no packet is split between two.
+    inputs:
+        start:          offset of the first shard (e.g., to pick up where a previous read left off)
+        file_size:      offset of the end of the last shard (defaults to the file's current size)
+    outputs:
+        boundaries:     array of file offsets, [start, ..., file_size]; shard k holds the
+                        packets starting in [boundaries[k], boundaries[k + 1])
+    '''
+    if file_size is None:
+        file_size = os.path.getsize(fpath)
+    shard_size = max(int(shard_size), 2*(PACKET_SIZE + CCSDS_HEADER_LEN))
+    search_size = 64*PACKET_SIZE
+
+    boundaries = [start]
+    for nominal in range(start + shard_size, file_size, shard_size):
+        # Search forward from each nominal split point for the next packet start
+        search_start = max(nominal, boundaries[-1] + 1)
+        while search_start < min(nominal + shard_size, file_size):
+            search_stop = min(search_start + search_size + PACKET_SIZE, file_size)
+            mm = np.memmap(fpath, dtype=np.uint8, mode='r', offset=search_start, shape=(search_stop - search_start,))
+            starts = find_packet_starts(np.array(mm))
+            del mm
+            if len(starts):
+                boundaries.append(search_start + int(starts[0]))
+                break
+            search_start += search_size
+    boundaries.append(file_size)
+
+    return np.array(boundaries, dtype=np.int64)
+
+def decode_TLM_shard(task):
+    '''
+    Decode the packets starting within one shard of a .TLM file (a worker task for iter_shards_TLM).
+    inputs:
+        task:           (fpath, fname, shard_start, shard_stop, file_size), from find_shard_boundaries
+    outputs:
+        packets:        a PacketTable of the decoded packets
+        num_starts:     number of packet starts found in the shard
+        no_header, bad_checksum:
+                        the rejected packets, numbered within the shard (see frames_to_table)
+    '''
+    fpath, fname, shard_start, shard_stop, file_size = task
+
+    # Read in the CCSDS header of the first packet, and the closing 0x7E of the last
+    read_start = max(shard_start - CCSDS_HEADER_LEN, 0)
+    read_stop = min(shard_stop + 1, file_size)
+    mm = np.memmap(fpath, dtype=np.uint8, mode='r', offset=read_start, shape=(read_stop - read_start,))
+    data = np.array(mm)
+    del mm
+
+    p_start_inds = find_packet_starts(data)
+    p_start_inds = p_start_inds[(p_start_inds + read_start >= shard_start) & (p_start_inds + read_start < shard_stop)]
+
+    packets, no_header, bad_checksum = frames_to_table(data, p_start_inds, fname)
+    return packets, len(p_start_inds), no_header, bad_checksum
+
+def iter_shards_TLM(data_root, fname, num_workers, shard_size=TLM_SHARD_SIZE, state=None):
+    '''
+    Decodes a .TLM file in parallel: the file is split at packet boundaries into
+    shards of ~shard_size bytes (find_shard_boundaries), which are decoded on a pool
+    of num_workers processes. Yields a PacketTable for each shard, in file order
+    (so, all together, the same packets in the same order as decode_packets_TLM).
+    Only a few shards per worker are in flight at a time, so memory use is bounded
+    by the shard size rather than the file size.
+    (state is an optional ingest state dictionary, as in iter_packets_TLM)
+    '''
+    logger = logging.getLogger(__name__ + '.iter_shards_TLM')
+
+    fpath = os.path.join(data_root, fname)
+    file_size = update_ingest_state(state, fpath)
+    first_start = state['byte_offset'] if state else 0
+    if first_start >= file_size:
+        return
+
+    boundaries = find_shard_boundaries(fpath, shard_size, start=first_start, file_size=file_size)
+    tasks = [(fpath, fname, int(a), int(b), file_size) for a, b in zip(boundaries[:-1], boundaries[1:])]
+    logger.info(f'Decoding file {fname} in {len(tasks)} shards, with {num_workers} workers')
+
+    packet_num = state['count'] if state else 0
+    total_packets = 0
+    checksum_failure_counter = 0
+
+    with multiprocessing.Pool(min(num_workers, len(tasks))) as pool:
+        pending = collections.deque()
+        tasks = iter(tasks)
+        for task in itertools.islice(tasks, 2*num_workers):
+            pending.append(pool.apply_async(decode_TLM_shard, (task,)))
+
+        while pending:
+            packets, num_starts, no_header, bad_checksum = pending.popleft().get()
+            for task in itertools.islice(tasks, 1):
+                pending.append(pool.apply_async(decode_TLM_shard, (task,)))
+
+            log_frame_errors(no_header, bad_checksum, first_packet_num=packet_num)
+            packet_num += num_starts
+            total_packets += len(packets)
+            checksum_failure_counter += len(bad_checksum)
+
+            if packets:
+                yield packets
+
+    if state is not None:
+        state['byte_offset'] = max(first_start, file_size - PACKET_SIZE + 1)
+        state['count'] = packet_num
+
+    logger.info(f"found {packet_num} valid packets")
+    if checksum_failure_counter > 0:
+        logger.warning(f'--------------- {checksum_failure_counter} failed checksums ---------------')
+
+    logger.info(f'decoded {total_packets} packets')
 
 def decode_packets_CSV(data_root, filename):
     '''
     Author:     Austin Sousa
                 austin.sousa@colorado.edu
+    Version:    1.2
+        Date    10.17.2026
+        - Now a wrapper around iter_packets_CSV; returns a PacketTable
+        - Single pass, in chunks of rows: hex payloads are converted in bulk,
+          and packets are decoded with the same vectorized stage as .TLM files
     Version:    1.1
         Date    6.12.2020
         - Modified to detect delimiter and to be more robust against header row weirdness
@@ -506,139 +926,241 @@ def decode_packets_CSV(data_root, filename):
         Parses data from VPM, stored in a .CSV file
         (e.g., the KSat file format)
 
+    '''
+    return PacketTable.concatenate(list(iter_packets_CSV(data_root, filename)))
+
+def iter_packets_CSV(data_root, filename, batch_size=PACKET_BATCH_SIZE, state=None):
+    '''
+    Streaming version of decode_packets_CSV. The file is read in a single pass,
+    CSV_CHUNK_ROWS rows at a time; each chunk is decoded with decode_CSV_rows,
+    and the packets are yielded in PacketTables of batch_size packets.
+    state is an optional ingest state dictionary, for picking up where a previous
+    run left off in a file which is still growing (see new_ingest_state).
+    '''
+    return tally_ingest_state(rebatch(iter_chunks_CSV(data_root, filename, state=state), batch_size), state)
+
+def iter_chunks_CSV(data_root, filename, state=None):
+    '''
+    The chunked reader behind iter_packets_CSV: yields a PacketTable of the
+    packets decoded from each chunk of rows.
     '''
     logger = logging.getLogger('decode_packets_CSV')
 
     fpath = os.path.join(data_root, filename)
-    
-    with open(fpath) as csvfile:
-        # cur = csvfile.read().split('\n')
-        cur = csvfile.readlines()
-
-    # Find the header row
-    for header_index, line in enumerate(cur):
-        if 'TARGET' in line:
-            header_line = line
-            break
-    logger.debug(f'Header index: {header_index}')            
-
-    # Detect the delimeter -- either comma or tab so far
-    delimeters = [',',' ','\t']
-    for delimeter in delimeters:
+    update_ingest_state(state, fpath)
+
+    # Track the byte offset of each line we read, so we know where to pick up next time
+    cursor = dict(offset=0, line_start=0, complete=True)
+    def read_lines(csvfile):
+        for line in csvfile:
+            cursor['line_start'] = cursor['offset']
+            cursor['offset'] += len(line)
+            cursor['complete'] = line.endswith(b'\n')
+            yield line.decode()
+
+    with open(fpath, 'rb') as csvfile:
+        lines = read_lines(csvfile)
+
+        # Find the header row
+        header_line = None
+        for header_index, line in enumerate(lines):
+            if 'TARGET' in line:
+                header_line = line
+                break
+        if state is not None and (header_line is None or not cursor['complete']):
+            # (A file which is still being written might not have got as far as the end of the header row)
+            logger.warning(f'No complete header row in {filename} yet')
+            return
+        if header_line is None:
+            raise ValueError(f'No header row found in {filename}')
+        logger.debug(f'Header index: {header_index}')            
+
+        # Detect the delimeter -- either comma or tab so far
+        delimeters = [',',' ','\t']
+        for delimeter in delimeters:
+
+            counts = header_line.count(delimeter)
+            logger.debug(f'Delimter: " {delimeter}" counts: {counts}')
+
+            if counts>3:
+                logger.info(f'using delimeter "{delimeter}"')
+                break
+
+        header_string = next(csv.reader([header_line], delimiter=delimeter))
+        logger.debug(f'Header string: {header_string}')
+        column_index = {name: index for index, name in enumerate(header_string)}
+
+        # Carry on reading from just past the header row (or from wherever we got to last time).
+        # (Blank rows are skipped, and don't count towards the file index)
+        if state and state['byte_offset'] > cursor['offset']:
+            csvfile.seek(state['byte_offset'] - 1)
+            stopped_mid_row = csvfile.read(1) != b'\n'
+            cursor['offset'] = state['byte_offset']
+            # (If we stopped partway through a row last time, having got its packet, skip the rest of it)
+            if stopped_mid_row:
+                next(lines, None)
+        rows = (row for row in csv.reader(lines, delimiter=delimeter) if row)
+
+        total_packets = 0
+        checksum_failure_counter = 0
+        exception_counter = 0
+        first_index = state['count'] if state else 0
+        while True:
+            chunk = list(itertools.islice(rows, CSV_CHUNK_ROWS))
+            if not chunk:
+                break
+            packets, checksum_failures, exceptions = decode_CSV_rows(chunk, column_index, filename, first_index)
+            first_index += len(chunk)
+            total_packets += len(packets)
+            checksum_failure_counter += checksum_failures
+            exception_counter += exceptions
+
+            if state is not None:
+                state['byte_offset'] = cursor['offset']
+                state['count'] = first_index
+                # If the last line's unfinished (the file's still being written), and didn't
+                # give us a packet, leave it for next time.
+                if not cursor['complete'] and \
+                   (len(packets) == 0 or packets['file_index'][-1] != first_index - 1):
+                    state['byte_offset'] = cursor['line_start']
+                    state['count'] = first_index - 1
+
+            if packets:
+                yield packets
+
+    logger.info(f'decoded {total_packets} packets ({checksum_failure_counter} failed checksums, {exception_counter} exceptions)')
+
+def hex_to_bytes(hex_strings):
+    '''
+    Converts a list of hex strings to bytes, all at once.
+    outputs:
+        raw:        1d uint8 array; the converted strings, end to end
+        lengths:    number of bytes from each string
+        valid:      False for any strings which aren't valid hex (these have length 0)
+    '''
+    num_chars = np.fromiter(map(len, hex_strings), dtype=np.int64, count=len(hex_strings))
 
-        counts = header_line.count(delimeter)
-        logger.debug(f'Delimter: " {delimeter}" counts: {counts}')
+    # Fast path: convert everything in one go. If every string has an even number
+    # of characters, and we get exactly half as many bytes back, then every character
+    # was a hex digit, and the bytes split up evenly between the strings.
+    if not np.any(num_chars%2):
+        try:
+            raw = np.frombuffer(bytes.fromhex(''.join(hex_strings)), dtype=np.uint8)
+            if len(raw)*2 == num_chars.sum():
+                return raw, num_chars//2, np.ones(len(hex_strings), dtype=bool)
+        except ValueError:
+            pass
+
+    # Otherwise, one at a time
+    segments = []
+    valid = np.ones(len(hex_strings), dtype=bool)
+    for i, h in enumerate(hex_strings):
+        try:
+            segments.append(bytes.fromhex(h))
+        except ValueError:
+            segments.append(b'')
+            valid[i] = False
+    raw = np.frombuffer(b''.join(segments), dtype=np.uint8)
+    lengths = np.fromiter(map(len, segments), dtype=np.int64, count=len(segments))
+    return raw, lengths, valid
+
+def decode_CSV_rows(rows, column_index, fname, first_index=0):
+    '''
+    Vectorized decoder for a chunk of rows from a KSat-style CSV file.
+    The hex payloads are converted to bytes in bulk, the packets are located within
+    each row, and then un-escaped, checksummed and decoded together by decode_frame_stack
+    (the same as for .TLM files).
+    inputs:
+        rows:           list of CSV rows (lists of strings)
+        column_index:   dictionary of column name -> index, from the header row
+        fname:          source file name, to tag each packet with
+        first_index:    file index of rows[0]
+    outputs:
+        packets:            a PacketTable of the decoded packets
+        checksum_failures:  number of packets with failed checksums
+        exceptions:         number of rows we couldn't get a packet out of
+    '''
+    logger = logging.getLogger('decode_packets_CSV')
 
-        # header_string = str(header_line).split()
-        
-        if counts>3:
-            logger.info(f'using delimeter "{delimeter}"')
-            header_string = header_line.split(delimeter)
-            logger.debug(f'Header string: {header_string}')
-            break
-    
+    i_target, i_packet, i_time, i_data = [column_index.get(k) for k in ['TARGET', 'PACKET', 'UTC_TIME', 'DYNAMIC_DATA']]
 
-    # Packet indices and lengths (set in payload firmware)
-    PACKET_SIZE = 512
-    DATA_SEGMENT_LENGTH = PACKET_SIZE - 8
-    PACKET_COUNT_INDEX = 1
-    DATA_TYPE_INDEX = 5
-    EXPERIMENT_INDEX = 6
-    DATA_START_INDEX = 7
-    DATA_END_INDEX = DATA_START_INDEX + DATA_SEGMENT_LENGTH
-    CHECKSUM_INDEX = PACKET_SIZE - 2
-
-    packets = [];
+    # Select the payload data rows
+    file_index = []
+    hex_strings = []
+    timestamps = []
+    for ind, row in enumerate(rows, first_index):
+        try:
+            if ('VPM' in row[i_target]) and row[i_packet] == 'PAYLOAD_INTERFACE_RECEIVE_RAW_PAYLOAD_DATA':
+                hex_strings.append(row[i_data])
+                timestamps.append(row[i_time])
+                file_index.append(ind)
+        except:
+            logger.info(f'skipped CSV line {ind}: {row}')
+    file_index = np.array(file_index, dtype=np.int64)
+
+    raw, lengths, valid = hex_to_bytes(hex_strings)
+    for ind in file_index[~valid]:
+        logger.info(f'skipped CSV line {ind}: {rows[ind - first_index]}')
+
+    # Locate each packet: from the first 0x7E in the row, to the second one
+    row_starts = np.cumsum(lengths) - lengths
+    flags = np.flatnonzero(raw == 0x7E)
+    flag_rows = np.searchsorted(row_starts, flags, side='right') - 1
+    first_flag = np.searchsorted(flag_rows, np.arange(len(lengths)), side='left')
+    num_flags = np.searchsorted(flag_rows, np.arange(len(lengths)), side='right') - first_flag
+
+    has_packet = valid & (num_flags >= 2)
+    p_starts = np.zeros(len(lengths), dtype=np.int64)
+    p_lengths = np.zeros(len(lengths), dtype=np.int64)
+    p_starts[has_packet] = flags[first_flag[has_packet]]
+    p_lengths[has_packet] = flags[first_flag[has_packet] + 1] - p_starts[has_packet] + 1
+
+    # Packets must be long enough to hold the checksum and bytecount fields
+    has_packet &= (p_lengths >= PACKET_SIZE - 1)
+    exception_counter = int(np.sum(valid & ~has_packet))
+    for ind in file_index[valid & ~has_packet]:
+        logger.warning('exception at packet # %d',ind)
+
+    # Decode each group of same-length packets (normally all of them are PACKET_SIZE long)
+    tables = []
     checksum_failure_counter = 0
-    exception_counter = 0
-
-    with open(fpath) as csvfile:
-        # Skip up to the header row:
-        for i in range(header_index):
-            csvfile.readline()
-        
-        # Read the remaining entries into dicts
-        reader = csv.DictReader(csvfile, delimiter=delimeter)
-        
-        # Parse the entry list, grab data and timestamp
-        timestamps = []
-        raw_data = []
-        for ind, row in enumerate(reader):
-            try:
-                if ('VPM' in row['TARGET']) and row['PACKET'] == 'PAYLOAD_INTERFACE_RECEIVE_RAW_PAYLOAD_DATA':
-                    # timestamps.append(row['UTC_TIME'])
-                    # raw_data.append(bytes.fromhex(row['DYNAMIC_DATA']))
-                    timestamp = row['UTC_TIME']
-                    p_data = bytes.fromhex(row['DYNAMIC_DATA'])
-                    
-                    # if ind%100==0:
-                    #     logger.debug(f'ind: {ind}, mem: {psutil.virtual_memory()}')
-
-                    # Decode the current packet
-                    try:
-                        cur_packet = np.array([int(x) for x in p_data], dtype='uint8')
-                        p_inds = np.array(sorted(np.where(cur_packet==0x7E)))
-                        cur_packet = np.copy(cur_packet[p_inds[0][0]:(p_inds[0][1] + 1)])
-
-                        # Check if the bytecount or checksum fields were escaped
-                        check_escaped = (cur_packet[PACKET_SIZE - 2]!=0)*1
-                        count_escaped = (cur_packet[PACKET_SIZE - 4]!=0)*1
-
-                        # Calculate the checksum (on the unescaped data):
-                        checksum_calc = sum(cur_packet[2:CHECKSUM_INDEX - 1])%256
-
-                        # Un-escape the packet (Destructive)
-                        esc1_inds = find_sequence(cur_packet,np.array([0x7D, 0x5E])) # [7D, 5E] -> 7E
-                        cur_packet[esc1_inds] =  0x7E
-                        cur_packet = np.delete(cur_packet, esc1_inds + 1) 
-                        esc2_inds = find_sequence(cur_packet,np.array([0x7D, 0x5D])) # [7D, 5D] -> 7D
-                        cur_packet = np.delete(cur_packet, esc2_inds + 1)
-
-
-                        # Get the new indices of the checksum and bytecount fields
-                        packet_length_post_escape = len(cur_packet)
-                        checksum_index = packet_length_post_escape + check_escaped - 3
-                        bytecount_index= packet_length_post_escape + check_escaped + count_escaped - 6
-
-                        # Decode metadata fields
-                        packet_start_index = struct.unpack('>L',cur_packet[PACKET_COUNT_INDEX:(PACKET_COUNT_INDEX + 4)])[0]
-
-                        datatype = chr(cur_packet[DATA_TYPE_INDEX]) # works!
-                        experiment_number = cur_packet[EXPERIMENT_INDEX]
-                        bytecount = struct.unpack('>H', cur_packet[bytecount_index:(bytecount_index + 2)])[0]
-                        checksum = cur_packet[checksum_index]
-
-                        if (checksum - checksum_calc) != 0:
-                            checksum_failure_counter += 1
-                            logger.warning('invalid checksum at packet # %d -- skipping'%ind)
-                            continue
-
-                        # Pack the decoded packet into a dictionary, and add it to the list
-                        # (maybe there's a nicer data structure for this - but this is probably the most general case)
-                        p = dict()
-                        p['data'] = np.array(cur_packet[DATA_START_INDEX:(bytecount + DATA_START_INDEX)], dtype='uint8').tolist()
-                        p['start_ind'] = packet_start_index
-                        p['dtype'] = datatype
-                        p['exp_num'] = experiment_number
-                        p['bytecount'] = bytecount
-                        p['checksum_verify'] = (checksum - checksum_calc)==0
-                        p['packet_length'] = packet_length_post_escape
-                        p['fname'] = filename
-                        p['header_timestamp'] = datetime.datetime.fromisoformat(timestamp[0:-1]).replace(tzinfo=datetime.timezone.utc).timestamp()
-                        p['file_index'] = ind # Order of arrival in file 
-                        packets.append(p)
-                    except:
-                        exception_counter += 1
-                        logger.warning('exception at packet # %d',ind)
-            except:
-                logger.info(f'skipped CSV line {ind}: {row}')
-        
-    # if checksum_failure_counter > 0:
-        # logger.warning(f'--------------- {checksum_failure_counter} failed checksums ---------------')
-
-    logger.info(f'decoded {len(packets)} packets ({checksum_failure_counter} failed checksums, {exception_counter} exceptions)')
-
-    return packets
+    for p_length in np.unique(p_lengths[has_packet]):
+        group = np.flatnonzero(has_packet & (p_lengths == p_length))
+        windows = np.lib.stride_tricks.as_strided(raw, shape=(len(raw) - p_length + 1, p_length),
+                                                  strides=(raw.strides[0], raw.strides[0]), writeable=False)
+        frames = windows[p_starts[group]]
+        cols = decode_frame_stack(frames)
+
+        for ind in file_index[group[~cols['checksum_verify']]]:
+            checksum_failure_counter += 1
+            logger.warning('invalid checksum at packet # %d -- skipping'%ind)
+        good = np.flatnonzero(cols['checksum_verify'])
+
+        header_timestamp, time_valid = iso_to_unix([timestamps[i][0:-1] for i in group[good]])
+        for ind in file_index[group[good[~time_valid]]]:
+            exception_counter += 1
+            logger.warning('exception at packet # %d',ind)
+        good = good[time_valid]
+
+        payload, bounds = pack_payloads(cols['payload'], cols['payload_offset'][good], cols['payload_length'][good])
+
+        columns = dict()
+        columns['start_ind'] = cols['start_ind'][good].astype(np.int64)
+        columns['dtype'] = cols['dtype'][good].view('S1').astype('U1')
+        columns['exp_num'] = cols['exp_num'][good]
+        columns['bytecount'] = cols['bytecount'][good]
+        columns['checksum_verify'] = cols['checksum_verify'][good]
+        columns['packet_length'] = cols['packet_length'][good].astype(np.int64)
+        columns['fname'] = np.full(len(good), fname, dtype=object)
+        columns['header_timestamp'] = header_timestamp[time_valid]
+        columns['file_index'] = file_index[group[good]] # Order of arrival in file
+        tables.append(PacketTable(columns, payload, bounds))
+
+    packets = PacketTable.concatenate(tables)
+    if len(tables) > 1:
+        packets = packets.sort('file_index')
+
+    return packets, checksum_failure_counter, exception_counter
 
 def remove_trailing_nans(arr1d):
     ''' Trims off the trailing NaNs of a vector.'''
@@ -703,7 +1225,7 @@ def decode_burst_data_by_experiment_number(packets, burst_cmd = None, burst_puls
     logger = logging.getLogger(__name__+'.decode_burst_data_by_experiment_number')
 
     # Select burst packets
-    burst_packets = list(filter(lambda packet: packet['dtype'] in ['E','B','G'], packets))
+    burst_packets = select_packets(packets, ['E','B','G'])
     
     # Get all unique experiment numbers for this set of packets 
     # (chances are real good that we'll only have 1 or 2 unique numbers)
@@ -754,7 +1276,7 @@ def decode_burst_data_in_range(packets, ta, tb, burst_cmd = None, burst_pulses =
         Use this in the event that we want to decode an incomplete burst.
     '''
     logger = logging.getLogger(__name__ +'.decode_burst_data_in_range')
-    burst_packets = list(filter(lambda packet: packet['dtype'] in ['E','B','G'], packets))
+    burst_packets = select_packets(packets, ['E','B','G'])
     burst_packets = sorted(burst_packets, key = lambda p: p['header_timestamp'])
     header_timestamps = ([p['header_timestamp'] for p in burst_packets])
 
@@ -811,7 +1333,7 @@ def decode_burst_data_between_status_packets(packets):
 
     I_packets     = list(filter(lambda p: (p['dtype'] == 'I' and chr(p['data'][3])=='B'), packets))
     I_packets     = sorted(I_packets, key = lambda p: p['header_timestamp'])
-    burst_packets = list(filter(lambda packet: packet['dtype'] in ['E','B','G'], packets))
+    burst_packets = select_packets(packets, ['E','B','G'])
     burst_packets = sorted(burst_packets, key = lambda p: p['header_timestamp'])
     # stats = decode_status(I_packets)
 
@@ -908,7 +1430,7 @@ def decode_burst_data_by_trailing_status_packet(packets):
 
     I_packets     = list(filter(lambda p: (p['dtype'] == 'I' and chr(p['data'][3])=='B'), packets))
     I_packets     = sorted(I_packets, key = lambda p: p['header_timestamp'])
-    burst_packets = list(filter(lambda packet: packet['dtype'] in ['E','B','G'], packets))
+    burst_packets = select_packets(packets, ['E','B','G'])
     burst_packets = sorted(burst_packets, key = lambda p: p['header_timestamp'])
     # stats = decode_status(I_packets)
 
@@ -999,9 +1521,9 @@ def process_burst(packets, burst_config=None):
     logger = logging.getLogger(__name__ +'.process_burst')
 
     # Sort the packets by data stream:
-    E_packets = list(filter(lambda packet: packet['dtype'] == 'E', packets))
-    B_packets = list(filter(lambda packet: packet['dtype'] == 'B', packets))
-    G_packets = list(filter(lambda packet: packet['dtype'] == 'G', packets))
+    E_packets = select_packets(packets, ['E'])
+    B_packets = select_packets(packets, ['B'])
+    G_packets = select_packets(packets, ['G'])
 
 
 
@@ -1132,10 +1654,8 @@ def decode_GPS_data(data):
     logger = logging.getLogger(__name__ +'.decode_GPS_data')
 
     # GPS time is delivered as: weeks from reference date, plus seconds into the week.
-    leap_seconds = 18  # GPS time does not account for leap seconds; as of ~2019, GPS leads UTC by 18 seconds.
-    reference_date = datetime.datetime(1980,1,6,0,0, tzinfo=datetime.timezone.utc) - datetime.timedelta(seconds=leap_seconds)
-    pos_inds = find_sequence(data,np.array([0xAA, 0x44, 0x12, 0x1C, 0x2A]))
-    vel_inds = find_sequence(data,np.array([0xAA, 0x44, 0x12, 0x1C, 0x63]))
+    # (converted with gps_week_to_unix, which accounts for leap seconds)
+    pos_inds, vel_inds = find_sequences(data, [BESTPOS_SYNC, BESTVEL_SYNC])
 
     if len(pos_inds)==0 and len(vel_inds)==0:
         logger.debug("No GPS logs found")
@@ -1249,16 +1769,108 @@ def decode_GPS_data(data):
         	except:
         		logger.warning(f'exception decoding velocity message {i}')
         # timestamp
-        out['timestamp'] = (reference_date + datetime.timedelta(weeks=out['weeknum']) + \
-                      datetime.timedelta(seconds=out['sec_offset'])).timestamp()
+        out['timestamp'] = float(gps_week_to_unix(out['weeknum'], out['sec_offset']))
         outs.append(out)
 
     return outs
 
+def decode_survey_GPS(blocks):
+    '''
+    Decodes the GPS blocks of many survey products at once.
+
+    In survey mode, each product's GPS block holds exactly one BESTPOS log and one
+    BESTVEL log, at fixed offsets -- so rather than searching each block for the sync
+    words, and unpacking the fields one at a time, we read every field of every block
+    through a structured dtype (SURVEY_GPS_DTYPE) in one go. Any block which doesn't
+    look like that (a log missing, or misplaced, or an extra sync word) goes through
+    decode_GPS_data instead, one at a time.
+
+    inputs:
+        blocks: (num_products x 180) uint8 array; the GPS block of each product
+    outputs:
+        A dictionary of GPS columns (as in a SurveyFrame), one entry per product, with
+        the same fields decode_GPS_data gives (None where a product hasn't got one)
+    '''
+    logger = logging.getLogger(__name__ + '.decode_survey_GPS')
+
+    blocks = np.ascontiguousarray(blocks, dtype=np.uint8)
+    num_blocks = len(blocks)
+    if num_blocks == 0:
+        return dict()
+
+    # Well-formed blocks have one BESTPOS sync, at the start, and one BESTVEL sync, right after it
+    well_formed = np.zeros(num_blocks, dtype=bool)
+    if blocks.shape[1] == SURVEY_GPS_DTYPE.itemsize:
+        (pos_rows, pos_offsets), (vel_rows, vel_offsets) = find_sequences_batch(blocks, [BESTPOS_SYNC, BESTVEL_SYNC])
+        well_formed = (np.bincount(pos_rows, minlength=num_blocks) == 1) & \
+                      (np.bincount(vel_rows, minlength=num_blocks) == 1)
+        well_formed[pos_rows[pos_offsets != 0]] = False
+        well_formed[vel_rows[vel_offsets != BESTPOS_DTYPE.itemsize]] = False
+
+    logs = blocks[well_formed].view(SURVEY_GPS_DTYPE).ravel()
+    pos, vel = logs['pos'], logs['vel']
+
+    # (The time fields are in both logs, and *should* be the same -- we go by BESTPOS)
+    for k in range(np.count_nonzero(pos['header']['week'] != vel['header']['week'])):
+        logger.warning("position / velocity timestamp mismatch")
+    weeknum = pos['header']['week'].astype(np.float64)
+    sec_offset = pos['header']['ms']/1000.
+
+    columns = {
+        'lat': pos['lat'].astype(np.float64),
+        'lon': pos['lon'].astype(np.float64),
+        'alt': pos['hgt'].astype(np.float64),
+        'tracked_sats': pos['tracked_sats'].astype(np.int64),
+        'used_sats': pos['used_sats'].astype(np.int64),
+        'time_status': pos['header']['time_status'].astype(np.int64),
+        'receiver_status': pos['header']['receiver_status'].astype(np.int64),
+        'weeknum': weeknum,
+        'sec_offset': sec_offset,
+        'solution_status': pos['sol_status'].astype(np.int64),
+        'solution_type': pos['pos_type'].astype(np.int64),
+        'horiz_speed': vel['hor_spd'].astype(np.float64),
+        'vert_speed': vel['vert_spd'].astype(np.float64),
+        'ground_track': vel['trk_gnd'].astype(np.float64),
+        'latency': vel['latency'].astype(np.float64),
+        'timestamp': gps_week_to_unix(weeknum, sec_offset),
+    }
+    if np.all(well_formed):
+        return columns
+
+    # Everything else, the long way
+    others = np.flatnonzero(~well_formed)
+    entries = []
+    for i in others:
+        try:
+            G = decode_GPS_data(blocks[i])
+        except:
+            logger.warning('Failed to decode survey GPS data')
+            G = []
+        entries.append(G[0] if G else dict())
+    if len(others) == num_blocks:
+        return gps_columns(entries)
+
+    columns = concatenate_columns([columns, gps_columns(entries)], [len(logs), len(others)])
+    order = np.argsort(np.concatenate([np.flatnonzero(well_formed), others]), kind='stable')
+    return {k: v[order] for k, v in columns.items()}
+
 def decode_survey_data(packets, separation_time = 4.5):
     '''
     Author:     Austin Sousa
                 austin.sousa@colorado.edu
+    Version:    1.3
+        Date:   10.17.2026
+    Description:
+        - Returns the survey products as a SurveyFrame, rather than a list of dictionaries.
+        - Decodes the GPS blocks of all the products at once (see decode_survey_GPS).
+    Version:    1.2
+        Date:   10.17.2026
+    Description:
+        - Reassembles every survey product in one pass: the packets are sorted by
+          (experiment number, arrival time) once, split into products, and scattered
+          into a single 2d buffer, and the E, B and GPS fields are gathered out of all
+          the complete products at once -- rather than re-scanning the whole list of
+          packets for each experiment number.
     Version:    1.1
         Date:   2.25.2020
     Description:
@@ -1271,41 +1883,44 @@ def decode_survey_data(packets, separation_time = 4.5):
 
     inputs: 
         packets: A list of "packet" dictionaries, as returned from decode_packets.py
+                 (or a PacketTable)
         separation_time: The maximum time, in seconds, between packet arrivals
                 for which we'll group by experiment number.
     outputs:
-        A list of dictionaries:
-        Each dictionary is a single survey column, and contains the following fields:
+        A SurveyFrame (which also behaves like a list of dictionaries):
+        Each entry is a single survey column, and contains the following fields:
             E_data: The electric field data, corresponding to averaged, log-scaled
                     magnitudes of the onboard FFT
             B_data: The magnetic field data, corresponding to averaged, log-scaled
                     magnitudes of the onboard FFT
-            GPS:    A dictionary of decoded GPS data, corresponding to the end of
+            GPS:    The decoded GPS data, corresponding to the end of
                     the current survey product
+            header_timestamp, exp_num
+        And the packets of any incomplete products (the same kind of container as packets)
     '''
 
     # leap_seconds = 18  # GPS time does not account for leap seconds; as of ~2019, GPS leads UTC by 18 seconds.
     # reference_date = datetime.datetime(1980,1,6,0,0, tzinfo=datetime.timezone.utc) - datetime.timedelta(seconds=leap_seconds)
     # logger = logging.getLogger(__name__ +'.decode_survey_data')
     logger = logging.getLogger(__name__ +'.decode_survey_data')
-    S_packets = list(filter(lambda packet: packet['dtype'] == 'S', packets))
-    # Sort by arrival time
-    # S_packets = sorted(S_packets, key=lambda p: p['header_epoch_sec'] + p['header_ns']*1e-9)
-    S_packets = sorted(S_packets, key=lambda p: p['header_timestamp'])
+    S_packets = select_packets(packets, ['S'])
 
     if len(S_packets) == 0:
         logger.info("no survey data present!")
-        return [], []
+        return SurveyFrame(), []
+
+    S_table = PacketTable.from_packets(S_packets)
+    if isinstance(S_packets, PacketTable):
+        exp_nums = np.array(S_table['exp_num'].tolist())
+        timestamps = S_table['header_timestamp'].tolist()
+    else:
+        exp_nums = np.array([p['exp_num'] for p in S_packets])
+        timestamps = [p['header_timestamp'] for p in S_packets]
+    arrival_times = np.array(timestamps, dtype=np.float64)
 
     # These will roll over every 256 survey columns... need to deal with that
     # in this search. For now, just assume they're unique
-
-    
-    # ax.plot(np.diff([x['exp_num'] for x in S_packets]),'.')
-    # plt.show()
-    e_nums = np.unique([x['exp_num'] for x in S_packets])
-
-    logging.debug(f'available survey experiment numbers: {e_nums}')
+    logging.debug(f'available survey experiment numbers: {np.unique(exp_nums)}')
 
     survey_packet_length = 1212
 
@@ -1319,89 +1934,123 @@ def decode_survey_data(packets, separation_time = 4.5):
     bbr_index_noLCS = np.array([np.arange(4) + 4 + k*8 for k in range(128)]).ravel().astype('int')
     gps_index += bbr_index_noLCS[-1] + 1
 
-    # Gather and reassemble the 3-ish survey (system) packets into a single survey (product) packet
-    S_data = []
-    complete_surveys = []
-    unused = []
-    # separation_time = 4.5 # 0.5  # seconds
-    for e_num in e_nums:
-
-        # Reassemble into a single survey data packet
-        cur_packets   = list(filter(lambda packet: packet['exp_num'] == e_num, S_packets))
-
-        # Divide this list up into segments with nearby arrival times:
-        # arrival_times = [p['header_epoch_sec'] + p['header_ns']*1e-9 for p in cur_packets]
-        arrival_times = [p['header_timestamp'] for p in cur_packets]
-
-        # Find any significant time differences
-        splits = np.where(np.diff(arrival_times) > separation_time)[0] + 1  
-        # append the first and last indexes to the list, to give us pairs of indexes to slice around
-        splits = np.insert(np.append(splits,[len(cur_packets)]),0,0) 
-
-        # Iterate over sub-lists of packets, as divided by splits:
-        for s1,s2 in zip(splits[0:-1],splits[1:]):
-            try:
-                # Start with all nans
-                cur_data = np.zeros(survey_packet_length)*np.nan
-                # Insert each packets' payload
-                for p in cur_packets[s1:s2]:
-                    cur_data[p['start_ind']:(p['start_ind'] + p['bytecount'])] = p['data']
-                # Did we get a full packet? 
-                if np.sum(np.isnan(cur_data)) == 0:
-                    # Complete packet!
-                    
-                    E_data = cur_data[bbr_index_noLCS]
-                    B_data = cur_data[bbr_index_noLCS + 4]
-                    G_data = cur_data[gps_index].astype('uint8')
-
-                    d = dict()
-                    try:
-                        G = decode_GPS_data(G_data)
-                        d['GPS'] = G
-                    except:
-                        logger.warning('Failed to decode survey GPS data')
-
-                    d['E_data'] = E_data.astype('uint8')
-                    d['B_data'] = B_data.astype('uint8')
-                    # d['header_epoch_sec'] = cur_packets[s1]['header_epoch_sec']
-                    d['header_timestamp'] = cur_packets[s1]['header_timestamp']
-                    d['exp_num'] = e_num
-                    S_data.append(d)
-
-                else:
-                    # If not, put the unused packets aside, so we can possibly
-                    # combine with packets from other files
-                    unused.extend(cur_packets[s1:s2])
-            except:
-                logging.warning(f'bad survey packet between {s1} and {s2}')
+    # Sort by arrival time, then by experiment number (keeping arrival order within each)
+    order = np.argsort(arrival_times, kind='stable')
+    order = order[np.argsort(exp_nums[order], kind='stable')]
+
+    # Gather and reassemble the 3-ish survey (system) packets into a single survey (product) packet:
+    # each run of packets with the same experiment number, without a gap of more than
+    # separation_time between arrivals, is one product
+    sorted_exp_nums = exp_nums[order]
+    new_product = np.ones(len(order), dtype=bool)
+    new_product[1:] = (sorted_exp_nums[1:] != sorted_exp_nums[:-1]) | (np.diff(arrival_times[order]) > separation_time)
+    product = np.cumsum(new_product) - 1
+    first_packets = order[new_product]
+    num_products = len(first_packets)
+
+    # A packet which doesn't fit where it says it goes spoils its whole product
+    starts = S_table['start_ind'][order].astype(np.int64)
+    ends = starts + S_table['bytecount'][order].astype(np.int64)
+    lengths = S_table.lengths[order]
+    fits = (starts >= 0) & (lengths == np.clip(ends, 0, survey_packet_length) - np.clip(starts, 0, survey_packet_length))
+    bad = np.zeros(num_products, dtype=bool)
+    bad[product[~fits]] = True
+    for k in np.flatnonzero(bad):
+        logging.warning(f'bad survey packet in experiment {exp_nums[first_packets[k]]}, at {timestamps[first_packets[k]]}')
+
+    use = ~bad[product]
+    used = S_table.take(order[use])
+    used_products, used_starts, used_lengths = product[use], starts[use], lengths[use]
+
+    # Find the products with packets which overlap each other
+    by_start = np.lexsort((used_starts, used_products))
+    lo = (used_products*2*survey_packet_length + used_starts)[by_start]
+    hi = lo + used_lengths[by_start]
+    overlapping = np.zeros(num_products, dtype=bool)
+    overlapping[used_products[by_start][1:][lo[1:] < np.maximum.accumulate(hi)[:-1]]] = True
+    one_pass = ~overlapping[used_products]
+
+    # Scatter the payloads into one buffer (num_products x survey_packet_length) all at once,
+    # marking which bytes we've got...
+    products = np.zeros((num_products, survey_packet_length), dtype=np.uint8)
+    filled = np.zeros((num_products, survey_packet_length), dtype=bool)
+    offsets = np.arange(used.bounds[-1]) - np.repeat(used.bounds[:-1], used_lengths)
+    flat_index = np.repeat(used_products*survey_packet_length + used_starts, used_lengths) + offsets
+    in_one_pass = np.repeat(one_pass, used_lengths)
+    products.flat[flat_index[in_one_pass]] = used.payload[in_one_pass]
+    filled.flat[flat_index[in_one_pass]] = True
+    # ...except where packets overlap: those go in one at a time, in arrival order, so the later one wins
+    for i in np.flatnonzero(~one_pass):
+        a, b = used_starts[i], used_starts[i] + used_lengths[i]
+        products[used_products[i], a:b] = used.data(i)
+        filled[used_products[i], a:b] = True
+    # Did we get a full packet?
+    complete = np.all(filled, axis=1) & ~bad
+
+    # Pick the fields out of all the complete products at once
+    complete_products = products[complete]
+    E_data = complete_products[:, bbr_index_noLCS]
+    B_data = complete_products[:, bbr_index_noLCS + 4]
+    G_data = complete_products[:, gps_index]
+
+    complete_first = first_packets[complete]
+    S_data = SurveyFrame(E_data, B_data,
+                         {'header_timestamp': arrival_times[complete_first],
+                          'exp_num': exp_nums[complete_first].astype(np.int64)},
+                         decode_survey_GPS(G_data))
+
+    # Put the packets of incomplete products aside, so we can possibly
+    # combine with packets from other files
+    unused_packets = order[~complete[product] & ~bad[product]]
+    if isinstance(S_packets, PacketTable):
+        unused = S_table.take(unused_packets)
+    else:
+        unused = [S_packets[i] for i in unused_packets]
+
     # Send it
     logger.info(f'Recovered {len(S_data)} survey products, leaving {len(unused)} unused packets')
     return S_data, unused
 
 
+def entry_digest(el, h=None):
+    ''' A digest of an entry (a dict, list, numpy array or plain value, nested any way),
+        which is the same for equal entries -- dicts are taken in sorted key order, and arrays
+        by value -- and the same from run to run (unlike Python's hash of a string). '''
+    top = h is None
+    if top:
+        h = hashlib.blake2b(digest_size=16)
+
+    if isinstance(el, dict):
+        h.update(b'{')
+        for k in sorted(el, key=str):
+            h.update(repr(k).encode() + b':')
+            entry_digest(el[k], h)
+        h.update(b'}')
+    elif isinstance(el, (list, tuple)):
+        h.update(b'[')
+        for v in el:
+            entry_digest(v, h)
+        h.update(b']')
+    elif isinstance(el, np.ndarray):
+        if el.dtype == object:
+            entry_digest(el.tolist(), h)
+        else:
+            h.update(f'array{el.dtype.str}{el.shape}'.encode())
+            h.update(np.ascontiguousarray(el).tobytes())
+    elif isinstance(el, np.generic):
+        entry_digest(el.item(), h)
+    else:
+        h.update(repr(el).encode() + b',')
+
+    if top:
+        return h.digest()
+
+
 def unique_entries(in_list):
-    # Python doesn't like to compare complex entries (dicts containing dicts, numpy arrays)
-    # So we're explicitly generating a hash of the entry, by casting the whole thing to a string.
-    # It's slow but probably works!
-    
-    # 1. compute hash
-    for el in in_list:
-        # Here's a quick and dirty hash function. Might fail on nested dictionaries,
-        # since we're only sorting the top-level dictionary (e.g., the GPS entries might
-        # come up in a different order)
-        el['id'] = hash(str(sorted(el.items())))
-    
-    # 2. build a temporary dictionary of values, with hash as key
-    temp = list({v['id']: v for v in in_list}.values())
-    
-    # 3. ditch the hash, for cleanliness:
-    #    - Pop from in_list, not temp, since the elements themselves
-    #      are identified by reference. If we pop from temp, we'll leave
-    #      'id' elements in the duplicate entries.
-    for el in in_list:
-        el.pop('id')
-    
-    return temp
+    ''' Remove duplicate entries (dicts containing dicts, lists, numpy arrays...) from a list.
+        Where there are duplicates, the entry is kept at the position of the first one (and the
+        last one wins, as before). The entries themselves aren't modified. '''
+    return list({entry_digest(v): v for v in in_list}.values())
 
 
 def deep_compare(d1, d2):
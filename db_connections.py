@@ -0,0 +1,161 @@
+import sqlite3
+from sqlite3 import Error
+
+import os
+import logging
+import atexit
+import urllib.parse
+import contextlib
+
+# Rather than opening a new connection for every query (and, mostly, never closing them),
+# the helpers here share one connection per database, per process -- a regular
+# connection for writers, and a read-only one for readers -- through get_connection.
+# Each is set up once (pragmas below), and keeps sqlite3's cache of prepared statements
+# for the repeated queries. The db arguments of the helpers can be either a path
+# or an open connection.
+
+# Set on every shared connection: memory-map the database file for reads, and a
+# bigger page cache than the default (2 MB).
+CONNECTION_PRAGMAS = [
+    'PRAGMA mmap_size=268435456',       # (256 MB)
+    'PRAGMA cache_size=-65536',         # (in kB -- 64 MB)
+]
+# Number of prepared statements each connection keeps around
+CACHED_STATEMENTS = 256
+# Seconds to wait for a lock held by another process (e.g., process_packets, in the middle
+# of writing a file) before giving up with "database is locked"
+BUSY_TIMEOUT = 60.0
+
+# (process ID, absolute path, read-only) -> Connection
+_connections = dict()
+
+def get_connection(db, readonly=False):
+    '''
+    The shared connection to the database at path db, for this process (opening it if need be).
+    With readonly=True, a read-only connection -- which can't take a write lock, so it never
+    holds up the writer. (If the database doesn't exist yet, or can't be opened read-only,
+    we fall back to a regular connection.) If db is already a connection, it's returned as-is.
+    '''
+    logger = logging.getLogger('get_connection')
+
+    if isinstance(db, sqlite3.Connection):
+        return db
+
+    # (Keyed by process, so workers forked from this process don't share its connections)
+    key = (os.getpid(), os.path.abspath(db), readonly)
+    conn = _connections.get(key)
+    if conn is not None:
+        try:
+            conn.total_changes
+            return conn
+        except sqlite3.ProgrammingError:
+            # (closed by the caller; open a new one)
+            conn = None
+
+    if readonly and os.path.exists(db):
+        uri = f'file:{urllib.parse.quote(os.path.abspath(db))}?mode=ro'
+        try:
+            conn = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS)
+        except Error as e:
+            logger.warning(f'cannot open {db} read-only ({e}); opening it read-write')
+    if conn is None:
+        conn = create_connection(db)
+        if conn is None:
+            return None
+
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    logger.debug(f"opened {'read-only ' if readonly else ''}connection to {db}")
+
+    _connections[key] = conn
+    return conn
+
+def close_connections(db=None):
+    '''
+    Close this process's shared connections to the database at path db
+    (or to every database, if db is None). Done automatically on exit.
+    '''
+    pid = os.getpid()
+    path = os.path.abspath(db) if db is not None else None
+    for key in list(_connections.keys()):
+        if key[0] == pid and (path is None or key[1] == path):
+            _connections.pop(key).close()
+
+atexit.register(close_connections)
+
+@contextlib.contextmanager
+def read_snapshot(database):
+    '''
+    Read from a consistent snapshot of the database at path database: within the with block,
+    every query on the shared read-only connection (i.e., the readers in db_handlers) sees the
+    database as it was at the start, whatever's written in the meantime. (It's a read
+    transaction, so -- in WAL mode -- it doesn't hold up the writer; but the write-ahead log
+    can't be checkpointed past it, so keep it short.) Yields the connection. Nests.
+    '''
+    conn = get_connection(database, readonly=True)
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute('BEGIN')
+    try:
+        # (The snapshot is taken at the first read)
+        conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        yield conn
+    finally:
+        conn.commit()
+
+def create_connection(db_file):
+    """ create a database connection to the SQLite database
+        specified by db_file
+    :param db_file: database file
+    :return: Connection object or None
+    """
+    logger = logging.getLogger('create_connection')
+
+    if not os.path.exists(db_file):
+        logger.info('no db exists! creating')
+    conn = None
+    try:
+        conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS)
+        return conn
+    except Error as e:
+        logger.error(e)
+
+    return conn
+
+
+def create_table(conn, create_table_sql):
+    """ create a table from the create_table_sql statement
+    :param conn: Connection object
+    :param create_table_sql: a CREATE TABLE statement
+    :return:
+    """
+    logger = logging.getLogger('create_table')
+
+    try:
+        c = conn.cursor()
+        c.execute(create_table_sql)
+    except Error as e:
+        logger.error(e)
+
+def table_exists(conn, table_name):
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+    return cur.fetchone() is not None
+
+def database_path(conn):
+    ''' The file behind a connection '''
+    for r in conn.execute('PRAGMA database_list'):
+        if r[1] == 'main':
+            return r[2]
+
+def find_hashes(conn, table, hashes):
+    ''' Which of hashes are in table already (a list) '''
+    hashes = [int(h) for h in hashes]
+    found = []
+    for i in range(0, len(hashes), 500):
+        chunk = hashes[i:i + 500]
+        cur = conn.cursor()
+        cur.execute(f"SELECT hash FROM {table} WHERE hash IN ({', '.join('?'*len(chunk))})", chunk)
+        found.extend(r[0] for r in cur.fetchall())
+    return found
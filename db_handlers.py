@@ -1,201 +1,776 @@
-import sqlite3
 from sqlite3 import Error
 
 import numpy as np
 import os, sys
 import logging
 import datetime
+import stat
+from collections import Counter
 
+from packet_table import PacketTable
+from time_handlers import unix_to_datetime, merge_intervals
+from segment_store import write_segment, read_segment, load_column, remove_segment
+from segment_store import read_archive
+from db_connections import create_connection, get_connection, read_snapshot, create_table, table_exists
+from db_connections import database_path, BUSY_TIMEOUT
+from packet_identity import PACKET_ID_FIELDS, packet_hashes, first_copies, known_packets, float_timestamps
+from packet_schema import PACKET_DB_PRAGMAS, sql_create_packets_table, create_packet_indexes, insert_packets
+from packet_schema import PACKET_COLUMNS, FETCH_BATCH_SIZE, rows_to_table
+from change_feed import create_change_feed, record_table_changes
+from shard_store import create_shard_catalog, get_shards, packet_stores, write_to_shards, commit_packet_db
+from packet_archive import create_archive_catalog, enable_incremental_vacuum, get_archives, drop_archived
 
 
 
-def create_connection(db_file):
-    """ create a database connection to the SQLite database
-        specified by db_file
-    :param db_file: database file
-    :return: Connection object or None
-    """
-    logger = logging.getLogger('create_connection')
-
-    if not os.path.exists(db_file):
-        logger.info('no db exists! creating')
-    conn = None
-    try:
-        conn = sqlite3.connect(db_file)
-        return conn
-    except Error as e:
-        logger.error(e)
-
-    return conn
-
-
-def create_table(conn, create_table_sql):
-    """ create a table from the create_table_sql statement
-    :param conn: Connection object
-    :param create_table_sql: a CREATE TABLE statement
-    :return:
-    """
-    logger = logging.getLogger('create_table')
-
-    try:
-        c = conn.cursor()
-        c.execute(create_table_sql)
-    except Error as e:
-        logger.error(e)
-
-def packet_hash(el):
-    # A hash of a single packet. This is a little sloppy, since
-    # it casts the whole dict to a string, sorted by keys.
-    # It will fail on nested dictionaries if the nested
-    # dicts are in different orders, since we're only sorting the
-    # top level.
-    return hash(str(sorted(el.items())))
-    
-def add_metadata(in_list):
-    # Add metadata to each entry -- a hash value, and the time added.
-    for el in in_list:
-        el['hash'] = packet_hash(el)
-        el['added'] = datetime.datetime.now().timestamp()
-
 def connect_packet_db(db_name):
-    # Connect to a database, and create the packets table,
-    # if it doesn't already exist
+    # Connect to a database (the shared read-write connection, from get_connection),
+    # and create the packets table, if it doesn't already exist
 
     logger = logging.getLogger('connect_packet_db')
 
-    sql_create_packets_table = """ CREATE TABLE IF NOT EXISTS packets (
-                                        data BLOB,
-                                        start_ind INTEGER,
-                                        dtype TEXT,
-                                        exp_num INTEGER,
-                                        bytecount INTEGER,
-                                        checksum_verify INTEGER,
-                                        packet_length INTEGER,
-                                        fname TEXT,
-                                        header_timestamp REAL,
-                                        file_index INTEGER,
-                                        hash INTEGER,
-                                        header_ns INTEGER,
-                                        header_epoch_sec INTEGER,
-                                        header_reboots INTEGER,
-                                        added REAL
-                                    ); """
-
     # create a database connection
-    conn = create_connection(db_name)
+    conn = get_connection(db_name)
 
     # create tables
     if conn is not None:
         logger.info('connected to db')
+        for pragma in PACKET_DB_PRAGMAS:
+            conn.execute(pragma)
+
         # create projects table
         create_table(conn, sql_create_packets_table)
+
+        # Bring the rest of the schema up to date
+        migrate_packet_db(conn)
     else:
         logger.error("Error! cannot create the database connection.")
 
     return conn
 
-def write_to_db(conn, packets, db_field = 'packets'):
-    logger = logging.getLogger('write_to_db')
-
-    for p in packets:
-
-        # add metadata
-        p['hash'] = packet_hash(p)
-        p['added'] = datetime.datetime.now().timestamp()
-
-        sql = f'INSERT INTO {db_field}('
-        vals = []
-
-
-        for k, v in p.items():
-            sql+=k + ','
-            if type(v) == list:
-                # Here we're assuming the list is of uint8s. Can
-                # we abstract this better? We could do the array conversion
-                # before this call, and just read the dtype...
-                # vals.append(str(v))
-                # vals.append(sqlite3.Binary(np.array(v,dtype=np.uint8)))
-                vals.append(sqlite3.Binary(np.array(v, dtype=np.uint8)).tobytes())
-                # To reconstruct on the other end, do:
-                # y = np.frombuffer(x, dtype=np.uint8)  
-            elif type(v) == np.uint8:
-                vals.append(int(v))
-            else:
-                vals.append(v)
-
-        sql = sql[:-1] + ') VALUES(' + ''.join(['?,' for x in p])
-        sql = sql[:-1] + ')'                                           
-        
+def checkpoint_packet_db(conn):
+    '''
+    Copy everything in the write-ahead log of the packet database (and of its unsealed shards;
+    conn is the main database's read-write connection) into the database, and empty the log --
+    without waiting on any readers: if they're still using part of the log, it's copied as far
+    as they allow, and left for next time. Commits. Returns True if the logs were all emptied.
+    '''
+    commit_packet_db(conn)
+    emptied = checkpoint_database(conn)
+    for s in get_shards(conn):
+        if not s['sealed'] and os.path.exists(s['path']):
+            emptied &= checkpoint_database(get_connection(s['path']))
+    return emptied
+
+def checkpoint_database(conn):
+    ''' Checkpoint (as checkpoint_packet_db) the one database conn (a read-write connection) is to '''
+    logger = logging.getLogger('checkpoint_packet_db')
+
+    busy, log_pages, done_pages = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+    if busy or done_pages < log_pages:
+        logger.info(f'checkpointed {done_pages} of {log_pages} pages of {database_path(conn)} (readers are using the rest)')
+        return False
+
+    # (TRUNCATE waits for readers to move off the log, with the busy timeout -- so don't wait)
+    conn.execute('PRAGMA busy_timeout=0')
+    try:
+        busy = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()[0]
+    finally:
+        conn.execute(f'PRAGMA busy_timeout={int(BUSY_TIMEOUT*1000)}')
+    logger.debug(f"checkpointed {log_pages} pages{'' if busy else '; log emptied'}")
+    return not busy
+
+# ---------------- Schema migrations ----------------
+# Each migration takes the packet database from the previous schema version to the next.
+# Version 0 is the bare packets table. connect_packet_db applies any missing migrations,
+# in order, and records each one in the schema_version table. (Migrations need to cope
+# with databases made before we kept track of versions, so they're written to be safe
+# to re-run.) To upgrade a database by hand, run migrate_packet_db.py.
+
+def create_file_registry(conn):
+    ''' Registry of the telemetry files we've read: where we got to in each one
+        (see data_handlers.new_ingest_state), and the range of times it covers '''
+    new_registry = not table_exists(conn, 'files')
+    conn.execute(''' CREATE TABLE IF NOT EXISTS files (
+                        path TEXT PRIMARY KEY,
+                        fname TEXT,
+                        size INTEGER,
+                        mtime REAL,
+                        digest TEXT,
+                        byte_offset INTEGER,
+                        count INTEGER,
+                        packet_count INTEGER,
+                        t_min REAL,
+                        t_max REAL,
+                        updated REAL
+                    ); ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS files_fname ON files (fname)')
+    conn.execute('CREATE INDEX IF NOT EXISTS files_time_range ON files (t_min, t_max)')
+    if new_registry:
+        backfill_file_registry(conn)
+
+# Columns to work out packet hashes from
+HASH_COLUMNS = PACKET_ID_FIELDS + ['header_timestamp', 'data']
+
+def iter_hash_rows(conn, table='packets', batch_size=10000):
+    ''' Stream the packets in table, in rowid order, batch_size at a time: yields the rowids of
+        each batch, their hashes and near hashes (see packet_hashes), and the packets themselves
+        (a PacketTable of their HASH_COLUMNS) '''
+    last_rowid = -1
+    while True:
         cur = conn.cursor()
-        cur.execute(sql, vals)
-    return cur.lastrowid
+        cur.execute(f"SELECT rowid, {', '.join(HASH_COLUMNS)} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last_rowid, batch_size))
+        rows = cur.fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+        packets = rows_to_table([r[1:-1] + (r[-1] or b'',) for r in rows], HASH_COLUMNS)
+        hashes, near_hashes = packet_hashes(packets, near=True)
+        yield [r[0] for r in rows], hashes, near_hashes, packets
+
+def rehash_packets(conn, table='packets'):
+    ''' Re-hash every packet in table with packet_hash (replacing whatever hashes it had). Doesn't commit. '''
+    for rowids, hashes, near_hashes, packets in iter_hash_rows(conn, table):
+        conn.executemany(f'UPDATE {table} SET hash=? WHERE rowid=?', zip(hashes, rowids))
+
+def create_hash_index(conn):
+    ''' Index the packet hashes -- with a unique index (so write_to_db's inserts skip copies of
+        packets we have already), unless there are duplicates in there already '''
+    logger = logging.getLogger('create_hash_index')
+
+    num_duplicates = conn.execute('SELECT COUNT(*) - COUNT(DISTINCT hash) FROM packets').fetchone()[0]
+    if num_duplicates > 0:
+        logger.warning(f'{num_duplicates} duplicate packets in the database; leaving them for now '
+                       f'(see migrate_packet_db.py --find_duplicates)')
+        conn.execute('CREATE INDEX IF NOT EXISTS packets_hash ON packets (hash)')
+    else:
+        conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS packets_hash ON packets (hash)')
 
-def get_packets_within_range(database, dtype=None, date_added=None, t1=None, t2=None):
+def hash_packets(conn):
     '''
-    Load packets from the database, with header_timestamps between datetimes t1 and t2,
-    and added after date_added, for data type specified by dtype (S, E, B, G, I)
+    Re-hash every packet with packet_hash (replacing the old hashes, which changed from run
+    to run), and index the hashes -- so write_to_db skips packets we already have. Any
+    duplicates already in the database are left alone (see deduplicate_packets).
     '''
-    logger = logging.getLogger('get_packets_within_range')
+    rehash_packets(conn)
+    create_hash_index(conn)
+
+def deduplicate_packets(conn, delete=False):
+    '''
+    Find the duplicate packets in the packets table -- the later copies (by rowid) of any packet:
+    the same PACKET_ID_FIELDS and data, with header timestamps within PACKET_TIME_TOLERANCE.
+    Not a schema migration, since it deletes packets: migrate_packet_db.py --find_duplicates
+    lists them, and --remove_duplicates deletes them (with delete=True; then hashes have to
+    be unique from there on). Commits. Returns a Counter of the duplicates, by dtype.
+    '''
+    logger = logging.getLogger('deduplicate_packets')
 
+    conn.commit()
+    rowids, hashes, near_hashes, dtypes, timestamps = [], [], [], [], []
+    for r, h, n, packets in iter_hash_rows(conn):
+        rowids.extend(r)
+        hashes.extend(h)
+        near_hashes.extend(n)
+        dtypes.extend(packets['dtype'].tolist())
+        timestamps.append(float_timestamps(packets))
+
+    duplicate = ~first_copies(hashes, near_hashes)
+    counts = Counter(np.array(dtypes, dtype=object)[duplicate].tolist())
+    if not counts:
+        logger.info('no duplicate packets')
+    else:
+        t = np.concatenate(timestamps)[duplicate]
+        t = t[np.isfinite(t)]
+        span = f', from {unix_to_datetime(t.min())} to {unix_to_datetime(t.max())}' if len(t) else ''
+        logger.info(f"{sum(counts.values())} duplicate packets ({', '.join(f'{n} {d}' for d, n in sorted(counts.items()))}){span}")
+
+    if delete and counts:
+        conn.executemany('DELETE FROM packets WHERE rowid = ?', ((r,) for r in np.array(rowids)[duplicate].tolist()))
+        conn.execute('DROP INDEX IF EXISTS packets_hash')
+        conn.execute('CREATE UNIQUE INDEX packets_hash ON packets (hash)')
+        conn.commit()
+        logger.info(f'deleted {sum(counts.values())} duplicate packets')
+
+    return counts
+
+def create_segment_catalog(conn):
+    ''' The catalog of segments (see write_to_segments), and the hashes of the packets in them
+        (to skip duplicates with). Empty, unless the packets are stored in segments. '''
+    conn.execute(''' CREATE TABLE IF NOT EXISTS segments (
+                        name TEXT PRIMARY KEY,
+                        path TEXT,
+                        t_min REAL,
+                        t_max REAL,
+                        packet_count INTEGER,
+                        added REAL,
+                        created REAL
+                    ); ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS segments_time_range ON segments (t_min, t_max)')
+    conn.execute(''' CREATE TABLE IF NOT EXISTS segment_hashes (
+                        hash INTEGER PRIMARY KEY
+                    ) WITHOUT ROWID; ''')
+
+def rehash_packet_stores(conn):
+    '''
+    Re-hash the packets everywhere they're stored -- the packets table, the shards (sealed ones
+    are made writable for it, and then read-only again), and the hash lists of the segments and
+    the cold archive -- after the packet identity changed to take in the header timestamp.
+    (It only splits identities, so there are no new duplicates. The hash columns stored in the
+    segment and archive files themselves are left as they were; nothing reads them back.)
+    '''
+    logger = logging.getLogger('rehash_packet_stores')
+
+    rehash_packets(conn)
+
+    for s in get_shards(conn):
+        mode = stat.S_IMODE(os.stat(s['path']).st_mode)
+        if s['sealed']:
+            os.chmod(s['path'], mode | stat.S_IWUSR)
+        try:
+            shard = create_connection(s['path'])
+            rehash_packets(shard)
+            shard.commit()
+            shard.close()
+        finally:
+            os.chmod(s['path'], mode)
+        logger.info(f"re-hashed shard {s['name']}")
+
+    for table, stores, read in [('segment_hashes', get_segments(conn), read_segment),
+                                ('archived_hashes', get_archives(conn), read_archive)]:
+        if not stores:
+            continue
+        conn.execute(f'DELETE FROM {table}')
+        for store in stores:
+            hashes = packet_hashes(read(store['path'], None, None, columns=HASH_COLUMNS))
+            conn.executemany(f'INSERT OR IGNORE INTO {table} (hash) VALUES (?)', ((h,) for h in hashes))
+        logger.info(f're-hashed {len(stores)} files for {table}')
+
+PACKET_DB_MIGRATIONS = [
+    (1, 'file registry', create_file_registry),
+    (2, 'packet indexes', create_packet_indexes),
+    (3, 'packet hashes', hash_packets),
+    (4, 'change feed', create_change_feed),
+    (5, 'shard catalog', create_shard_catalog),
+    (6, 'segment catalog', create_segment_catalog),
+    (7, 'archive catalog', create_archive_catalog),
+    (8, 'time in packet identity', rehash_packet_stores),
+    (9, 'incremental vacuum', enable_incremental_vacuum),
+]
+PACKET_DB_VERSION = PACKET_DB_MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    ''' The schema version of the packet database (0 if it's never been migrated) '''
+    if not table_exists(conn, 'schema_version'):
+        return 0
+    cur = conn.cursor()
+    cur.execute('SELECT MAX(version) FROM schema_version')
+    version = cur.fetchone()[0]
+    return version if version is not None else 0
+
+def migrate_packet_db(conn):
+    '''
+    Apply any schema migrations the packet database is missing (each in its own transaction).
+    Returns the schema version, afterwards.
+    '''
+    logger = logging.getLogger('migrate_packet_db')
+
+    conn.execute(''' CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT,
+                        applied REAL
+                    ); ''')
+    version = get_schema_version(conn)
+
+    for migration_version, description, migration in PACKET_DB_MIGRATIONS:
+        if migration_version <= version:
+            continue
+        logger.info(f'migrating packet database to version {migration_version}: {description}')
+        try:
+            migration(conn)
+            conn.execute('INSERT INTO schema_version (version, description, applied) VALUES(?, ?, ?)',
+                         (migration_version, description, datetime.datetime.now().timestamp()))
+            conn.commit()
+        except Error as e:
+            conn.rollback()
+            logger.error(f'migration to version {migration_version} failed: {e}')
+            break
+        version = migration_version
+
+    return version
+
+def backfill_file_registry(conn):
+    '''
+    Register the files in a database from before we kept a file registry, from the packets table.
+    (A one-time scan of the packets table.) We don't know where these files live, or
+    how much of each we read, so they're entered by name only (path = fname, and no size);
+    process_packets skips them, as it always has.
+    '''
+    logger = logging.getLogger('backfill_file_registry')
+
+    sql = '''INSERT OR IGNORE INTO files (path, fname, packet_count, t_min, t_max, updated)
+             SELECT fname, fname, COUNT(*), MIN(header_timestamp), MAX(header_timestamp), ?
+             FROM packets WHERE fname IS NOT NULL GROUP BY fname'''
+    cur = conn.cursor()
+    cur.execute(sql, (datetime.datetime.now().timestamp(),))
+    if cur.rowcount > 0:
+        logger.info(f'registered {cur.rowcount} files already in the packets table')
+
+def write_to_db(conn, packets, db_field = 'packets', shard_period=None, store='sqlite'):
+    '''
+    Insert packets (a PacketTable, or a list of packet dictionaries) into table db_field.
+    The whole batch goes in with a single prepared statement (executemany), with the
+    columns converted to Python values a column at a time, and each data segment
+    stored as a blob of bytes. (To reconstruct on the other end, do
+    np.frombuffer(x, dtype=np.uint8)). Doesn't commit; that's left to the caller
+    (with commit_packet_db, if the database is sharded).
+    Packets already in the database (with the same packet_hash, give or take
+    PACKET_TIME_TOLERANCE -- e.g., the same packet from another telemetry file), or in its
+    cold archive, are skipped. The time buckets the new packets fall in
+    are entered in the change feed (see record_changes).
+    With shard_period ('month' or 'year'), the packets go into the shards of the
+    database instead (see write_to_shards); with store='segments', into a new segment
+    file (see write_to_segments).
+    Returns the number of packets written.
+    '''
+    packets = PacketTable.from_packets(packets)
+    if db_field == 'packets' and len(packets):
+        packets = drop_archived(conn, packets)
+    if len(packets) == 0:
+        return 0
+
+    if store == 'segments' and db_field == 'packets':
+        return write_to_segments(conn, packets)
+    if shard_period and db_field == 'packets':
+        return write_to_shards(conn, packets, shard_period)
+    return insert_packets(conn, packets, db_field)
+
+def write_stream_to_db(conn, packet_batches, db_field = 'packets', shard_period=None, store='sqlite'):
+    '''
+    Insert a stream of packets into table db_field, one batch at a time.
+    packet_batches is any iterable of PacketTables (or lists of packet dictionaries),
+    e.g. from iter_packets_TLM or iter_packets_CSV -- so only one batch needs to be
+    in memory at once. (With store='segments', each batch gets a segment of its own,
+    for compact_segments to merge afterwards.) Doesn't commit; that's left to the caller.
+    Returns the number of packets written.
+    '''
+    logger = logging.getLogger('write_stream_to_db')
+
+    num_written = 0
+    for batch in packet_batches:
+        if len(batch):
+            num_written += write_to_db(conn, batch, db_field=db_field, shard_period=shard_period, store=store)
+            logger.debug(f'wrote {len(batch)} packets ({num_written} total)')
+
+    return num_written
+
+def query_limits(dtype=None, date_added=None, t1=None, t2=None, columns=None):
+    ''' The arguments of get_packets_within_range (see there), with the defaults filled in:
+        the list of dtypes (empty for all), date_added, t1 and t2 as Unix timestamps,
+        and the list of columns '''
+    # (Aware datetimes, so they're the epoch whatever the local time zone)
     if date_added is None:
-        date_added = datetime.datetime.utcfromtimestamp(0)
+        date_added = datetime.datetime.fromtimestamp(0, tz=datetime.timezone.utc)
     if t1 is None:
-        t1 = datetime.datetime.utcfromtimestamp(0)
+        t1 = datetime.datetime.fromtimestamp(0, tz=datetime.timezone.utc)
     if t2 is None:
         t2 = datetime.datetime.now()
 
-    conn = create_connection(database)
-    conn.row_factory = sqlite3.Row
+    names = list(PACKET_COLUMNS) if columns is None else list(columns)
+    for k in names:
+        if k not in PACKET_COLUMNS:
+            raise ValueError(f'no column {k} in the packets table')
+
+    # (A single type, or a list of them)
+    dtypes = [] if not dtype else [dtype] if isinstance(dtype, str) else list(dtype)
+
+    return dtypes, date_added.timestamp(), t1.timestamp(), t2.timestamp(), names
+
+def select_packets_within_range(conn, dtype=None, date_added=None, t1=None, t2=None, columns=None):
+    '''
+    Run the query for get_packets_within_range (see there), and return the cursor,
+    along with the names of the selected columns.
+    '''
+    dtypes, date_added, t1, t2, names = query_limits(dtype, date_added, t1, t2, columns)
+
+    # (No DISTINCT -- packets are unique by hash -- which saves sorting every selected row, blobs and all)
+    sql = f'''SELECT {', '.join(names)} FROM packets
+            WHERE header_timestamp > ?
+            AND header_timestamp < ?
+            {f"AND dtype IN ({', '.join('?'*len(dtypes))})" if dtypes else ''}
+            AND added > ?
+            ORDER BY header_timestamp'''
+    params = [t1, t2] + dtypes + [date_added]
+
     cur = conn.cursor()
+    cur.execute(sql, params)
+    return cur, names
 
-    if dtype:
-        sql = '''SELECT DISTINCT * FROM packets 
-                WHERE header_timestamp > ? 
-                AND header_timestamp < ? 
-                AND dtype=?
-                AND added > ?
-                ORDER BY header_timestamp'''
+def iter_packets_within_range(database, dtype=None, date_added=None, t1=None, t2=None, columns=None,
+                              batch_size=FETCH_BATCH_SIZE):
+    '''
+    Stream the packets from get_packets_within_range, in time order: yields PacketTables
+    of up to batch_size packets, fetched batch_size rows at a time -- so only one batch
+    needs to be in memory at once. (For a sharded database, the packets come in time order
+    from each shard in turn -- which is only overall time order if the shards don't overlap.
+    Likewise for segments and the archive, which come after the database's own packets.) The database is read
+    from one snapshot, until the last batch.
+    '''
+    with read_snapshot(database):
+        for conn in packet_stores(database, t1 and t1.timestamp(), t2 and t2.timestamp()):
+            cur, names = select_packets_within_range(conn, dtype, date_added, t1, t2, columns)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows_to_table(rows, names)
+
+        dtypes, added_after, ts1, ts2, names = query_limits(dtype, date_added, t1, t2, columns)
+        for s in get_segments(database, ts1, ts2, added_after):
+            packets = read_segment(s['path'], ts1, ts2, dtypes, added_after, names)
+            for i in range(0, len(packets), batch_size):
+                yield packets[i:i + batch_size]
+
+        for a in get_archives(database, ts1, ts2, added_after):
+            packets = read_archive(a['path'], ts1, ts2, dtypes, added_after, names)
+            for i in range(0, len(packets), batch_size):
+                yield packets[i:i + batch_size]
+
+def get_packets_within_range(database, dtype=None, date_added=None, t1=None, t2=None, columns=None):
+    '''
+    Load packets from the database, with header_timestamps between datetimes t1 and t2,
+    and added after date_added, for data type specified by dtype (S, E, B, G, I; or a
+    list of them). database is the path to the packet database (or an open connection to it).
+    columns is the list of columns to load (default: all of them); leave out 'data'
+    to skip loading the data segments altogether, e.g. when you only need the timestamps.
+    (Packets from the cold archive, if the times asked for go back that far, are included.)
+    Returns a PacketTable.
+    '''
+    logger = logging.getLogger('get_packets_within_range')
 
-        cur.execute(sql, (t1.timestamp(), t2.timestamp(), dtype, date_added.timestamp()))
+    # (The catalogs, and everything in the database itself, from the same snapshot)
+    with read_snapshot(database):
+        stores = packet_stores(database, t1 and t1.timestamp(), t2 and t2.timestamp())
+        dtypes, added_after, ts1, ts2, names = query_limits(dtype, date_added, t1, t2, columns)
+        segments = get_segments(database, ts1, ts2, added_after)
+        archives = get_archives(database, ts1, ts2, added_after)
+
+        # (Packets from more than one shard, segment or archive file need sorting by time, afterwards)
+        query_columns = columns
+        if len(stores) + len(segments) + len(archives) > 1 and columns is not None and 'header_timestamp' not in columns:
+            query_columns = list(columns) + ['header_timestamp']
+
+        tables = []
+        for conn in stores:
+            cur, names = select_packets_within_range(conn, dtype, date_added, t1, t2, query_columns)
+
+            # (fetchmany rather than fetchall, so sqlite3 doesn't have to grow one huge list)
+            rows = []
+            while True:
+                batch = cur.fetchmany(FETCH_BATCH_SIZE)
+                if not batch:
+                    break
+                rows.extend(batch)
+            tables.append(rows_to_table(rows, names))
+
+        for s in segments:
+            tables.append(read_segment(s['path'], ts1, ts2, dtypes, added_after, query_columns or PACKET_COLUMNS))
+        for a in archives:
+            tables.append(read_archive(a['path'], ts1, ts2, dtypes, added_after, query_columns or PACKET_COLUMNS))
+
+    found = [t for t in tables if len(t)]
+    if len(found) <= 1:
+        packets = found[0] if found else tables[0]
     else:
-        sql = '''SELECT DISTINCT * FROM packets 
-                WHERE header_timestamp > ? 
-                AND header_timestamp < ? 
-                AND added > ?
-                ORDER BY header_timestamp'''
-
-        cur.execute(sql, (t1.timestamp(), t2.timestamp(), date_added.timestamp()))
+        packets = PacketTable.concatenate(found).sort('header_timestamp')
+    if query_columns is not columns:
+        del packets.columns['header_timestamp']
 
-    rows = cur.fetchall()
+    logger.debug(f'Retrieved {len(packets)} packets from db')
 
-    logger.debug(f'Retrieved {np.shape(rows)[0]} packets from db')
-    packets = []
-    for row in rows:
-        p = dict(row)
-        p['data'] = np.frombuffer(p['data'],dtype=np.uint8).tolist()
-        packets.append(p)
-        
     return packets
 
+def iter_packets_in_windows(database, windows, dtype=None, columns=None):
+    '''
+    Load the packets in each of a list of time windows, e.g. one per burst. windows is a list
+    of (t1, t2) Unix timestamps; for each window, in order, yields a PacketTable of the packets
+    with t1 < header_timestamp < t2 (of type dtype, as in get_packets_within_range).
+    Rather than a query per window, the windows are merged into their union, and each
+    separate piece of it is fetched with a single range scan, then split into its windows
+    in memory (with a binary search on the sorted timestamps). Only one piece is kept in
+    memory at a time, so windows in the same piece should come one after the other
+    (e.g., sorted by time -- either way).
+    '''
+    logger = logging.getLogger('iter_packets_in_windows')
+
+    if columns is not None and 'header_timestamp' not in columns:
+        columns = list(columns) + ['header_timestamp']
+
+    spans = merge_intervals(windows)
+    span_starts = np.array([s[0] for s in spans])
+    current_span = None
+
+    for t1, t2 in windows:
+        k = np.searchsorted(span_starts, t1, side='right') - 1
+        if k != current_span:
+            s1, s2 = spans[k]
+            packets = get_packets_within_range(database, dtype=dtype, columns=columns,
+                                               t1=datetime.datetime.fromtimestamp(s1, tz=datetime.timezone.utc),
+                                               t2=datetime.datetime.fromtimestamp(s2, tz=datetime.timezone.utc))
+            timestamps = packets['header_timestamp'].astype(np.float64) if len(packets) else np.zeros(0)
+            current_span = k
+            logger.debug(f'loaded {len(packets)} packets between {s1} and {s2}')
+
+        yield packets[np.searchsorted(timestamps, t1, side='right'):np.searchsorted(timestamps, t2, side='left')]
+
+def get_packet_arrays(database, columns, dtype=None, date_added=None, t1=None, t2=None, payload_width=None):
+    '''
+    Like get_packets_within_range, but returns a dictionary of arrays, one per column in columns.
+    If 'data' is one of them, it's returned as a 2d uint8 array (num_packets x payload_width,
+    default the longest data segment; shorter segments are zero-padded), along with 'lengths',
+    the number of data bytes in each row. (If every segment is payload_width bytes long, the
+    2d array is just a view onto the joined blobs.)
+    '''
+    packets = get_packets_within_range(database, dtype, date_added, t1, t2, columns)
+    arrays = dict(packets.columns)
+    if 'data' in columns:
+        arrays['data'], arrays['lengths'] = packets.payload_matrix(payload_width)
+    return arrays
+
+# ---------------- Segments ----------------
+# As an alternative to storing packets in SQLite (packet_store = segments, in GSS_settings.conf),
+# they can be written to segments: immutable directories of .npy column arrays, sorted by time,
+# which are read memory-mapped -- so a long read (e.g., reprocessing the whole mission) goes at
+# disk speed, rather than a row at a time (see segment_store). They go in a directory next to the
+# main packet database (e.g. packets_segments/, for packets.db), one per batch written (so only
+# a batch is in memory at once), which compact_segments merges into bigger ones afterwards. The
+# main database keeps the catalog of segments (the segments table -- the time range of each, to
+# pick which to read), the hashes of the packets in them, and everything else, as usual;
+# get_packets_within_range and friends read from both.
+
+# Ways of storing the packets
+PACKET_STORES = ['sqlite', 'segments']
+# Size to merge segments up to (in packets; ~500 bytes each, plus metadata)
+SEGMENT_TARGET_PACKETS = 250000
+# Age (in seconds) a segment which isn't in the catalog has to reach before compact_segments
+# deletes it -- until then, it may be one another process has written, but not committed yet
+SEGMENT_ORPHAN_SECONDS = 24*60*60
+
+SEGMENT_FIELDS = ['name', 'path', 't_min', 't_max', 'packet_count', 'added']
+
+def segment_root(conn):
+    ''' The directory for the segments of the packet database (conn) '''
+    root, ext = os.path.splitext(database_path(conn))
+    return root + '_segments'
+
+def new_segment_name(root):
+    ''' A name for a new segment in directory root (in order of creation) '''
+    base = datetime.datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f')
+    name, k = base, 1
+    while os.path.exists(os.path.join(root, name)):
+        name = f'{base}-{k}'
+        k += 1
+    return name
+
+def get_segments(database, t1=None, t2=None, added_after=None):
+    '''
+    The catalog of segments of the packet database (a list of dictionaries, in time order), with
+    the full path to each one -- only those with packets between Unix timestamps t1 and t2, and
+    added after added_after, if given.
+    '''
+    conn = get_connection(database, readonly=True)
+    if not table_exists(conn, 'segments'):
+        return []
+    root = os.path.dirname(database_path(conn))
+
+    sql = f"SELECT {', '.join(SEGMENT_FIELDS)} FROM segments WHERE 1"
+    params = []
+    if t1 is not None:
+        sql += ' AND t_max > ?'
+        params.append(t1)
+    if t2 is not None:
+        sql += ' AND t_min < ?'
+        params.append(t2)
+    if added_after is not None:
+        sql += ' AND added > ?'
+        params.append(added_after)
+    cur = conn.cursor()
+    cur.execute(sql + ' ORDER BY t_min, name', params)
+
+    segments = [dict(zip(SEGMENT_FIELDS, r)) for r in cur.fetchall()]
+    for s in segments:
+        s['path'] = os.path.join(root, s['path'])
+    return segments
+
+def write_to_segments(conn, packets):
+    '''
+    Write packets (a PacketTable) to a new segment of the packet database (conn is the main
+    database's connection), and enter it in the catalog and the change feed. Packets we already
+    have (in a segment, or in the main database) are skipped. Doesn't commit. (If the transaction
+    is rolled back, the segment is left behind, but not in the catalog -- so it's ignored, and
+    cleaned up by compact_segments.) Returns the number of packets written.
+    '''
+    logger = logging.getLogger('write_to_segments')
+
+    hashes, near_hashes = [np.array(h, dtype=np.int64) for h in packet_hashes(packets, near=True)]
+    keep = first_copies(hashes, near_hashes)
+    keep &= ~known_packets(conn, 'segment_hashes', hashes, near_hashes)
+    if conn.execute('SELECT 1 FROM packets LIMIT 1').fetchone() is not None:
+        keep &= ~known_packets(conn, 'packets', hashes, near_hashes)
+    if not np.all(keep):
+        logger.debug(f'skipped {len(packets) - np.sum(keep)} packets already in the database')
+    if not np.any(keep):
+        return 0
+
+    if not np.all(keep):
+        packets = packets.take(keep)
+        hashes = hashes[keep]
+    added = datetime.datetime.now().timestamp()
+    columns = dict(packets.columns)
+    columns['hash'] = hashes
+    columns['added'] = np.full(len(packets), added)
+
+    root = segment_root(conn)
+    os.makedirs(root, exist_ok=True)
+    name = new_segment_name(root)
+    packets = write_segment(os.path.join(root, name), PacketTable(columns, packets.payload, packets.bounds))
+
+    t = float_timestamps(packets)
+    t = t[np.isfinite(t)]
+    t_min, t_max = (float(t.min()), float(t.max())) if len(t) else (None, None)
+    conn.executemany('INSERT INTO segment_hashes (hash) VALUES (?)', ((h,) for h in hashes.tolist()))
+    conn.execute(f'''INSERT INTO segments ({', '.join(SEGMENT_FIELDS)}, created) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                 (name, os.path.join(os.path.basename(root), name), t_min, t_max, len(packets), added, added))
+    record_table_changes(conn, packets, added)
+
+    return len(packets)
+
+def compact_segments(conn, target=SEGMENT_TARGET_PACKETS):
+    '''
+    Merge the small segments of the packet database (conn is the main database's read-write
+    connection) into segments of up to about target packets, in time order -- so reading a
+    long stretch of time is a few long sequential reads. Also deletes any segments which
+    aren't in the catalog (any more), once they're older than SEGMENT_ORPHAN_SECONDS.
+    Commits. Returns the number of segments merged away.
+    '''
+    logger = logging.getLogger('compact_segments')
+
+    conn.commit()
+    root = segment_root(conn)
+    if not os.path.isdir(root):
+        return 0
+    db_root = os.path.dirname(database_path(conn))
+    segments = [dict(zip(SEGMENT_FIELDS, r)) for r in
+                conn.execute(f"SELECT {', '.join(SEGMENT_FIELDS)} FROM segments ORDER BY t_min, name").fetchall()]
+
+    # (Left over from writes which were rolled back, or merged last time. Merged segments are
+    # left for a run, for any readers which looked at the catalog before they were merged.
+    # Recent ones may be from a write_to_segments which hasn't committed yet, and the
+    # .<name>.tmp directories from one which is still writing, so those are left alone.)
+    names = [s['name'] for s in segments]
+    now = datetime.datetime.now().timestamp()
+    for f in os.listdir(root):
+        path = os.path.join(root, f)
+        if f in names or (f.startswith('.') and f.endswith('.tmp')):
+            continue
+        if now - os.path.getmtime(path) < SEGMENT_ORPHAN_SECONDS:
+            logger.debug(f'leaving {f} (not in the catalog, but recent)')
+            continue
+        logger.info(f'removing {f} (no longer in the catalog)')
+        remove_segment(path)
+
+    # Runs of small segments, in time order
+    groups = [[]]
+    for s in segments:
+        if s['packet_count'] >= target//2:
+            groups.append([])
+            continue
+        if sum(g['packet_count'] for g in groups[-1]) + s['packet_count'] > target:
+            groups.append([])
+        groups[-1].append(s)
+
+    num_merged = 0
+    for group in groups:
+        if len(group) < 2:
+            continue
+        packets = PacketTable.concatenate([read_segment(os.path.join(db_root, s['path']), None, None) for s in group])
+        name = new_segment_name(root)
+        packets = write_segment(os.path.join(root, name), packets)
+
+        t = float_timestamps(packets)
+        t = t[np.isfinite(t)]
+        t_min, t_max = (float(t.min()), float(t.max())) if len(t) else (None, None)
+        conn.execute(f"DELETE FROM segments WHERE name IN ({', '.join('?'*len(group))})", [s['name'] for s in group])
+        conn.execute(f'''INSERT INTO segments ({', '.join(SEGMENT_FIELDS)}, created) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     (name, os.path.join(os.path.basename(root), name), t_min, t_max, len(packets),
+                      max(s['added'] for s in group), datetime.datetime.now().timestamp()))
+        conn.commit()
+
+        logger.info(f'merged {len(group)} segments into {name} ({len(packets)} packets)')
+        num_merged += len(group)
+
+    return num_merged
 
 def get_files_in_db(db_name, db_field):
     try:
         # Get filenames already in the database, so we don't reprocess them:
         sql = '''SELECT DISTINCT fname FROM ''' + db_field
-        conn = create_connection(db_name)
-        cur = conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        return [x[0] for x in rows]
+        fnames = []
+        for conn in (packet_stores(db_name) if db_field == 'packets' else [get_connection(db_name, readonly=True)]):
+            cur = conn.cursor()
+            cur.execute(sql)
+            fnames.extend(x[0] for x in cur.fetchall() if x[0] not in fnames)
+        if db_field == 'packets':
+            for s in get_segments(db_name):
+                fnames.extend(x for x in np.unique(load_column(s['path'], 'fname')).tolist() if x not in fnames)
+            for a in get_archives(db_name):
+                fnames.extend(x for x in np.unique(read_archive(a['path'], None, None, columns=['fname'])['fname']).tolist()
+                              if x not in fnames)
+        return fnames
     except:
         return []
 
+REGISTRY_FIELDS = ['path', 'fname', 'size', 'mtime', 'digest', 'byte_offset', 'count', 'packet_count', 't_min', 't_max']
+
+def get_file_registry(conn):
+    '''
+    Get the registry entry (ingest state) of every file we've read so far -- where we
+    got to in each, how big it was at the time, and the times it covers -- as a
+    dictionary keyed by path.
+    '''
+    cur = conn.cursor()
+    cur.execute(f"SELECT {', '.join(REGISTRY_FIELDS)} FROM files")
+    return {r[0]: dict(zip(REGISTRY_FIELDS, r)) for r in cur.fetchall()}
+
+def write_file_record(conn, fname, state):
+    '''
+    Record the ingest state of file fname in the registry. Doesn't commit -- so it
+    can be committed along with the file's packets, in a single transaction.
+    '''
+    record = dict(state, fname=fname)
+    vals = [record[k].item() if isinstance(record[k], np.generic) else record[k] for k in REGISTRY_FIELDS]
+    sql = f"INSERT OR REPLACE INTO files ({', '.join(REGISTRY_FIELDS)}, updated) VALUES({'?, '*len(REGISTRY_FIELDS)}?)"
+    cur = conn.cursor()
+    cur.execute(sql, vals + [datetime.datetime.now().timestamp()])
+
+def get_files_covering(db_name, t1, t2=None):
+    '''
+    Find the raw telemetry files with packets between (Unix) timestamps t1 and t2
+    (or at time t1, if there's no t2), e.g. to re-decode just those files.
+    Returns a list of (path, t_min, t_max) tuples, sorted by t_min.
+    '''
+    if t2 is None:
+        t2 = t1
+    conn = get_connection(db_name, readonly=True)
+    cur = conn.cursor()
+    cur.execute('SELECT path, t_min, t_max FROM files WHERE t_min <= ? AND t_max >= ? ORDER BY t_min', (t2, t1))
+    return cur.fetchall()
+
 def get_last_access_time(db_name, source_str):
     '''
      Get the time of the last access entry for source_str.
     '''
     sql = f'SELECT * FROM log WHERE source="{source_str}"'
-    conn = create_connection(db_name)
+    conn = get_connection(db_name)
     cur = conn.cursor()
     cur.execute(sql)
     rows = cur.fetchall()
@@ -204,28 +779,6 @@ def get_last_access_time(db_name, source_str):
     else:
         return 0
 
-def get_time_range_for_updated_packets(db_name, ts):
-    # 1. find the last log entry timestamp for source_str
-    # Get header timestamps corresponding to newly-added packets:
-    
-    sql = f'SELECT header_timestamp FROM packets WHERE added > {ts}'
-    conn = create_connection(db_name)
-    cur = conn.cursor()
-    cur.execute(sql)
-    rows = cur.fetchall()
-    if len(rows) < 1:
-        # print(f'No packets added after {datetime.datetime.utcfromtimestamp(ts)}')
-        return None, None
-
-    # Get minimum timestamp:
-    tmin = min(rows)[0]    
-    tmax = max(rows)[0]
-
-    return tmin, tmax   
-    # logger.info(f'packets added after {datetime.datetime.utcfromtimestamp(ts)}')
-    # logger.info(f'Header timestamps range from {datetime.datetime.utcfromtimestamp(tmin)} to {datetime.datetime.utcfromtimestamp(tmax)}')
-    
-    
 def log_access_time(db_name, source_str, desc_str=None):
     '''
      records the current time in the "log" db, tagged to source_str.
@@ -239,7 +792,7 @@ def log_access_time(db_name, source_str, desc_str=None):
                                     description TEXT
                                 ); """
 
-    conn = create_connection(db_name)
+    conn = get_connection(db_name)
     cur = conn.cursor()
     cur.execute(sql_create_log_table)
 
@@ -248,5 +801,4 @@ def log_access_time(db_name, source_str, desc_str=None):
     t = datetime.datetime.now()
     cur.execute(sql,(t.timestamp(), t.isoformat(), source_str, desc_str))
     conn.commit()
-    conn.close()
     
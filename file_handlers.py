@@ -8,6 +8,8 @@ import logging
 import gzip
 import pickle
 import scipy.io as spio
+from survey_frame import SurveyFrame, as_float
+from time_handlers import unix_to_datetime
 
 def write_status_XML(in_data, filename="status_messages.xml"):
     '''write status messages to an xml file'''
@@ -16,9 +18,10 @@ def write_status_XML(in_data, filename="status_messages.xml"):
     d = ET.Element('status_messages')
     d.set('file_creation_date', datetime.datetime.now(datetime.timezone.utc).isoformat())
 
-    for entry_data in in_data:
+    header_times = unix_to_datetime([x['header_timestamp'] for x in in_data])
+    for entry_data, header_time in zip(in_data, header_times):
         entry = ET.SubElement(d,'status')
-        entry.set('header_timestamp',datetime.datetime.utcfromtimestamp(entry_data['header_timestamp']).isoformat())
+        entry.set('header_timestamp',header_time.isoformat())
 
         for k, v in entry_data.items():
             # (This is a prime place for some recursion, if you wanted to show off)
@@ -38,21 +41,22 @@ def write_status_XML(in_data, filename="status_messages.xml"):
         f.write(reparsed)
 
 def write_survey_XML(in_data, filename='survey_data.xml'):
-    ''' Write a list of survey elements to an xml file. '''
+    ''' Write survey elements (a SurveyFrame, or a list of survey elements) to an xml file. '''
     
     # Sort by internal timestamp    
-    # in_data = sorted(in_data, key=lambda k: k['GPS'][0]['timestamp'])
+    # in_data = SurveyFrame.from_entries(in_data).sort('timestamp')
     # Sort by receipt timestamp
-    in_data = sorted(in_data, key=lambda k: k['header_timestamp'])
+    in_data = SurveyFrame.from_entries(in_data).sort('header_timestamp')
 
     d = ET.Element('survey_data')
     # d.set('creation_date', str(datetime.datetime.now(datetime.timezone.utc).timestamp()))
     d.set('file_creation_date', datetime.datetime.now(datetime.timezone.utc).isoformat())
 
-    for entry_data in in_data:
+    header_times = unix_to_datetime(as_float(in_data['header_timestamp'])) if len(in_data) else []
+    for entry_data, header_time in zip(in_data, header_times):
 
         entry = ET.SubElement(d, 'survey')
-        entry.set('header_timestamp',datetime.datetime.utcfromtimestamp(entry_data['header_timestamp']).isoformat())
+        entry.set('header_timestamp',header_time.isoformat())
 
         if 'E_data' in entry_data:
             E_elem = ET.SubElement(entry, 'E_data')
@@ -76,7 +80,7 @@ def write_survey_XML(in_data, filename='survey_data.xml'):
         f.write(reparsed)
 
 def read_survey_XML(filename):   
-    ''' Reads survey elements from an xml file. '''
+    ''' Reads survey elements from an xml file, into a SurveyFrame. '''
 
     # Open it
     with open(filename,'r') as f:
@@ -92,7 +96,8 @@ def read_survey_XML(filename):
         d['GPS'] = []
         d['GPS'].append(dict())
         G = S.find('GPS')
-        for el in G:
+        # (Products we got no GPS data for have no GPS element)
+        for el in (G if G is not None else []):
             try:
                 d['GPS'][0][el.tag] = int(el.text)
             except:
@@ -104,8 +109,7 @@ def read_survey_XML(filename):
 
         if 'exp_num' in S.attrib:
             d['exp_num'] = int(S.attrib['exp_num'])
-    # Return a list of dicts
-    return outs
+    return SurveyFrame.from_entries(outs)
 
 def write_burst_XML(in_data, filename='burst_data.xml'):
     ''' write a list of burst elements to an xml file. '''
@@ -118,13 +122,14 @@ def write_burst_XML(in_data, filename='burst_data.xml'):
     d.set('file_creation_date', datetime.datetime.now(datetime.timezone.utc).isoformat())
 
     # Process each burst in the input list:
-    for entry_data in in_data:
+    header_times = unix_to_datetime([x['header_timestamp'] for x in in_data])
+    for entry_data, header_time in zip(in_data, header_times):
         logger.debug(f'entry_data contains {entry_data.keys()}')
         entry = ET.SubElement(d, 'burst')
-        entry.set('header_timestamp',datetime.datetime.utcfromtimestamp(entry_data['header_timestamp']).isoformat())
+        entry.set('header_timestamp',header_time.isoformat())
         
         if 'footer_timestamp' in entry_data:
-            entry.set('footer_timestamp', datetime.datetime.utcfromtimestamp(entry_data['footer_timestamp']).isoformat())
+            entry.set('footer_timestamp', unix_to_datetime(entry_data['footer_timestamp']).isoformat())
 
         if 'experiment_number' in entry_data:
             entry.set('experiment_number', f"{entry_data['experiment_number']}")
@@ -435,9 +440,9 @@ def read_survey_matlab(filename):
                 x['GPS'] = [x['GPS']]
             x['E_data'] = np.array(x['E_data'], dtype='uint8')
             x['B_data'] = np.array(x['B_data'], dtype='uint8')
-        return sd
+        return SurveyFrame.from_entries(sd)
     else:
-        return []
+        return SurveyFrame()
 
 def read_burst_matlab(filename):
     bd = loadmat(filename)
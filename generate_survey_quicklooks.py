@@ -32,15 +32,6 @@ params = {'backend': 'ps',
 plt.rcParams.update(params)
 # --------------- Latex Plot Beautification --------------------------
 
-def get_timestamp(x):
-    try:
-        ts = x['GPS'][0]['timestamp']
-    except:
-        print("entry is missing GPS data")
-        ts = x['header_timestamp']
-    return ts
-
-
 def generate_survey_quicklooks(in_root, out_root, 
         start_date=None, stop_date=None, plot_length=6, last_run_time=None,
         line_plots = ['Lshell','altitude','lat','lon','used_sats','solution_status','daylight']):
@@ -78,7 +69,7 @@ def generate_survey_quicklooks(in_root, out_root,
                                 d2 = day + datetime.timedelta(hours=int(h2))
                                 t1 = d1.replace(tzinfo = datetime.timezone.utc).timestamp()
                                 t2 = d2.replace(tzinfo = datetime.timezone.utc).timestamp()
-                                S_filt = list(filter(lambda x: (get_timestamp(x) >= t1) and (get_timestamp(x) < t2), S_data))
+                                S_filt = S_data.between(t1, t2)
                                 
                                 outdir = os.path.join(out_root,f'{day.year}','{:02d}'.format(day.month))
 
@@ -0,0 +1,61 @@
+import argparse
+import logging
+from configparser import ConfigParser
+
+from db_handlers import get_schema_version, migrate_packet_db, deduplicate_packets, PACKET_DB_VERSION
+from db_connections import create_connection
+
+
+def migrate(db_name):
+    ''' Upgrade the packet database at db_name to the current schema, in place '''
+    conn = create_connection(db_name)
+    old_version = get_schema_version(conn)
+    logging.info(f'{db_name}: schema version {old_version} (current version is {PACKET_DB_VERSION})')
+
+    new_version = migrate_packet_db(conn)
+    conn.close()
+
+    if new_version == old_version:
+        logging.info('nothing to do')
+    else:
+        logging.info(f'migrated from version {old_version} to {new_version}')
+    return new_version
+
+
+def deduplicate(db_name, delete=False):
+    ''' List the duplicate packets in the packet database at db_name (the later copies of any
+        packet) -- and with delete=True, delete them. Returns the number found. '''
+    conn = create_connection(db_name)
+    try:
+        counts = deduplicate_packets(conn, delete=delete)
+    finally:
+        conn.close()
+
+    if counts and not delete:
+        logging.info(f'nothing deleted; run with --remove_duplicates to delete these {sum(counts.values())} packets '
+                     f'(back up {db_name} first)')
+    return sum(counts.values())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="VPM Ground Support Software -- Upgrade the packet database schema")
+    parser.add_argument("--db", required=False, type=str, default=None,
+                        help="path to the packet database. Defaults to packet_db_file, from GSS_settings.conf")
+    parser.add_argument("--find_duplicates", action='store_true', default=False,
+                        help="afterwards, count the duplicate packets in the database (without changing anything)")
+    parser.add_argument("--remove_duplicates", action='store_true', default=False,
+                        help="afterwards, delete the duplicate packets in the database (keeping the first copy of each)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(name)s]\t%(levelname)s\t%(message)s')
+
+    db_name = args.db
+    if db_name is None:
+        config = ConfigParser()
+        with open('GSS_settings.conf') as fp:
+            config.read_file(fp)
+        db_name = config['db_locations']['packet_db_file']
+
+    migrate(db_name)
+    if args.find_duplicates or args.remove_duplicates:
+        deduplicate(db_name, delete=args.remove_duplicates)
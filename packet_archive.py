@@ -0,0 +1,263 @@
+import numpy as np
+import os
+import logging
+import datetime
+
+from db_connections import get_connection, close_connections, table_exists, database_path, find_hashes
+from packet_identity import packet_hashes, known_packets, float_timestamps
+from packet_schema import PACKET_COLUMNS, FETCH_BATCH_SIZE, rows_to_table
+from change_feed import PROCESSING_STAGES, get_stage_cursor, processed_until
+from shard_store import SHARD_PERIODS, get_shards, commit_packet_db
+from segment_store import write_archive
+from time_handlers import unix_to_datetime64
+
+# Packets older than some age (and already made into products) can be moved out of the packet
+# database into the cold archive, by archive_packets.py: compressed, read-only files, one per
+# month (see segment_store.write_archive), in a directory next to the main packet database
+# (e.g. packets_archive/, for packets.db). The main database keeps the catalog (the archives
+# table), and the hashes of the archived packets, so they aren't taken in again. Readers
+# (get_packets_within_range and friends) fall back to the archive for times it covers.
+
+# Size of the archive files
+ARCHIVE_PERIOD = 'month'
+
+ARCHIVE_FIELDS = ['name', 'path', 't_min', 't_max', 'packet_count', 'added']
+
+def archive_root(conn):
+    ''' The directory for the cold archive of the packet database (conn) '''
+    root, ext = os.path.splitext(database_path(conn))
+    return root + '_archive'
+
+def get_archives(database, t1=None, t2=None, added_after=None):
+    '''
+    The catalog of the cold archive of the packet database (a list of dictionaries, in time
+    order), with the full path to each file -- only those with packets between Unix timestamps
+    t1 and t2, and added after added_after, if given.
+    '''
+    conn = get_connection(database, readonly=True)
+    if not table_exists(conn, 'archives'):
+        return []
+    root = os.path.dirname(database_path(conn))
+
+    sql = f"SELECT {', '.join(ARCHIVE_FIELDS)} FROM archives WHERE 1"
+    params = []
+    if t1 is not None:
+        sql += ' AND t_max > ?'
+        params.append(t1)
+    if t2 is not None:
+        sql += ' AND t_min < ?'
+        params.append(t2)
+    if added_after is not None:
+        sql += ' AND added > ?'
+        params.append(added_after)
+    cur = conn.cursor()
+    cur.execute(sql + ' ORDER BY t_min, name', params)
+
+    archives = [dict(zip(ARCHIVE_FIELDS, r)) for r in cur.fetchall()]
+    for a in archives:
+        a['path'] = os.path.join(root, a['path'])
+    return archives
+
+def drop_archived(conn, packets):
+    ''' packets (a PacketTable), less any which are in the cold archive already '''
+    if not table_exists(conn, 'archived_hashes') or \
+       conn.execute('SELECT 1 FROM archived_hashes LIMIT 1').fetchone() is None:
+        return packets
+    keep = ~known_packets(conn, 'archived_hashes', *packet_hashes(packets, near=True))
+    if np.all(keep):
+        return packets
+    logging.getLogger('write_to_db').debug(f'skipped {len(packets) - np.sum(keep)} packets in the archive')
+    return packets.take(keep)
+
+def create_archive_catalog(conn):
+    ''' The catalog of the cold archive (see archive_packets), and the hashes of the packets in it
+        (to skip duplicates with). Empty, until packets are archived. '''
+    conn.execute(''' CREATE TABLE IF NOT EXISTS archives (
+                        name TEXT PRIMARY KEY,
+                        path TEXT,
+                        t_min REAL,
+                        t_max REAL,
+                        packet_count INTEGER,
+                        added REAL,
+                        created REAL
+                    ); ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS archives_time_range ON archives (t_min, t_max)')
+    conn.execute(''' CREATE TABLE IF NOT EXISTS archived_hashes (
+                        hash INTEGER PRIMARY KEY
+                    ) WITHOUT ROWID; ''')
+
+def enable_incremental_vacuum(conn):
+    '''
+    Switch on auto_vacuum=INCREMENTAL (so vacuum_packet_db can give space back a bit at a time)
+    for a database created without it. That takes a full VACUUM -- once, here -- which rewrites
+    the whole file, so it takes a while, and needs as much free disk space again as the database.
+    (New databases have it from the start; see PACKET_DB_PRAGMAS.)
+    '''
+    logger = logging.getLogger('enable_incremental_vacuum')
+
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return
+    logger.info('switching on incremental vacuum (with a full VACUUM -- this may take a while)')
+    # (VACUUM can't run inside a transaction)
+    conn.commit()
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    conn.execute('VACUUM')
+
+def archive_packets(conn, before, processed_only=True):
+    '''
+    Move the packets in the packet database (conn is its read-write connection) with header
+    timestamps before Unix timestamp before into the cold archive, a file per month -- only
+    those every stage has processed already (see processed_until; so nothing at all, until each
+    of the PROCESSING_STAGES has acknowledged the change feed), unless processed_only is False.
+    They're deleted from the database, and from its unsealed shards (run vacuum_packet_db
+    afterwards, to give the space back). Sealed shards are read-only, so they're archived whole,
+    once their period is over by before and all their packets are processed: the shard's file is
+    deleted, and it's dropped from the catalog. Commits after each month. Returns the number of
+    packets archived.
+    '''
+    logger = logging.getLogger('archive_packets')
+
+    commit_packet_db(conn)
+    where = 'header_timestamp < ?'
+    params = [before]
+    until = None
+    if processed_only:
+        until = processed_until(conn)
+        if until is None:
+            missing = [stage for stage in PROCESSING_STAGES if get_stage_cursor(conn, stage) is None]
+            logger.warning(f"not archiving anything: no change feed cursor for {', '.join(missing)} yet "
+                           f"(run the processing scripts first, or archive with --all)")
+            return 0
+        where += ' AND added <= ?'
+        params.append(until)
+
+    num_archived = archive_store(conn, conn, before, where, params)
+
+    for s in get_shards(conn):
+        if s['t_min'] is None or s['t_min'] >= before or not os.path.exists(s['path']):
+            continue
+        if not s['sealed']:
+            num_archived += archive_store(conn, get_connection(s['path']), before, where, params, shard=s['name'])
+            continue
+
+        shard = get_connection(s['path'], readonly=True)
+        last_added = shard.execute('SELECT MAX(added) FROM packets').fetchone()[0]
+        # (Anything without a header timestamp can't go in the archive, so the shard stays)
+        untimed = shard.execute('SELECT COUNT(*) FROM packets WHERE header_timestamp IS NULL OR header_timestamp >= ?',
+                                (s['period_end'],)).fetchone()[0]
+        if s['period_end'] > before or untimed or (until is not None and last_added is not None and last_added > until):
+            logger.debug(f"leaving sealed shard {s['name']} (not all of it is due for the archive yet)")
+            continue
+        num_archived += archive_store(conn, shard, s['period_end'], '1', [], delete=False)
+
+        conn.execute('DELETE FROM shards WHERE name = ?', (s['name'],))
+        conn.commit()
+        close_connections(s['path'])
+        os.remove(s['path'])
+        logger.info(f"archived sealed shard {s['name']}; removed {s['path']}")
+
+    if num_archived == 0:
+        logger.info('nothing to archive')
+    return num_archived
+
+def archive_store(conn, store, before, where, params, delete=True, shard=None):
+    '''
+    The work of archive_packets, for the packets in one database (store: the main packet
+    database's read-write connection, conn, or a connection to one of its shards, named shard)
+    with header timestamps before Unix timestamp before which match the SQL condition where
+    (with parameters params). The archive files go in the catalog of conn, a month at a time;
+    if delete, the packets are deleted from store after each month is committed to the
+    catalog. (A shard's packets which are in the archive already -- from a run which stopped
+    in between -- are deleted, rather than archived again.) Returns the number of packets archived.
+    '''
+    logger = logging.getLogger('archive_packets')
+
+    t_min = store.execute(f'SELECT MIN(header_timestamp) FROM packets WHERE {where}', params).fetchone()[0]
+    if t_min is None:
+        return 0
+
+    root = archive_root(conn)
+    os.makedirs(root, exist_ok=True)
+    db_root = os.path.dirname(database_path(conn))
+
+    periods = np.arange(*unix_to_datetime64([t_min, before]).astype(SHARD_PERIODS[ARCHIVE_PERIOD]) + [0, 1])
+    num_archived = 0
+    for period in periods:
+        start, end = [float(t) for t in np.array([period, period + 1]).astype('datetime64[us]').astype(np.int64)/1e6]
+        cur = store.cursor()
+        cur.execute(f'''SELECT rowid, {', '.join(PACKET_COLUMNS)} FROM packets
+                        WHERE header_timestamp >= ? AND header_timestamp < ? AND {where}''', [start, end] + params)
+        rows = []
+        while True:
+            batch = cur.fetchmany(FETCH_BATCH_SIZE)
+            if not batch:
+                break
+            rows.extend(batch)
+        if store is not conn and rows:
+            hash_col = 1 + PACKET_COLUMNS.index('hash')
+            archived = set(find_hashes(conn, 'archived_hashes', [r[hash_col] for r in rows]))
+            if archived:
+                logger.info(f'{len(archived)} packets from {period} are in the archive already')
+                stale = [r for r in rows if r[hash_col] in archived]
+                rows = [r for r in rows if r[hash_col] not in archived]
+                if delete:
+                    store.executemany('DELETE FROM packets WHERE rowid = ?', ((r[0],) for r in stale))
+                    store.commit()
+        if not rows:
+            continue
+
+        # (More packets for a month we've archived before go in a file of their own)
+        name, k = str(period), 1
+        while os.path.exists(os.path.join(root, name + '.npz')) or \
+              conn.execute('SELECT 1 FROM archives WHERE name = ?', (name,)).fetchone() is not None:
+            name = f'{period}_{k}'
+            k += 1
+        path = os.path.join(root, name + '.npz')
+        packets = write_archive(path, rows_to_table([r[1:] for r in rows], PACKET_COLUMNS))
+
+        t = float_timestamps(packets)
+        conn.execute(f'''INSERT INTO archives ({', '.join(ARCHIVE_FIELDS)}, created) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     (name, os.path.relpath(path, db_root), float(t.min()), float(t.max()), len(packets),
+                      float(np.max(packets['added'])), datetime.datetime.now().timestamp()))
+        conn.executemany('INSERT OR IGNORE INTO archived_hashes (hash) VALUES (?)', ((h,) for h in packets['hash'].tolist()))
+        if delete:
+            store.executemany('DELETE FROM packets WHERE rowid = ?', ((r[0],) for r in rows))
+        if shard is not None:
+            conn.execute('UPDATE shards SET packet_count = packet_count - ? WHERE name = ?', (len(packets), shard))
+        # (The catalog first: if we stop in between, the packets are in both for a while, rather than neither)
+        conn.commit()
+        if store is not conn:
+            store.commit()
+
+        logger.info(f"archived {len(packets)} packets from {period}{f' (shard {shard})' if shard else ''} to {path}")
+        num_archived += len(packets)
+
+    return num_archived
+
+def vacuum_packet_db(conn, max_pages=None):
+    '''
+    Give the space freed up in the packet database and its unsealed shards (e.g., by
+    archive_packets) back to the file system, with an incremental vacuum (of up to max_pages
+    pages each; default all of them). Needs auto_vacuum=INCREMENTAL, which new databases have,
+    and migrate_packet_db switches on for old ones; without it, this does nothing.
+    '''
+    commit_packet_db(conn)
+    incremental_vacuum(conn, max_pages)
+    for s in get_shards(conn):
+        if not s['sealed'] and os.path.exists(s['path']):
+            incremental_vacuum(get_connection(s['path']), max_pages)
+
+def incremental_vacuum(conn, max_pages=None):
+    ''' The incremental vacuum of vacuum_packet_db, for the one database conn (a read-write
+        connection) is to '''
+    logger = logging.getLogger('vacuum_packet_db')
+
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        logger.warning(f'{database_path(conn)} has no incremental vacuum (is it migrated?); not vacuuming')
+        return
+
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    # (Through executescript, which runs it to the end -- execute only frees the first page)
+    conn.executescript(f'PRAGMA incremental_vacuum({max_pages or 0});')
+    logger.info(f"freed {free_pages - conn.execute('PRAGMA freelist_count').fetchone()[0]} pages "
+                f"of {database_path(conn)}")
@@ -0,0 +1,110 @@
+import numpy as np
+import datetime
+import hashlib
+
+from db_connections import find_hashes
+
+# The fields which identify a packet from the payload, along with its data segment.
+# Everything else (the file name, and the header / ground-station timestamps) depends
+# on how the packet got to us -- so the same packet, received in both a .TLM file and
+# a KSat .CSV file, gets the same identity.
+PACKET_ID_FIELDS = ['dtype', 'exp_num', 'start_ind', 'bytecount']
+# ... but the same fields and data do turn up again later (exp_num wraps around every 256
+# experiments, and one empty packet looks like another), so the identity includes the
+# header timestamp too, to within PACKET_TIME_TOLERANCE seconds -- which has to be wider
+# than the difference between the TLM and CSV timestamps of the same packet. The timestamps
+# are cut into windows twice that long, and each packet is looked up in its own window and
+# the nearer of the ones either side (see packet_hashes): so copies of a packet less than
+# PACKET_TIME_TOLERANCE apart always match, and copies three times that apart never do. In
+# between, it depends where they fall in their windows: e.g., the first copy's window is
+# looked up from the second's only if the second is in that window, or in the first half of
+# the next one -- so copies 90 s apart match if the first is in the first 90 s of its window,
+# and not otherwise. The price of the tolerance is that two genuinely different packets with
+# the same fields and data (e.g., two empty packets, with the same experiment number) can be
+# taken for one, if they arrive less than three minutes apart.
+PACKET_TIME_TOLERANCE = 60
+
+def packet_digest(fields, data):
+    ''' A 64-bit digest of the identifying fields and data bytes of a packet, as a signed integer '''
+    h = hashlib.blake2b(digest_size=8)
+    h.update('|'.join(str(f) for f in fields).encode())
+    h.update(b'|')
+    h.update(data)
+    return int.from_bytes(h.digest(), 'big', signed=True)
+
+def time_windows(timestamps):
+    '''
+    The time window of each of the header timestamps (Unix timestamps; NaN for none), for
+    packet identities (see PACKET_TIME_TOLERANCE), and the nearer of the windows either side.
+    Returns two lists (None for a missing timestamp).
+    '''
+    t = np.asarray(timestamps, dtype=np.float64)
+    width = 2*PACKET_TIME_TOLERANCE
+    valid = np.isfinite(t)
+    windows = np.floor(np.where(valid, t, 0)/width).astype(np.int64)
+    near = np.where(t - windows*width < PACKET_TIME_TOLERANCE, windows - 1, windows + 1)
+    windows, near = windows.astype(object), near.astype(object)
+    windows[~valid] = None
+    near[~valid] = None
+    return windows.tolist(), near.tolist()
+
+def packet_hash(el):
+    '''
+    The identity of a single packet (a packet dictionary): a digest of its
+    PACKET_ID_FIELDS, header timestamp window (see time_windows) and data segment.
+    Unlike Python's hash(), this is the same from one run to the next, so it can be
+    stored and used to spot duplicates.
+    '''
+    t = el.get('header_timestamp')
+    window = time_windows([np.nan if t is None else t])[0]
+    return packet_digest([el[k] for k in PACKET_ID_FIELDS] + window, np.asarray(el['data'], dtype=np.uint8).tobytes())
+
+def packet_hashes(packets, near=False):
+    '''
+    packet_hash, for every packet in a PacketTable (returns a list). With near=True, also
+    the hashes they'd have in the nearer neighbouring time window -- to look up as well,
+    to find copies of them with timestamps a little way off (returns both lists).
+    '''
+    fields = list(zip(*[packets[k].tolist() for k in PACKET_ID_FIELDS]))
+    windows, near_windows = time_windows(float_timestamps(packets))
+    payload = packets.payload
+    data = [payload[a:b].tobytes() for a, b in zip(packets.bounds[:-1], packets.bounds[1:])]
+    hashes = [packet_digest(f + (w,), d) for f, w, d in zip(fields, windows, data)]
+    if not near:
+        return hashes
+    return hashes, [packet_digest(f + (w,), d) for f, w, d in zip(fields, near_windows, data)]
+
+def first_copies(hashes, near_hashes):
+    ''' True for the first copy of each packet in a batch, in order (by their hashes, and
+        near hashes -- see packet_hashes) '''
+    hashes = np.asarray(hashes, dtype=np.int64)
+    near_hashes = np.asarray(near_hashes, dtype=np.int64)
+    first = np.zeros(len(hashes), dtype=bool)
+    if len(hashes) == 0:
+        return first
+    unique, first_index = np.unique(hashes, return_index=True)
+    first[first_index] = True
+    i = np.minimum(np.searchsorted(unique, near_hashes), len(unique) - 1)
+    first &= ~((unique[i] == near_hashes) & (first_index[i] < np.arange(len(hashes))))
+    return first
+
+
+def known_packets(conn, table, hashes, near_hashes):
+    ''' True for the packets whose hash, or near hash (see packet_hashes), is in table already '''
+    hashes = np.asarray(hashes, dtype=np.int64)
+    near_hashes = np.asarray(near_hashes, dtype=np.int64)
+    found = find_hashes(conn, table, np.concatenate([hashes, near_hashes]))
+    return np.isin(hashes, found) | np.isin(near_hashes, found)
+
+def add_metadata(in_list):
+    # Add metadata to each entry -- a hash value, and the time added.
+    for el in in_list:
+        el['hash'] = packet_hash(el)
+        el['added'] = datetime.datetime.now().timestamp()
+
+def float_timestamps(packets):
+    ''' The header_timestamp column of packets as floats (NaN where there isn't one) '''
+    timestamps = packets['header_timestamp']
+    if timestamps.dtype == object:
+        return np.array([np.nan if t is None else t for t in timestamps], dtype=np.float64)
+    return timestamps.astype(np.float64)
@@ -0,0 +1,121 @@
+import numpy as np
+import logging
+import datetime
+
+from packet_table import PacketTable, make_column
+from packet_identity import packet_hashes, first_copies, known_packets
+from change_feed import record_changes
+
+# The packets table: its settings and schema, and getting packets (PacketTables) in and out of it.
+
+# Settings for the packet database. Write-ahead logging lets readers carry on while
+# packets are being written (and makes commits much cheaper); with WAL, synchronous=NORMAL
+# is still safe against corruption (a power cut can only lose the last few commits).
+# The log is checkpointed into the database every ~4 MB (1000 pages) of commits, as far as
+# the readers allow, and cut back to 64 MB whenever it starts over (see also checkpoint_packet_db).
+# New databases are set up for incremental vacuuming (see vacuum_packet_db).
+# (On top of CONNECTION_PRAGMAS.)
+PACKET_DB_PRAGMAS = [
+    'PRAGMA auto_vacuum=INCREMENTAL',
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA wal_autocheckpoint=1000',
+    'PRAGMA journal_size_limit=67108864',
+]
+
+sql_create_packets_table = """ CREATE TABLE IF NOT EXISTS packets (
+                                        data BLOB,
+                                        start_ind INTEGER,
+                                        dtype TEXT,
+                                        exp_num INTEGER,
+                                        bytecount INTEGER,
+                                        checksum_verify INTEGER,
+                                        packet_length INTEGER,
+                                        fname TEXT,
+                                        header_timestamp REAL,
+                                        file_index INTEGER,
+                                        hash INTEGER,
+                                        header_ns INTEGER,
+                                        header_epoch_sec INTEGER,
+                                        header_reboots INTEGER,
+                                        added REAL
+                                    ); """
+
+# Columns of the packets table
+PACKET_COLUMNS = ['data', 'start_ind', 'dtype', 'exp_num', 'bytecount', 'checksum_verify', 'packet_length',
+                  'fname', 'header_timestamp', 'file_index', 'hash', 'header_ns', 'header_epoch_sec',
+                  'header_reboots', 'added']
+
+# Number of rows to fetch from the database at a time
+FETCH_BATCH_SIZE = 10000
+
+def create_packet_indexes(conn):
+    ''' Indexes for the stage queries (get_packets_within_range) and the change feed (record_changes) '''
+    # Packets of one type, by time -- survey, status and burst all select on both
+    conn.execute('CREATE INDEX IF NOT EXISTS packets_dtype_time ON packets (dtype, header_timestamp)')
+    # Packets of any type, by time
+    conn.execute('CREATE INDEX IF NOT EXISTS packets_time ON packets (header_timestamp)')
+    # Newly-added packets (and the time range they cover, straight from the index)
+    conn.execute('CREATE INDEX IF NOT EXISTS packets_added ON packets (added, header_timestamp)')
+    # Give the query planner some statistics to choose between them with
+    conn.execute('ANALYZE')
+
+def insert_packets(conn, packets, table='packets', hashes=None, near_hashes=None, feed=None):
+    ''' The insert for write_to_db: packets (a PacketTable) into table, with their
+        packet_hashes and near hashes (if they've already been worked out), less any
+        copies of packets already in table, or earlier in the batch. The new packets go in
+        the change feed of feed (the main packet database's connection), if conn is a shard's.
+        Returns the number written. '''
+    logger = logging.getLogger('write_to_db')
+
+    if hashes is None:
+        hashes, near_hashes = packet_hashes(packets, near=True)
+    keep = first_copies(hashes, near_hashes) & ~known_packets(conn, table, hashes, near_hashes)
+    if not np.all(keep):
+        logger.debug(f'skipped {len(packets) - np.sum(keep)} packets already in the database')
+        packets = packets.take(keep)
+        hashes = np.asarray(hashes, dtype=np.int64)[keep]
+    if len(packets) == 0:
+        return 0
+
+    # add metadata
+    columns = dict(packets.columns)
+    added = datetime.datetime.now().timestamp()
+    columns['hash'] = hashes
+    columns['added'] = [added]*len(packets)
+
+    names = ['data'] + list(columns.keys())
+    values = [[packets.payload[a:b].tobytes() for a, b in zip(packets.bounds[:-1], packets.bounds[1:])]]
+    values.extend(v.tolist() if isinstance(v, np.ndarray) else v for v in columns.values())
+
+    sql = f"INSERT OR IGNORE INTO {table} ({', '.join(names)}) VALUES ({', '.join('?'*len(names))})"
+    changes_before = conn.total_changes
+    cur = conn.cursor()
+    cur.executemany(sql, zip(*values))
+    num_written = conn.total_changes - changes_before
+
+    if num_written < len(packets):
+        logger.debug(f'skipped {len(packets) - num_written} packets already in the database')
+    if num_written > 0 and table == 'packets':
+        record_changes(conn, added, feed=feed)
+
+    return num_written
+
+def rows_to_table(rows, names):
+    '''
+    Build a PacketTable from database rows (tuples of the columns in names). The data
+    blobs are joined into a single buffer, which the payload array is a view onto.
+    If there's no data column, the packets get empty data segments.
+    '''
+    values = list(zip(*rows)) if rows else [()]*len(names)
+    columns = {k: make_column(list(v), k) for k, v in zip(names, values) if k != 'data'}
+
+    if 'data' not in names:
+        return PacketTable(columns, bounds=np.zeros(len(rows) + 1, dtype=np.int64))
+
+    blobs = values[names.index('data')]
+    payload = np.frombuffer(b''.join(blobs), dtype=np.uint8)
+    bounds = np.zeros(len(blobs) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in blobs], out=bounds[1:])
+    return PacketTable(columns, payload, bounds)
@@ -0,0 +1,318 @@
+import numpy as np
+
+
+# Types for the packet metadata columns we know about. Anything else gets
+# whatever type numpy infers for it. Columns with missing entries (e.g., TLM
+# packets don't have a file_index, and CSV packets don't have the CCSDS header
+# fields) are stored as objects, with None marking the gaps.
+COLUMN_TYPES = {
+    'start_ind': np.int64,
+    'dtype': 'U1',
+    'exp_num': np.uint8,
+    'bytecount': np.int64,
+    'checksum_verify': bool,
+    'packet_length': np.int64,
+    'fname': object,
+    'header_timestamp': np.float64,
+    'file_index': np.int64,
+    'hash': np.int64,
+    'header_ns': np.int64,
+    'header_epoch_sec': np.int64,
+    'header_reboots': np.int64,
+    'added': np.float64,
+}
+
+# How many rows to unpack into dictionaries at a time, when iterating
+ITER_CHUNK_SIZE = 4096
+
+
+def make_column(values, name=None, types=COLUMN_TYPES):
+    ''' Cast a list of values to a typed column (or an object column, if any are missing).
+        types gives the types of the columns we know about, by name. '''
+    if any(v is None for v in values):
+        col = np.empty(len(values), dtype=object)
+        col[:] = values
+        return col
+    if name in types:
+        if types[name] is object:
+            col = np.empty(len(values), dtype=object)
+            col[:] = values
+            return col
+        return np.array(values, dtype=types[name])
+    return np.array(values)
+
+
+def concatenate_columns(column_sets, lengths):
+    '''
+    Join dictionaries of columns end to end. Columns missing from some of them are
+    filled in with None there (and become object columns).
+    inputs:
+        column_sets:    list of dictionaries of 1d arrays
+        lengths:        the number of rows in each
+    '''
+    keys = []
+    for c in column_sets:
+        for k in c:
+            if k not in keys:
+                keys.append(k)
+
+    columns = dict()
+    for k in keys:
+        parts = []
+        for c, n in zip(column_sets, lengths):
+            if k in c:
+                parts.append(c[k])
+            else:
+                parts.append(np.full(n, None, dtype=object))
+        if any(p.dtype == object for p in parts) and not all(p.dtype == object for p in parts):
+            parts = [p.astype(object) for p in parts]
+        columns[k] = np.concatenate(parts)
+    return columns
+
+
+def pack_payloads(buffer, offsets, lengths):
+    '''
+    Gather variable-length segments out of a 1d buffer, into one contiguous array.
+    inputs:
+        buffer:     1d uint8 array
+        offsets:    start index of each segment within buffer
+        lengths:    length of each segment
+    outputs:
+        payload:    1d uint8 array of the segments, end to end
+        bounds:     (num_segments + 1) array; segment i is payload[bounds[i]:bounds[i+1]]
+    '''
+    lengths = np.asarray(lengths, dtype=np.int64)
+    bounds = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=bounds[1:])
+    index = np.arange(bounds[-1]) + np.repeat(np.asarray(offsets, dtype=np.int64) - bounds[:-1], lengths)
+    return buffer[index], bounds
+
+
+class PacketTable(object):
+    '''
+    A columnar container for decoded packets.
+
+    Rather than a list of per-packet dictionaries, each holding its data segment
+    as a list of Python ints (~15-20 kB per packet!), the packets' data segments
+    are stored end-to-end in one contiguous uint8 array, and the metadata fields
+    (start_ind, dtype, exp_num, bytecount, header_timestamp, fname...) are stored
+    as typed numpy arrays, one entry per packet.
+
+    For compatibility with the rest of the code, a PacketTable behaves like a
+    list of packet dictionaries, too:
+        len(table), bool(table)     number of packets
+        for p in table:             yields packet dictionaries; p['data'] is a
+                                    (read-only) uint8 view into the payload array
+        table[i]                    the i'th packet dictionary
+        table + other               concatenation (with another table, or a list of packets)
+    and supports columnar access:
+        table['header_timestamp']   the column array
+        table[mask], table[inds],
+        table[i:j]                  a new PacketTable, with the selected packets
+    '''
+
+    def __init__(self, columns=None, payload=None, bounds=None):
+        '''
+        inputs:
+            columns:    dictionary of 1d metadata arrays, all of the same length
+            payload:    1d uint8 array of data segments, end to end
+            bounds:     (num_packets + 1) array; packet i's data is payload[bounds[i]:bounds[i+1]]
+        '''
+        self.columns = dict(columns) if columns else dict()
+        num_packets = len(bounds) - 1 if bounds is not None else \
+                      (len(next(iter(self.columns.values()))) if self.columns else 0)
+        self.payload = np.zeros(0, dtype=np.uint8) if payload is None else np.asarray(payload, dtype=np.uint8)
+        self.bounds = np.zeros(num_packets + 1, dtype=np.int64) if bounds is None else np.asarray(bounds, dtype=np.int64)
+        self.payload.flags.writeable = False
+
+        for k, v in self.columns.items():
+            if len(v) != num_packets:
+                raise ValueError(f'column {k} has length {len(v)}; expected {num_packets}')
+
+    # ---------------- Construction ----------------
+    @classmethod
+    def from_packets(cls, packets):
+        ''' Build a PacketTable from a list of packet dictionaries (or return a PacketTable as-is) '''
+        if isinstance(packets, PacketTable):
+            return packets
+        packets = list(packets)
+
+        keys = []
+        for p in packets:
+            for k in p:
+                if k != 'data' and k not in keys:
+                    keys.append(k)
+
+        columns = {k: make_column([p.get(k) for p in packets], k) for k in keys}
+        segments = [np.asarray(p['data'], dtype=np.uint8) for p in packets]
+        lengths = [len(s) for s in segments]
+        bounds = np.zeros(len(packets) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=bounds[1:])
+        payload = np.concatenate(segments) if segments else np.zeros(0, dtype=np.uint8)
+
+        return cls(columns, payload, bounds)
+
+    @classmethod
+    def concatenate(cls, tables):
+        ''' Join a list of PacketTables (or lists of packets) end to end '''
+        tables = [cls.from_packets(t) for t in tables]
+        tables = [t for t in tables if len(t)]
+        if not tables:
+            return cls()
+        if len(tables) == 1:
+            return tables[0]
+
+        columns = concatenate_columns([t.columns for t in tables], [len(t) for t in tables])
+        payload = np.concatenate([t.payload[t.bounds[0]:t.bounds[-1]] for t in tables])
+        lengths = np.concatenate([t.lengths for t in tables])
+        bounds = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=bounds[1:])
+
+        return cls(columns, payload, bounds)
+
+    # ---------------- Properties ----------------
+    @property
+    def lengths(self):
+        ''' Number of data bytes stored for each packet '''
+        return np.diff(self.bounds)
+
+    @property
+    def nbytes(self):
+        ''' Approximate memory footprint, in bytes '''
+        return self.payload.nbytes + self.bounds.nbytes + \
+               sum(8*len(c) if c.dtype == object else c.nbytes for c in self.columns.values())
+
+    def keys(self):
+        return ['data'] + list(self.columns.keys())
+
+    def __len__(self):
+        return len(self.bounds) - 1
+
+    def __repr__(self):
+        return f'PacketTable({len(self)} packets, {self.payload.nbytes} payload bytes, columns={list(self.columns.keys())})'
+
+    # ---------------- Access ----------------
+    def data(self, i):
+        ''' The data segment of packet i, as a uint8 array '''
+        return self.payload[self.bounds[i]:self.bounds[i + 1]]
+
+    def payload_matrix(self, width=None, fill=0):
+        '''
+        The data segments as a 2d array (num_packets x width), left-justified and
+        padded with fill. Also returns the number of valid bytes in each row.
+        (If every segment is exactly width bytes long, this is a read-only view onto
+        the payload array, rather than a copy.)
+        '''
+        lengths = self.lengths
+        if width is None:
+            width = int(lengths.max()) if len(lengths) else 0
+        if len(self) and width > 0 and np.all(lengths == width):
+            return self.payload[self.bounds[0]:self.bounds[-1]].reshape(len(self), width), lengths
+        lengths = np.minimum(lengths, width)
+        out = np.full((len(self), width), fill, dtype=np.uint8)
+        rows = np.repeat(np.arange(len(self)), lengths)
+        cols = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        out[rows, cols] = self.payload[self.bounds[:-1][rows] + cols]
+        return out, lengths
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key == 'data':
+                return [self.data(i) for i in range(len(self))]
+            return self.columns[key]
+
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            if key < 0 or key >= len(self):
+                raise IndexError('packet index out of range')
+            p = {'data': self.data(key)}
+            for k, v in self.columns.items():
+                p[k] = v[key].item() if isinstance(v[key], np.generic) else v[key]
+            return p
+
+        return self.take(key)
+
+    def take(self, key):
+        ''' A new PacketTable with the packets selected by key (a slice, boolean mask, or index array) '''
+        inds = np.arange(len(self))[key]
+        columns = {k: v[inds] for k, v in self.columns.items()}
+        payload, bounds = pack_payloads(self.payload, self.bounds[:-1][inds], self.lengths[inds])
+        return PacketTable(columns, payload, bounds)
+
+    def where(self, **conditions):
+        '''
+        Select packets by column values, e.g. table.where(dtype='S'), or
+        table.where(dtype=['E','B','G'], exp_num=3).
+        '''
+        mask = np.ones(len(self), dtype=bool)
+        for k, v in conditions.items():
+            if isinstance(v, (list, tuple, set, np.ndarray)):
+                mask &= np.isin(self.columns[k], list(v))
+            else:
+                mask &= (self.columns[k] == v)
+        return self.take(mask)
+
+    def sort(self, key='header_timestamp'):
+        ''' A new PacketTable, sorted (stably) by the column key '''
+        return self.take(np.argsort(self.columns[key], kind='stable'))
+
+    def __iter__(self):
+        names = list(self.columns.keys())
+        for chunk_start in range(0, len(self), ITER_CHUNK_SIZE):
+            chunk = slice(chunk_start, min(chunk_start + ITER_CHUNK_SIZE, len(self)))
+            values = [self.columns[k][chunk].tolist() for k in names]
+            for i, row in enumerate(zip(*values)):
+                p = {'data': self.data(chunk_start + i)}
+                p.update(zip(names, row))
+                yield p
+
+    def __add__(self, other):
+        return PacketTable.concatenate([self, other])
+
+    def __radd__(self, other):
+        return PacketTable.concatenate([other, self])
+
+    def to_packets(self):
+        ''' Unpack into a list of packet dictionaries (with data segments as lists of ints) '''
+        packets = []
+        for p in self:
+            p['data'] = p['data'].tolist()
+            packets.append(p)
+        return packets
+
+
+def select_packets(packets, dtypes):
+    '''
+    Select packets with dtype in dtypes, from either a PacketTable or a list of
+    packet dictionaries. Returns the same kind of container it was given.
+    '''
+    if isinstance(packets, PacketTable):
+        return packets.where(dtype=list(dtypes))
+    return list(filter(lambda packet: packet['dtype'] in dtypes, packets))
+
+
+def rebatch(tables, batch_size):
+    '''
+    Re-chunk a stream of PacketTables (or lists of packets) into PacketTables of
+    exactly batch_size packets (the last one may be shorter). A generator.
+    '''
+    pending = []
+    num_pending = 0
+    for t in tables:
+        t = PacketTable.from_packets(t)
+        while len(t):
+            n = min(batch_size - num_pending, len(t))
+            if n == len(t):
+                pending.append(t)
+                t = PacketTable()
+            else:
+                pending.append(t[:n])
+                t = t[n:]
+            num_pending += n
+            if num_pending == batch_size:
+                yield PacketTable.concatenate(pending)
+                pending = []
+                num_pending = 0
+    if num_pending:
+        yield PacketTable.concatenate(pending)
@@ -4,6 +4,7 @@ import os
 import pickle
 from data_handlers import decode_status
 from data_handlers import decode_burst_command
+from time_handlers import unix_to_datetime
 import logging
 
 def packet_inspector(fig, packets):
@@ -53,7 +54,7 @@ def packet_inspector(fig, packets):
 
     taxis = np.arange(len(packets))    
     tstamps = np.array([p['header_timestamp'] for p in packets])
-    dts = np.array([datetime.datetime.utcfromtimestamp(p['header_timestamp']) for p in packets])
+    dts = unix_to_datetime([p['header_timestamp'] for p in packets])
     dtypes  = np.array([p['dtype'] for p in packets])
 
     ax.plot(dts[dtypes=='E'], 1*np.ones_like(tstamps[dtypes=='E']),'.', label='E',      picker=5)
@@ -66,7 +67,7 @@ def packet_inspector(fig, packets):
 
 
     # ax.hlines([p['header_timestamp'] for p in I_packets], 0, len(packets))
-    ax.vlines([datetime.datetime.utcfromtimestamp(p['header_timestamp']) for p in I_packets], 0, 6, alpha=0.7)
+    ax.vlines(unix_to_datetime([p['header_timestamp'] for p in I_packets]), 0, 6, alpha=0.7)
     ax.legend()
     # ax.set_xlabel('arrival index')
     ax.set_xlabel('Header Timestamp')
@@ -117,7 +118,7 @@ def packet_inspector(fig, packets):
 
             logger.info(f"\tdtype: {packets[x]['dtype']}")
             logger.info(f"\theader timestamp: {packets[x]['header_timestamp']}" +\
-            f" ({datetime.datetime.utcfromtimestamp(packets[x]['header_timestamp'])})")
+            f" ({unix_to_datetime(packets[x]['header_timestamp'])})")
             logger.info(f"\tExp num: {packets[x]['exp_num']}")
             logger.info(f"\tData indexes: [{packets[x]['start_ind']}:" +\
                 f"{packets[x]['start_ind'] + packets[x]['bytecount']}]")
@@ -12,6 +12,7 @@ import argparse
 from file_handlers import read_burst_XML
 from data_handlers import decode_status
 from data_handlers import decode_uBBR_command
+from time_handlers import unix_to_datetime
 import pickle
 
 def plot_burst_TD(fig, burst, cal_data = None):
@@ -373,7 +374,7 @@ def plot_burst_FD(fig, burst, cal_data = None):
         B_FD.set_xticks(xtix)
         B_FD.set_xticks(minorticks, minor=True)
         E_FD.set_xticklabels([])
-        B_FD.set_xticklabels([datetime.datetime.utcfromtimestamp(x).strftime("%H:%M:%S") for x in xtix])
+        B_FD.set_xticklabels([x.strftime("%H:%M:%S") for x in unix_to_datetime(xtix)])
 
         fig.autofmt_xdate()
 
@@ -5,6 +5,7 @@ import logging
 from compute_ground_track import load_TLE_library, get_position_from_TLE_library
 from matplotlib.cm import get_cmap
 from configparser import ConfigParser
+from time_handlers import unix_to_datetime
 
 def plot_burst_map(fig, gps_data, 
         show_terminator = True, plot_trajectory=True, show_transmitters=True,
@@ -33,7 +34,7 @@ def plot_burst_map(fig, gps_data,
             # Find the median timestamp to use:
             avg_ts = np.mean([k['timestamp'] for k in gps_data if k['time_status'] > 20])
 
-            CS=m.nightshade(datetime.datetime.utcfromtimestamp(avg_ts))
+            CS=m.nightshade(unix_to_datetime(avg_ts))
         except:
             logger.warning('Problem plotting day/night terminator')
 
@@ -59,7 +60,7 @@ def plot_burst_map(fig, gps_data,
             TLE_lib = load_TLE_library(TLE_file)
 
             avg_ts = np.mean([k['timestamp'] for k in gps_data if k['time_status'] > 20])
-            t_mid = datetime.datetime.utcfromtimestamp(avg_ts)
+            t_mid = unix_to_datetime(avg_ts)
             t1 = t_mid - datetime.timedelta(minutes=15)
             t2 = t_mid + datetime.timedelta(minutes=15)
 
@@ -107,8 +108,9 @@ def plot_burst_map(fig, gps_data,
     m_ax.legend()
 
     gstr = ''
-    for entry in gps_data:
-        time = datetime.datetime.strftime(datetime.datetime.utcfromtimestamp(entry['timestamp']),'%D %H:%M:%S')
+    gps_times = unix_to_datetime([entry['timestamp'] for entry in gps_data])
+    for entry, gps_time in zip(gps_data, gps_times):
+        time = datetime.datetime.strftime(gps_time,'%D %H:%M:%S')
         tloc = entry['time_status'] > 20
         ploc = entry['solution_status'] ==0
         gstr+= '{:s} ({:1.2f}, {:1.2f}): time lock: {:b} position lock: {:b}\n'.format(time, entry['lat'], entry['lon'], tloc,ploc)
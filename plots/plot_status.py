@@ -10,6 +10,7 @@ import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator
 import matplotlib.gridspec as GS
 import argparse
+from time_handlers import unix_to_datetime
 
 
 def plot_ubbr_configuration(data,filename='bbr_config.png', show_plots=False):
@@ -40,12 +41,13 @@ def plot_ubbr_configuration(data,filename='bbr_config.png', show_plots=False):
 
     for S in sorted(dd, key = lambda f: f['header_timestamp']):
         if S['bbr_config'] is not None:    
-            bbr_data['T'].append(datetime.datetime.utcfromtimestamp(S['header_timestamp']))
+            bbr_data['T'].append(S['header_timestamp'])
             for k, v in S['bbr_config'].items():
                 if k in bbr_data:
                     bbr_data[k].append(v)
                 else:
                     bbr_data[k] = [v]
+    bbr_data['T'] = list(unix_to_datetime(bbr_data['T']))
                     
 
     # We probably don't care about the ADC resets and presets, etc
@@ -101,16 +103,17 @@ def plot_system_status(data, filename ='system_status.pdf', show_plots=False):
 
     for S in sorted(dd, key = lambda f: f['header_timestamp']):
         if S['bbr_config'] is not None:    
-            bbr_data['T'].append(datetime.datetime.utcfromtimestamp(S['header_timestamp']))
+            bbr_data['T'].append(S['header_timestamp'])
             for k, v in S['bbr_config'].items():
                 if k in bbr_data:
                     bbr_data[k].append(v)
                 else:
                     bbr_data[k] = [v]
+    bbr_data['T'] = list(unix_to_datetime(bbr_data['T']))
 
 
     for S in sorted(dd, key = lambda f: f['header_timestamp']):
-        sys_data['T'].append(datetime.datetime.utcfromtimestamp(S['header_timestamp']))
+        sys_data['T'].append(S['header_timestamp'])
         for k, v in S.items():
             if k in ['bbr_config','burst_config']:
                 continue
@@ -119,6 +122,7 @@ def plot_system_status(data, filename ='system_status.pdf', show_plots=False):
                     sys_data[k].append(v)
                 else:
                     sys_data[k] = [v]
+    sys_data['T'] = list(unix_to_datetime(sys_data['T']))
 
 
     # --------------- Latex Plot Beautification --------------------------
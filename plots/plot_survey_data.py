@@ -12,6 +12,8 @@ import argparse
 import os
 import math
 from file_handlers import read_survey_XML
+from time_handlers import unix_to_datetime
+from survey_frame import SurveyFrame
 # from mpl_toolkits.basemap import Basemap
 # from scipy.interpolate import interp1d, interp2d
 
@@ -29,10 +31,10 @@ def plot_survey_data(S_data, filename="survey_data.pdf", show_plots=False):
         Plots survey data as PDFs
 
     inputs: 
-        S_data: a list of dictionaries, as returned from decode_survey_data.py
-                Each dictionary represents a single column of the survey product.
-                A time axis will be constructed using the timestamps within each
-                dictionary.
+        S_data: a SurveyFrame (or a list of dictionaries), as returned from decode_survey_data
+                Each entry represents a single column of the survey product.
+                A time axis will be constructed using the GPS timestamps of the
+                entries.
         filename: The filename to save
     outputs:
         saved images; format is defined by the suffix of filename
@@ -67,31 +69,16 @@ def plot_survey_data(S_data, filename="survey_data.pdf", show_plots=False):
         return
     
     # Assemble into grids:
-    E = []
-    B = []
-    T = []
     F = np.arange(512)*40/512;
-    for S in sorted(S_data, key = lambda f: f['GPS'][0]['timestamp']):
-        if S['GPS'] is not None:
-            # if S['GPS'][0]['time_status'] != 20:  # Ignore any 
-            T.append(S['GPS'][0]['timestamp'])
-            # T.append(S['header_timestamp'])
-            # print(datetime.datetime.utcfromtimestamp(S['GPS'][0]['timestamp']), S['exp_num'], datetime.datetime.utcfromtimestamp(S['header_timestamp']))
-        else:
-            T.append(np.nan)
-
-        E.append(S['E_data'])
-        B.append(S['B_data'])
-
-
-    E = np.array(E); B = np.array(B); T = np.array(T);
 
-    # Sort by time vector:
+    # Sort by time vector (entries without GPS data go last, with NaN timestamps):
     # (This may cause issues if the GPS card is off, since everything restarts at 1/6/1980 without a lock.
     # The spacecraft timestamp will be accurate enough when bursts are NOT being taken, but things will get
     # weird during a burst, since the data will have sat in the payload SRAM for a bit before receipt.)
-    sort_inds = np.argsort(T)
-    E = E[sort_inds, :]; B = B[sort_inds, :]; T = T[sort_inds];
+    S_data = SurveyFrame.from_entries(S_data).sort('timestamp')
+    # T = S_data['header_timestamp']
+    T = S_data.gps('timestamp')
+    E = S_data.E; B = S_data.B;
 
     fig = plt.figure()
     gs = GS.GridSpec(2, 2, width_ratios=[20, 1], wspace = 0.05, hspace = 0.05)
@@ -137,7 +124,7 @@ def plot_survey_data(S_data, filename="survey_data.pdf", show_plots=False):
     e_clims = [50, 255]
     b_clims = [150, 255]
     t_edges = np.insert(T, 0, T[0] - 26)
-    dates = np.array([datetime.datetime.utcfromtimestamp(t) for t in t_edges])
+    dates = unix_to_datetime(t_edges)
     
     gaps = np.where(np.diff(dates) > datetime.timedelta(seconds=(per_sec+2)))[0]
     d_gapped = np.insert(dates, gaps + 1, dates[gaps] + datetime.timedelta(seconds=per_sec))
@@ -8,6 +8,8 @@ from plots.parula_colormap import parula
 import logging
 import os
 import pickle
+from time_handlers import unix_to_datetime
+from survey_frame import SurveyFrame
 
 try:
     from mpl_toolkits.basemap import Basemap
@@ -68,26 +70,18 @@ def plot_survey_data_and_metadata(fig, S_data,
     cm = parula(); #plt.cm.viridis;
 
     # Sort by header timestamps
-    S_data = sorted(S_data, key = lambda f: f['header_timestamp'])
+    S_data = SurveyFrame.from_entries(S_data).sort('header_timestamp')
 
     # Subset of data with GPS stamps included.
     # We need these for the line plots, regardless if we're using payload or bus timestamps.
     # Also confirm that we have at least one field from BESTPOS and BESTVEL messages,
     # since on rare occasions we miss one or the other.
-    S_with_GPS = list(filter(lambda x: (('GPS' in x) and 
-                                        ('timestamp' in x['GPS'][0]) and
-                                        ('lat' in x['GPS'][0]) and
-                                        ('horiz_speed' in x['GPS'][0])), S_data))
-    S_with_GPS = sorted(S_with_GPS, key = lambda f: f['GPS'][0]['timestamp'])
+    S_with_GPS = S_data[S_data.has_gps('timestamp', 'lat', 'horiz_speed')].sort('timestamp')
 
     logger.info(f'{len(S_with_GPS)} GPS packets')
-    T_gps = np.array([x['GPS'][0]['timestamp'] for x in S_with_GPS])
+    T_gps = S_with_GPS.gps('timestamp')
     dts_gps = np.array([datetime.datetime.fromtimestamp(x, tz=datetime.timezone.utc) for x in T_gps])
 
-    # Build arrays
-    E = []
-    B = []
-    T = []
     F = np.arange(512)*40/512;
     
     # # Only plot survey data if we have GPS data to match
@@ -95,21 +89,18 @@ def plot_survey_data_and_metadata(fig, S_data,
         logger.info('Using bus timestamps')
         # Sort using bus timestamp (finer resolution, but 
         # includes transmission error from payload to bus)
-        for S in S_data:
-            T.append(S['header_timestamp'])
-            E.append(S['E_data'])
-            B.append(S['B_data'])
+        T = S_data['header_timestamp'].astype(np.float64)
+        E = S_data.E
+        B = S_data.B
     else:
         logger.info('using payload timestamps')
         # Sort using payload GPS timestamp (rounded to nearest second.
         # Ugh, why didn't we just save a local microsecond counter... do that on CANVAS please)
-        for S in S_with_GPS:
-            T.append(S['GPS'][0]['timestamp'])
-            E.append(S['E_data'])
-            B.append(S['B_data'])
-    T = np.array(T)
+        T = T_gps
+        E = S_with_GPS.E
+        B = S_with_GPS.B
 
-    dates = np.array([datetime.datetime.utcfromtimestamp(t) for t in T])
+    dates = unix_to_datetime(T)
 
     if t1 is None:
         t1 = dates[0]
@@ -118,7 +109,6 @@ def plot_survey_data_and_metadata(fig, S_data,
     # -----------------------------------
     # Spectrograms
     # -----------------------------------
-    E = np.array(E); B = np.array(B); T = np.array(T);
     logger.debug(f'E has shape {np.shape(E)}, B has shape {np.shape(B)}')
 
     # gs_data = GS.GridSpec(2, 2, width_ratios=[20, 1], wspace = 0.05, hspace = 0.05, subplot_spec=gs_root[1])
@@ -171,8 +161,8 @@ def plot_survey_data_and_metadata(fig, S_data,
 
     if plot_map:
         m = Basemap(projection='mill',lon_0=0,ax=m_ax, llcrnrlon=-180,llcrnrlat=-70,urcrnrlon=180,urcrnrlat=70)
-        lats = [x['GPS'][0]['lat'] for x in S_with_GPS]
-        lons = [x['GPS'][0]['lon'] for x in S_with_GPS]
+        lats = S_with_GPS.gps('lat')
+        lons = S_with_GPS.gps('lon')
 
         sx,sy = m(lons, lats)
 
@@ -238,12 +228,12 @@ def plot_survey_data_and_metadata(fig, S_data,
         markeralpha= 0.6
         for ind, a in enumerate(line_plots):
             
-            if a in S_with_GPS[0]['GPS'][0]:
-                yvals = np.array([x['GPS'][0][a] for x in S_with_GPS])
+            if a in S_with_GPS.GPS:
+                yvals = S_with_GPS.gps(a)
                 ax_lines[ind].plot(dts_gps, yvals,markerface, markersize=markersize, label=a, alpha=markeralpha)
                 ax_lines[ind].set_ylabel(a, rotation=0, labelpad=30)
             elif a in 'altitude':
-                yvals = np.array([x['GPS'][0]['alt'] for x in S_with_GPS])/1000.
+                yvals = S_with_GPS.gps('alt')/1000.
                 ax_lines[ind].plot(dts_gps, yvals,markerface, markersize=markersize, label=a, alpha=markeralpha)
                 ax_lines[ind].set_ylabel('Altitude\n[km]', rotation=0, labelpad=30)
                 ax_lines[ind].set_ylim([450,500])
@@ -251,8 +241,8 @@ def plot_survey_data_and_metadata(fig, S_data,
                 ax_lines[ind].plot(dts_gps, T - T_gps,markerface, markersize=markersize, label=a, alpha=markeralpha)
                 ax_lines[ind].set_ylabel(r't$_{header}$ - t$_{GPS}$',  rotation=0, labelpad=30)
             elif a in 'velocity':
-                v_horiz = np.array([x['GPS'][0]['horiz_speed'] for x in S_with_GPS])
-                v_vert = np.array([x['GPS'][0]['vert_speed'] for x in S_with_GPS])
+                v_horiz = S_with_GPS.gps('horiz_speed')
+                v_vert = S_with_GPS.gps('vert_speed')
                 vel = np.sqrt(v_horiz*v_horiz + v_vert*v_vert)/1000.
 
                 ax_lines[ind].plot(dts_gps, vel, markerface, markersize=markersize, alpha=markeralpha, label='Velocity')
@@ -9,7 +9,8 @@ import numpy as np
 from file_handlers import load_packets_from_tree
 from file_handlers import read_burst_XML, write_burst_XML
 from data_handlers import decode_status, decode_uBBR_command, decode_burst_command, process_burst
-from db_handlers import get_packets_within_range
+from db_handlers import get_packets_within_range, iter_packets_in_windows
+from change_feed import get_dirty_buckets, acknowledge_changes, bucket_spans, BUCKET_SECONDS
 from log_handlers import get_last_access_time, log_access_time
 from cli_plots import plot_burst_data, plot_burst_map
 from compute_ground_track import fill_missing_GPS_entries
@@ -80,42 +81,68 @@ def get_burst_pairs(packet_db, t1=None, t2=None, date_added=None, max_lookback_t
 
     return pairs
 
+def pair_in_buckets(pair, buckets):
+    ''' True if either status packet of a header / footer pair (from get_burst_pairs) is
+        in one of the time buckets (start times, from change_feed.get_dirty_buckets) '''
+    return any(I and (I['header_timestamp'] // BUCKET_SECONDS)*BUCKET_SECONDS in buckets for I in pair)
+
+def burst_window(IA, IB, max_lookback_time=datetime.timedelta(hours=2)):
+    ''' The time interval to load burst packets from, for a header / footer pair (from get_burst_pairs).
+        Returns (ta, tb), as UTC datetimes. '''
+    tb = datetime.datetime.fromtimestamp(round(IB['header_timestamp']) + 1, tz=datetime.timezone.utc)
+    if not IA:
+        ta = tb - max_lookback_time
+    else:
+        ta = datetime.datetime.fromtimestamp(round(IA['header_timestamp']) - 1, tz=datetime.timezone.utc)
+    return ta, tb
+
+
 def process_bursts_from_database(packet_db, pairs, max_lookback_time=datetime.timedelta(hours=2)):
 
     ''' Decode bursts from the packet database, between a list of status packet tuples defined by pairs.
         pairs is generated by get_burst_pairs().
     '''
+    completed_bursts = []
+    for bursts in iter_bursts_from_database(packet_db, pairs, max_lookback_time):
+        completed_bursts.extend(bursts)
+    return completed_bursts
+
+
+def iter_bursts_from_database(packet_db, pairs, max_lookback_time=datetime.timedelta(hours=2)):
+
+    ''' Decode bursts from the packet database, between a list of status packet tuples defined by pairs
+        (from get_burst_pairs), yielding a list of the completed bursts for each pair, in turn.
+        The packets for all the pairs are loaded together (see db_handlers.iter_packets_in_windows),
+        so overlapping time intervals are only read from the database once.
+    '''
     logger = logging.getLogger('process_bursts_from_database')
 
-    completed_bursts = []
+    windows = [burst_window(IA, IB, max_lookback_time) for IA, IB in pairs]
+    window_packets = iter_packets_in_windows(packet_db, [(ta.timestamp(), tb.timestamp()) for ta, tb in windows],
+                                             dtype=['I', 'E', 'B', 'G'])
 
     # Process packets between each set of headers:
-    for index, (IA, IB) in enumerate(pairs):
+    for index, ((IA, IB), (ta, tb), packets) in enumerate(zip(pairs, windows, window_packets)):
         # logger.debug(f'doing {index}')
-        
-        tb = datetime.datetime.fromtimestamp(round(IB['header_timestamp']) + 1, tz=datetime.timezone.utc)
-        if not IA:
-            ta = tb - max_lookback_time
-        else:
-            ta = datetime.datetime.fromtimestamp(round(IA['header_timestamp']) - 1, tz=datetime.timezone.utc)
-        
-        
-        
-        # Load the rest of the packets within the time interval
-        statcheck = get_packets_within_range(packet_db, dtype='I', t1 = ta, t2 = tb)
-        E_packets = get_packets_within_range(packet_db, dtype='E', t1 = ta, t2 = tb)
-        B_packets = get_packets_within_range(packet_db, dtype='B', t1 = ta, t2 = tb)
-        G_packets = get_packets_within_range(packet_db, dtype='G', t1 = ta, t2 = tb)
+        completed_bursts = []
+
+        # The rest of the packets within the time interval
+        statcheck = packets.where(dtype='I')
+        E_packets = packets.where(dtype='E')
+        B_packets = packets.where(dtype='B')
+        G_packets = packets.where(dtype='G')
 
         # Skip if there's no data to process
         if not E_packets and not B_packets and not G_packets:
             logger.debug('No data found!')
+            yield completed_bursts
             continue
 
         logger.info(f'burst between {ta} and {tb} (dt = {tb - ta})')
         logger.info(f'loaded {len(E_packets)} E packets, {len(B_packets)} B packets, {len(G_packets)} GPS packets, and {len(statcheck)} status packets')
 
-        avail_exp_nums = np.unique([x['exp_num'] for x in (E_packets + B_packets + G_packets)])
+        burst_packets = E_packets + B_packets + G_packets
+        avail_exp_nums = np.unique(burst_packets['exp_num'].astype(np.int64))
 
         logger.debug(f'Available experiment nums: {avail_exp_nums}')
 
@@ -137,7 +164,7 @@ def process_bursts_from_database(packet_db, pairs, max_lookback_time=datetime.ti
 
                 logger.debug(f'burst configuration: {burst_config}')
 
-                packets_to_process = list(filter(lambda p: p['exp_num'] == e_num, E_packets + B_packets + G_packets))
+                packets_to_process = burst_packets.where(exp_num=e_num)
                 processed = process_burst(packets_to_process, burst_config)
 
 
@@ -148,14 +175,14 @@ def process_bursts_from_database(packet_db, pairs, max_lookback_time=datetime.ti
                     processed['header_timestamp'] = IA['header_timestamp']
                 else:
                     processed['status'] = [IB]
-                    processed['header_timestamp'] = min([x['header_timestamp'] for x in (E_packets + B_packets + G_packets)])
+                    processed['header_timestamp'] = float(burst_packets['header_timestamp'].min())
                 processed['experiment_number'] = e_num
 
                 completed_bursts.append(processed)
             except:
                 logger.warning(f'Problem decoding burst {index}, exp_num {e_num}')
 
-    return completed_bursts
+        yield completed_bursts
 
 
 
@@ -311,8 +338,20 @@ def main():
     logging.info(f'packet_db: {packet_db}')
     logging.info(f'file types: {file_types}')
     logging.info(f'Out root: {out_root}')
-    # Get any sets of headers / footers to check:
-    pairs = get_burst_pairs(packet_db, date_added=last_time, max_lookback_time=max_lookback_time)
+    # Get any sets of headers / footers to check -- from the time buckets with newly-added
+    # status packets (from the change feed). The change feed alone says what's new: we pair
+    # up all the status packets within the buckets, plus a margin of the lookback time (so
+    # a new footer finds a header that came in on an earlier run, and vice versa), and keep
+    # the pairs with a packet inside the buckets themselves -- not those out in the margin,
+    # which an earlier run has done already.
+    buckets, seq = get_dirty_buckets(packet_db, 'process_burst_data', dtypes=['I'], since=last_timestamp)
+    dirty = set(buckets)
+    pairs = []
+    for t1, t2 in bucket_spans(buckets, margin=max_lookback_time.total_seconds()):
+        span_pairs = get_burst_pairs(packet_db, max_lookback_time=max_lookback_time,
+                                     t1=datetime.datetime.fromtimestamp(t1, tz=datetime.timezone.utc),
+                                     t2=datetime.datetime.fromtimestamp(t2, tz=datetime.timezone.utc))
+        pairs.extend(p for p in span_pairs if pair_in_buckets(p, dirty))
 
     if not pairs:
         logging.info(f'No new burst data to decode')
@@ -321,12 +360,9 @@ def main():
         logging.info(f'Have {len(pairs)} sets to check')
 
         # Check each pair one by one, and saving + plotting as we go
-        for index, pair in enumerate(pairs):
+        for index, bursts in enumerate(iter_bursts_from_database(packet_db, pairs, max_lookback_time=max_lookback_time)):
             logging.info(f'Doing pair {index}:')
 
-            # Process
-            bursts = process_bursts_from_database(packet_db, [pair], max_lookback_time=max_lookback_time)
-
             # Replace any bad GPS positions with TLE-propagated data
             if fill_GPS:
                 for B in bursts:
@@ -341,9 +377,11 @@ def main():
                 gen_burst_plots(bursts, out_root, do_plots=do_plots,
                          do_maps=do_maps, dpi=dpi, cal_file=cal_file,
                          TLE_file=TLE_file, TX_file=TX_file)
-        # Success!
-        logging.info(f'saving access time')
-        log_access_time(access_log,'process_burst_data')
+
+    # Success! (Even with no pairs: those buckets are done with, too)
+    logging.info(f'saving access time')
+    acknowledge_changes(packet_db, 'process_burst_data', seq)
+    log_access_time(access_log,'process_burst_data')
 
     # For debugging a smaller section:
     # t1 = datetime.datetime(2020,5,1,0,0,0, tzinfo=datetime.timezone.utc)
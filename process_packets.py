@@ -1,49 +1,156 @@
-import sys
 import os
 
 import gzip
 import pickle
-import numpy as np
-import datetime
-import matplotlib.pyplot as plt
+import tempfile
+import functools
+import multiprocessing
 from configparser import ConfigParser
 
-from data_handlers import decode_packets_TLM, decode_packets_CSV
-from data_handlers import decode_survey_data
+from data_handlers import iter_packets_TLM, iter_packets_CSV, PACKET_BATCH_SIZE, TLM_SHARD_SIZE
+from data_handlers import new_ingest_state, file_digest, DIGEST_BYTES
 from data_handlers import unique_entries
 
-from db_handlers import write_to_db, connect_packet_db, get_files_in_db
-from log_handlers import get_last_access_time, log_access_time
+from packet_table import PacketTable
+from time_handlers import day_buckets
+from db_handlers import write_stream_to_db, connect_packet_db, checkpoint_packet_db
+from db_handlers import get_file_registry, write_file_record
+from db_handlers import compact_segments, PACKET_STORES
+from db_connections import close_connections
+from shard_store import seal_shards, commit_packet_db, rollback_packet_db, SHARD_PERIODS
+from log_handlers import log_access_time
 
 import logging
 
 
-def load_from_telemetry(filepath, files_to_skip = [], do_TLM=True, do_CSV=True):
-    ''' Walk through a file tree, and process any TLM and CSV files we can find '''
-    # -------- Process all TLM and CSV files we can find -----------
-
-    logger = logging.getLogger('load_from_telemetry')
-    packets = []
+def find_telemetry_files(in_roots, registry=dict(), do_TLM=True, do_CSV=True):
+    ''' Walk through the input directories, and list any TLM and CSV files which are new,
+        or which have grown since we last read them.
+        inputs:
+            registry:   the registry entry (ingest state) of each file we've already read,
+                        by path (from db_handlers.get_file_registry)
+        Returns a list of (root, fname, state) tuples; state is the ingest state to pick up from.
+    '''
+    logger = logging.getLogger('find_telemetry_files')
 
-    for root, dirs, files in os.walk(filepath):
+    # Files registered by name only (from before we kept track of paths)
+    known_names = set(r['fname'] for r in registry.values())
 
-        for fname in files:
-            if fname in files_to_skip:
-                logger.debug(f'File {fname} already in database; skipping')
+    tasks = []
+    for in_root in in_roots:
+        logger.info(f'doing {in_root}:')
+        for root, dirs, files in os.walk(in_root):
+            for fname in files:
+                if not ((do_TLM and fname.endswith('.tlm')) or (do_CSV and fname.endswith('.csv'))):
+                    continue
+                fpath = os.path.abspath(os.path.join(root, fname))
+                state = registry.get(fpath)
+                if state is not None and state['size'] is not None:
+                    state = dict(state)
+                    stat = os.stat(fpath)
+                    if stat.st_size == state['size'] and stat.st_mtime == state['mtime']:
+                        logger.debug(f'File {fname} unchanged since last read; skipping')
+                    elif stat.st_size < state['size'] or \
+                         file_digest(fpath, min(state['size'], DIGEST_BYTES)) != state['digest']:
+                        logger.warning(f'File {fname} has been replaced since we last read it; skipping')
+                    else:
+                        logger.info(f'File {fname} has grown; picking up from byte {state["byte_offset"]}')
+                        tasks.append((root, fname, state))
+                elif fname in known_names:
+                    logger.debug(f'File {fname} already in database; skipping')
+                else:
+                    tasks.append((root, fname, new_ingest_state(fpath)))
+    return tasks
+
+
+def decode_file(task, batch_size=PACKET_BATCH_SIZE):
+    ''' Decode all the (new) packets in one telemetry file. This is the worker task for parallel ingestion.
+        The packets are written (pickled, in PacketTables of up to batch_size packets) to a temporary
+        file, rather than sent back to the parent process all at once -- so neither process has to
+        hold the whole file's packets; iter_spilled_batches reads them back one batch at a time.
+        inputs:
+            task:       a (root, fname, state) tuple, from find_telemetry_files
+        outputs:
+            (root, fname, path, state), where path is the temporary file -- or None, if the
+            file couldn't be decoded -- and state is the updated ingest state
+    '''
+    logger = logging.getLogger('decode_file')
+    root, fname, state = task
+    fd, path = tempfile.mkstemp(prefix='decoded_', suffix='.pkl')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if fname.endswith('.tlm'):
+                logger.info(f'loading TLM from {root} {fname}')
+                batches = iter_packets_TLM(root, fname, batch_size=batch_size, state=state)
             else:
+                logger.info(f'loading CSV from {root} {fname}')
+                batches = iter_packets_CSV(root, fname, batch_size=batch_size, state=state)
+            for packets in batches:
+                pickle.dump(packets, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        logger.warning(f'Problem loading {fname}')
+        os.remove(path)
+        return root, fname, None, state
+
+    return root, fname, path, state
+
+
+def iter_spilled_batches(path):
+    ''' Yield the packet batches decode_file wrote to the temporary file at path, one at a time;
+        the file is removed afterwards (or if we stop partway through) '''
+    try:
+        with open(path, 'rb') as f:
+            while True:
                 try:
-                    if do_TLM and fname.endswith('.tlm'):
-                        logger.info(f'loading TLM from {root} {fname}')
-                        # Load packets from each TLM file, tag with the source filename, and decode
-                        packets.extend(decode_packets_TLM(root, fname))
-
-                    if do_CSV and fname.endswith('.csv'):
-                        logger.info(f'loading CSV from {root} {fname}')
-                        packets.extend(decode_packets_CSV(root, fname))
-                except:
-                    logger.warning(f'Problem loading {fname}')
+                    yield pickle.load(f)
+                except EOFError:
+                    break
+    finally:
+        os.remove(path)
+
+
+def iter_decoded_files(tasks, num_workers=1, batch_size=PACKET_BATCH_SIZE):
+    ''' Decode a list of telemetry files, yielding (fname, packet_batches, state) for each one.
+        With num_workers > 1, the files are decoded in parallel by a pool of worker
+        processes, and yielded in the order they finish (the workers hand the packets back
+        through temporary files; see decode_file). Large TLM files (over TLM_SHARD_SIZE of
+        new data) are done afterwards, one at a time, each split into shards which are
+        decoded in parallel. With num_workers = 1, the files are decoded one at a time in
+        this process. Either way, packet_batches is a generator of PacketTables of up to
+        batch_size packets (so the packets are streamed through, and memory use doesn't
+        depend on the size of the file). state is the file's ingest state, which is up to
+        date once packet_batches is used up.
+    '''
+    logger = logging.getLogger('iter_decoded_files')
 
-    return packets
+    if num_workers <= 1:
+        pooled_tasks = []
+        streamed_tasks = tasks
+    else:
+        is_large = [fname.endswith('.tlm') and
+                    os.path.getsize(os.path.join(root, fname)) - state['byte_offset'] > TLM_SHARD_SIZE
+                    for root, fname, state in tasks]
+        pooled_tasks = [task for task, large in zip(tasks, is_large) if not large]
+        streamed_tasks = [task for task, large in zip(tasks, is_large) if large]
+
+    if pooled_tasks:
+        with multiprocessing.Pool(min(num_workers, len(pooled_tasks))) as pool:
+            decode = functools.partial(decode_file, batch_size=batch_size)
+            for root, fname, path, state in pool.imap_unordered(decode, pooled_tasks):
+                if path is not None:
+                    yield fname, iter_spilled_batches(path), state
+
+    for root, fname, state in streamed_tasks:
+        if fname.endswith('.tlm'):
+            logger.info(f'loading TLM from {root} {fname}')
+            if num_workers > 1:
+                yield fname, iter_packets_TLM(root, fname, window_size=TLM_SHARD_SIZE, batch_size=batch_size,
+                                              num_workers=num_workers, state=state), state
+            else:
+                yield fname, iter_packets_TLM(root, fname, batch_size=batch_size, state=state), state
+        else:
+            logger.info(f'loading CSV from {root} {fname}')
+            yield fname, iter_packets_CSV(root, fname, batch_size=batch_size, state=state), state
 
 
 def save_packets_to_file_tree(packets, filepath):
@@ -52,16 +159,18 @@ def save_packets_to_file_tree(packets, filepath):
     '''
 
     logger = logging.getLogger('save_packets_to_file_tree')
-    dates = [datetime.datetime.fromtimestamp(x['header_timestamp'], tz=datetime.timezone.utc) for x in packets]
-    days_to_do = np.unique([x.replace(hour=0, minute=0, second=0, microsecond=0) for x in dates])
+
+    # The file tree stores lists of packet dictionaries
+    if isinstance(packets, PacketTable):
+        packets = packets.to_packets()
+
+    days_to_do, day_index = day_buckets([x['header_timestamp'] for x in packets])
 
     print(days_to_do)
 
-    for d in days_to_do:
+    for i, d in enumerate(days_to_do):
         logger.info(f'doing {d}')
-        t1 = d.timestamp()
-        t2 = (d + datetime.timedelta(days=1)).timestamp()
-        P_filt = list(filter(lambda x: (x['header_timestamp'] >= t1) and (x['header_timestamp'] < t2), packets))
+        P_filt = [x for x, k in zip(packets, day_index) if k == i]
         
         outpath = os.path.join(out_root,'Packets',f'{d.year}', '{:02d}'.format(d.month),'{:02d}'.format(d.day))
         fname = f"VPM_packets_{d.strftime('%Y-%m-%d')}.pklz"
@@ -111,6 +220,7 @@ def process_packets():
              format='[%(asctime)s]\t%(module)s.%(name)s\t%(levelname)s\t%(message)s',
              datefmt='%Y-%m-%d %H:%M:%S')
     logging.getLogger('matplotlib').setLevel(logging.WARNING)
+    logger = logging.getLogger('process_packets')
     
     output_type = 'db'
     # output_type = 'files'
@@ -125,56 +235,84 @@ def process_packets():
     do_TLM = True
     do_CSV = True
 
-    logging.info(f'input paths: {in_roots}')
+    # Number of processes to decode files with (0 to use all the cores)
+    num_workers = int(config.get('packet_config', 'num_workers', fallback='1'))
+    if num_workers <= 0:
+        num_workers = multiprocessing.cpu_count()
+
+    # Split the packet database into one file per month (or year)?
+    shard_period = config.get('packet_config', 'shard_period', fallback='none').strip()
+    if shard_period not in SHARD_PERIODS:
+        if shard_period != 'none':
+            logger.warning(f'unknown shard_period {shard_period}; not sharding')
+        shard_period = None
+
+    # Store the packets in the database, or in segment files?
+    packet_store = config.get('packet_config', 'packet_store', fallback='sqlite').strip()
+    if packet_store not in PACKET_STORES:
+        logger.warning(f'unknown packet_store {packet_store}; using sqlite')
+        packet_store = 'sqlite'
+    if packet_store == 'segments' and shard_period:
+        logger.warning('shard_period is ignored with packet_store = segments')
+        shard_period = None
+
+    logger.info(f'input paths: {in_roots}')
+    logger.info(f'decoding with {num_workers} worker(s)')
+    if shard_period:
+        logger.info(f'packets sharded by {shard_period}')
+    if packet_store == 'segments':
+        logger.info('packets stored in segments')
     
 
     # Find any files to exclude from this run
     # (We could also do this by tracking the file modification date)
+    # (Files which have grown since we last read them are picked up from where we left off)
+    # The workers only decode; all the writing happens here, in this process,
+    # over a single database connection.
+    conn = None
     if 'db' in output_type:
-        logging.info(f'output database: {db_name}')
-        files_to_skip = get_files_in_db(db_name, 'packets')
+        logger.info(f'output database: {db_name}')
+        conn = connect_packet_db(db_name)
+        registry = get_file_registry(conn)
     else:
-        logging.info(f'output path: {out_root}')
-        files_to_skip = []
-
-    # logging.info(f'Files to skip: {files_to_skip}')
-
-    for in_root in in_roots:
-        logging.info(f'doing {in_root}:')
-
-        for root, dirs, files in os.walk(in_root):
-
-                for fname in files:
-                    if fname in files_to_skip:
-                        logging.debug(f'File {fname} already in database; skipping')
-                    else:
-
-                        packets = []
-                        try:
-                            if do_TLM and fname.endswith('.tlm'):
-                                logging.info(f'loading TLM from {root} {fname}')
-                                # Load packets from each TLM file, tag with the source filename, and decode
-                                packets = decode_packets_TLM(root, fname)
-
-                            if do_CSV and fname.endswith('.csv'):
-                                logging.info(f'loading CSV from {root} {fname}')
-                                packets = decode_packets_CSV(root, fname)
-
-                            if packets:
-                                if 'files' in output_type:
-                                    save_packets_to_file_tree(packets, out_root)
-                                if 'db' in output_type:
-                                    conn = connect_packet_db(db_name)
-                                    line_id = write_to_db(conn, packets, db_field='packets')
-                                    logging.info(f'wrote to db: line ID = {line_id}')
-                                    conn.commit()
-                                    conn.close()
-
-                        except:
-                            logging.warning(f'Problem loading {fname}')
-
-
-
+        logger.info(f'output path: {out_root}')
+        registry = dict()
+
+    tasks = find_telemetry_files(in_roots, registry, do_TLM, do_CSV)
+    logger.info(f'{len(tasks)} new files to do')
+
+    try:
+        for fname, batches, state in iter_decoded_files(tasks, num_workers):
+            try:
+                if 'files' in output_type:
+                    for packets in batches:
+                        save_packets_to_file_tree(packets, out_root)
+                elif 'db' in output_type:
+                    # One transaction per file (packets -- in the shards, too -- and ingest state
+                    # together), so a file which fails partway through doesn't get marked as done
+                    num_written = write_stream_to_db(conn, batches, db_field='packets',
+                                                     shard_period=shard_period, store=packet_store)
+                    write_file_record(conn, fname, state)
+                    logger.info(f'wrote {num_written} packets from {fname} to db')
+                    commit_packet_db(conn)
+            except Exception:
+                logger.warning(f'Problem loading {fname}')
+                if conn is not None:
+                    rollback_packet_db(conn)
+
+        # Make the shards of any periods which are over read-only
+        if shard_period and conn is not None:
+            seal_shards(conn)
+        # Merge this run's segments (one per batch) into bigger ones
+        if packet_store == 'segments' and conn is not None:
+            compact_segments(conn)
+        # Keep the write-ahead log from growing, while the processing scripts are reading
+        if conn is not None:
+            checkpoint_packet_db(conn)
+    finally:
+        if conn is not None:
+            # (The shards' connections, too)
+            close_connections()
 
     if 'db' in output_type:
         log_access_time(access_log, 'process_packets')
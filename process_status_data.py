@@ -10,23 +10,22 @@ from configparser import ConfigParser
 from file_handlers import load_packets_from_tree
 from data_handlers import decode_status, unique_entries
 from file_handlers import read_status_XML, write_status_XML
-from db_handlers import get_packets_within_range, get_time_range_for_updated_packets
+from db_handlers import get_packets_within_range
+from change_feed import get_dirty_buckets, acknowledge_changes, bucket_spans
 # from db_handlers import get_last_access_time, log_access_time
 from log_handlers import get_last_access_time, log_access_time
+from time_handlers import day_buckets
 
 def save_status_to_file_tree(stat_data, out_root):
     
     logger = logging.getLogger(__name__ + '.save_status_to_file_tree')
 
-    dates = [datetime.datetime.fromtimestamp(x['header_timestamp'], tz=datetime.timezone.utc) for x in stat_data]
-    days_to_do = np.unique([x.replace(hour=0, minute=0, second=0, microsecond=0) for x in dates])
+    days_to_do, day_index = day_buckets([x['header_timestamp'] for x in stat_data])
     # print(days_to_do)
 
-    for d in days_to_do:
+    for i, d in enumerate(days_to_do):
         logger.info(f'doing {d}')
-        t1 = d.timestamp()
-        t2 = (d + datetime.timedelta(days=1)).timestamp()
-        stat_filt = list(filter(lambda x: (x['header_timestamp'] >= t1) and (x['header_timestamp'] <= t2), stat_data))
+        stat_filt = [x for x, k in zip(stat_data, day_index) if k == i]
         for file_format in ['xml']:
             logger.info(f'saving {len(stat_filt)} status entries')
             outpath = os.path.join(out_root,file_format,f'{d.year}', '{:02d}'.format(d.month),'{:02d}'.format(d.day))
@@ -80,30 +79,34 @@ def main():
     last_time = datetime.datetime.utcfromtimestamp(last_timestamp)
     logging.info(f'Last run time: {last_time} UTC')
 
-    tsmin, tsmax = get_time_range_for_updated_packets(packet_db, last_timestamp)
+    # Time buckets with status packets added since we last ran (from the change feed)
+    buckets, seq = get_dirty_buckets(packet_db, 'process_status_data', dtypes=['I'], since=last_timestamp)
 
-    if (not tsmin) or (not tsmax):
+    if not buckets:
         logging.info('No new data to process')
-    else:    
-        logging.info(f'Header timestamps range from {datetime.datetime.utcfromtimestamp(tsmin)} to {datetime.datetime.utcfromtimestamp(tsmax)}')
-        # Add in some extra margin, in case the new minimum is in the middle of a burst
-        tmin = datetime.datetime.utcfromtimestamp(tsmin) - datetime.timedelta(hours=2)
-        tmax = datetime.datetime.utcfromtimestamp(tsmax) + datetime.timedelta(hours=2)
-        logging.info(f'Loading packets with header timestamps {tmin} to {tmax}')
-
+    else:
+        logging.info(f'{len(buckets)} hours with new status packets')
         stats = []
-        # ---------------- Load packets --------------------
-        # packets = load_packets_from_tree(in_root)
-        packets = get_packets_within_range(packet_db, dtype='I', t1=tmin, t2=tmax)
+        # Add in some extra margin, in case the new packets are in the middle of a burst
+        for tsmin, tsmax in bucket_spans(buckets, margin=2*60*60):
+            tmin = datetime.datetime.fromtimestamp(tsmin, tz=datetime.timezone.utc)
+            tmax = datetime.datetime.fromtimestamp(tsmax, tz=datetime.timezone.utc)
+            logging.info(f'Loading packets with header timestamps {tmin} to {tmax}')
+
+            # ---------------- Load packets --------------------
+            # packets = load_packets_from_tree(in_root)
+            packets = get_packets_within_range(packet_db, dtype='I', t1=tmin, t2=tmax)
 
 
-        logging.info(f'loaded {len(packets)} packets')
-        if packets:
-            stats.extend(decode_status(packets))
-            logging.info(f'Decoded {len(stats)} status messages')
+            logging.info(f'loaded {len(packets)} packets')
+            if packets:
+                stats.extend(decode_status(packets))
+                logging.info(f'Decoded {len(stats)} status messages')
 
         if stats:
             save_status_to_file_tree(stats, out_root)
+
+        acknowledge_changes(packet_db, 'process_status_data', seq)
   
     log_access_time(access_log,'process_status_data')
             
@@ -8,75 +8,59 @@ from configparser import ConfigParser
 import numpy as np
 from file_handlers import load_packets_from_tree
 from file_handlers import read_survey_XML, write_survey_XML
-from data_handlers import decode_packets_TLM, decode_packets_CSV, decode_survey_data, unique_entries
-from db_handlers import get_packets_within_range, get_time_range_for_updated_packets
+from data_handlers import decode_packets_TLM, decode_packets_CSV, decode_survey_data
+from survey_frame import SurveyFrame
+from db_handlers import get_packets_within_range
+from change_feed import get_dirty_buckets, acknowledge_changes, bucket_spans
 from log_handlers import get_last_access_time, log_access_time
 import logging
 from compute_ground_track import fill_missing_GPS_entries
+from time_handlers import day_buckets, day_start
 
 
 
-def get_timestamp(x):
-    logger = logging.getLogger('get_timestamp')
-    try:
-        ts = x['GPS'][0]['timestamp']
-    except:
-        logger.info("entry is missing GPS data")
-        ts = x['header_timestamp']
-    return ts
-
-
 # Sift out packets with GPS issues (no lock, or not present)
-def valid_GPS_mask(s):
-    try:
-        g = s['GPS'][0]
-        # Time status messages:
-        # 20 -- UNKNOWN
-        # 60 -- APPROXIMATE
-        # 80 -- COARSEADJUSTING
-        # 100 -- COARSE
-        # 120 -- COARSESTEERING
-        # 130 -- FREEWHEELING
-        # 140 -- FINEADJUSTING
-        # 160 -- FINE
-        # 170 -- FINEBACKUPSTEERING
-        # 180 -- FINESTEERING
-        # 200 -- SATTIME
-        stat = g['time_status']
-        return (stat > 20)
-    except:
-#         print("entry is missing GPS data")
-        return False
-    
-    return temp
+def valid_GPS_mask(S_data):
+    ''' True for the entries of S_data (a SurveyFrame) with a GPS time lock '''
+    # Time status messages:
+    # 20 -- UNKNOWN
+    # 60 -- APPROXIMATE
+    # 80 -- COARSEADJUSTING
+    # 100 -- COARSE
+    # 120 -- COARSESTEERING
+    # 130 -- FREEWHEELING
+    # 140 -- FINEADJUSTING
+    # 160 -- FINE
+    # 170 -- FINEBACKUPSTEERING
+    # 180 -- FINESTEERING
+    # 200 -- SATTIME
+    # (Entries without GPS data count as no lock)
+    return S_data.gps('time_status', fill=0) > 20
 
 def save_survey_to_file_tree(S_data, out_root, file_types=['xml']):
     logger = logging.getLogger('save_survey_to_file_tree')
 
-
+    S_data = SurveyFrame.from_entries(S_data)
 
     # -------------------- Filter out invalid entries -----------------------------
-    S_valid   = list(filter(lambda x: valid_GPS_mask(x), S_data))
-    S_invalid = list(filter(lambda x: not valid_GPS_mask(x), S_data))
+    valid = valid_GPS_mask(S_data)
+    S_invalid = S_data[~valid]
 
 
     # ---------------- Quantize timestamps into range of days -----------------------------
-    dates = [datetime.datetime.fromtimestamp(x['GPS'][0]['timestamp'],
-                             tz=datetime.timezone.utc) for x in S_valid]
-
-    days_to_do = np.unique([x.replace(hour=0, minute=0, second=0) for x in dates])
+    days_to_do, _ = day_buckets(S_data.gps('timestamp')[valid])
+    # (Invalid entries get binned by their header timestamps, if they have no GPS time)
+    entry_days = day_start(S_data.timestamps())
 
     logger.info(f"Days to do: {[x.strftime('%Y-%m-%d') for x in days_to_do]}")
 
-    logger.info(f'{len(S_data)} total survey products: {len(S_valid)} valid, {len(S_invalid)} rejected')
+    logger.info(f'{len(S_data)} total survey products: {np.sum(valid)} valid, {len(S_invalid)} rejected')
 
 
 
     for d in days_to_do:
         logger.info(f'doing {d}')
-        t1 = d.timestamp()
-        t2 = (d + datetime.timedelta(days=1)).timestamp()
-        S_filt = list(filter(lambda x: (get_timestamp(x) >= t1) and (get_timestamp(x) < t2), S_data))
+        S_filt = S_data[entry_days == d.timestamp()]
 
 
         if S_filt:
@@ -95,13 +79,13 @@ def save_survey_to_file_tree(S_data, out_root, file_types=['xml']):
                 S_previous = read_survey_XML(outfile)
                 logger.info(f'Joining {len(S_previous)} entries with current {len(S_filt)}')
 
-                S_filt.extend(S_previous)
+                S_filt = S_filt + S_previous
                 len_pre_filt = len(S_filt)
-                S_filt = unique_entries(S_filt)
+                S_filt = S_filt.unique()
                 logger.info(f'rejecting {len_pre_filt - len(S_filt)} duplicate entries')
 
             logger.info(f'saving {len(S_filt)} survey entries')
-            S_filt = sorted(S_filt, key=lambda x: get_timestamp(x))
+            S_filt = S_filt.sort(S_filt.timestamps())
 
             # Can save xml, matlab, or pickle file types:
             for ftype in file_types:
@@ -117,12 +101,12 @@ def save_survey_to_file_tree(S_data, out_root, file_types=['xml']):
 
                 if ftype=='mat':
                     # Write MAT file
-                    savemat(outfile, {'survey_data' : S_filt})
+                    savemat(outfile, {'survey_data' : S_filt.to_entries()})
 
                 if ftype=='pkl':
                     # Write pickle file
                     with open(outfile,'wb') as file:
-                        pickle.dump(S_filt, file)                    
+                        pickle.dump(S_filt.to_entries(), file)
 
     # ---------------- Cache invalid packets -----------------------------
 
@@ -134,13 +118,13 @@ def save_survey_to_file_tree(S_data, out_root, file_types=['xml']):
 
             S_previous = read_survey_XML(invalid_xml_file)
             logger.info(f'Joining {len(S_previous)} entries with current {len(S_invalid)}')
-            S_invalid.extend(S_previous)
+            S_invalid = S_invalid + S_previous
             len_pre_filt = len(S_invalid)
-            S_invalid = unique_entries(S_invalid)
+            S_invalid = S_invalid.unique()
             logger.info(f'rejecting {len_pre_filt - len(S_invalid)} duplicate entries')
 
         logger.info(f'saving {len(S_invalid)} rejected survey entries')
-        S_invalid = sorted(S_invalid, key=lambda x: get_timestamp(x))
+        S_invalid = S_invalid.sort(S_invalid.timestamps())
 
         for ftype in file_types:
             invalid_file = os.path.join(out_root,ftype,f'invalid_entries.{ftype}')
@@ -149,11 +133,11 @@ def save_survey_to_file_tree(S_data, out_root, file_types=['xml']):
                 write_survey_XML(S_invalid, invalid_file)
 
             if ftype=='mat':
-                savemat(invalid_file, {'survey_data': S_invalid})
+                savemat(invalid_file, {'survey_data': S_invalid.to_entries()})
 
             if ftype=='pkl':
-                with open(outfile,'wb') as file:
-                    pickle.dump(S_invalid, file)
+                with open(invalid_file,'wb') as file:
+                    pickle.dump(S_invalid.to_entries(), file)
 
 
 def main():
@@ -178,7 +162,7 @@ def main():
     
     file_types = config['survey_config']['file_types']
     file_types = [x.strip() for x in file_types.split(',')]
-    S_data = []
+    S_data = SurveyFrame()
 
     fill_GPS = int(config['survey_config']['fill_missing_GPS']) > 0
 
@@ -187,41 +171,43 @@ def main():
     last_time = datetime.datetime.utcfromtimestamp(last_timestamp)
     logging.info(f'Last run time: {last_time} UTC')
 
-    # Get the range of header timestamps corresponding to
-    # packets added after the last time we ran:
-    
-    tsmin, tsmax = get_time_range_for_updated_packets(packet_db, last_timestamp)
+    # Get the time buckets with survey packets added since
+    # the last time we ran (from the change feed):
+    buckets, seq = get_dirty_buckets(packet_db, 'process_survey_data', dtypes=['S'], since=last_timestamp)
 
-    if (not tsmin) or (not tsmax):
+    if not buckets:
         logging.info('No new data to process')
-    else:    
-        logging.info(f'Header timestamps range from {datetime.datetime.utcfromtimestamp(tsmin)} to {datetime.datetime.utcfromtimestamp(tsmax)}')
-        # Add in some extra margin, in case the new minimum is in the middle of a burst
-        tmin = datetime.datetime.utcfromtimestamp(tsmin) - datetime.timedelta(hours=2)
-        tmax = datetime.datetime.utcfromtimestamp(tsmax) + datetime.timedelta(hours=2)
-        logging.info(f'Loading packets with header timestamps {tmin} to {tmax}')
+    else:
+        logging.info(f'{len(buckets)} hours with new survey packets')
+        # Add in some extra margin, in case the new packets are in the middle of a burst
+        for tsmin, tsmax in bucket_spans(buckets, margin=2*60*60):
+            tmin = datetime.datetime.fromtimestamp(tsmin, tz=datetime.timezone.utc)
+            tmax = datetime.datetime.fromtimestamp(tsmax, tz=datetime.timezone.utc)
+            logging.info(f'Loading packets with header timestamps {tmin} to {tmax}')
 
-        # ---------------- Load packets --------------------
-        # this version from a file tree (.pklz files)
-        # packets = load_packets_from_tree(in_root)
+            # ---------------- Load packets --------------------
+            # this version from a file tree (.pklz files)
+            # packets = load_packets_from_tree(in_root)
 
-        # this version from the database!
-        packets = get_packets_within_range(packet_db, dtype='S', t1=tmin, t2 = tmax)
+            # this version from the database!
+            packets = get_packets_within_range(packet_db, dtype='S', t1=tmin, t2 = tmax)
 
 
-        # -------------------- Decode survey data from packets --------------------
-        if packets:
-            from_packets, unused = decode_survey_data(packets, separation_time=4.5)
-            logging.info(f'Decoded {len(from_packets)} survey products, ({len(unused)}) unused packets remaining')
-            S_data.extend(from_packets)
+            # -------------------- Decode survey data from packets --------------------
+            if packets:
+                from_packets, unused = decode_survey_data(packets, separation_time=4.5)
+                logging.info(f'Decoded {len(from_packets)} survey products, ({len(unused)}) unused packets remaining')
+                S_data = S_data + from_packets
 
         if S_data:
 
             # Replace any missing GPS positions with TLE-propagated data
             if fill_GPS:
-                fill_missing_GPS_entries([x['GPS'][0] for x in S_data])
+                fill_missing_GPS_entries(S_data)
 
             save_survey_to_file_tree(S_data, out_root, file_types=file_types)
+
+        acknowledge_changes(packet_db, 'process_survey_data', seq)
     
     log_access_time(access_log, 'process_survey_data')
 
@@ -0,0 +1,202 @@
+import numpy as np
+import os
+import stat
+import shutil
+import logging
+import functools
+
+from packet_table import PacketTable, COLUMN_TYPES
+
+# A segment is an immutable directory of packets, sorted by header_timestamp:
+#   data.npy                the data segments, end to end (uint8)
+#   bounds.npy              packet i's data is data[bounds[i]:bounds[i+1]] (int64)
+#   <column>.npy            one typed array per metadata column
+#   <column>.mask.npy       (only for columns with gaps) True where the value is missing
+# Everything is opened memory-mapped, so reading a time range is a binary search on
+# header_timestamp.npy (the time index -- missing timestamps are stored as NaN, which sort
+# last), and slices of the files, straight off the disk. Segments are written to a
+# temporary directory (.<name>.tmp), synced to disk, and renamed into place once complete.
+# An archive is the same arrays, compressed into a single read-only .npz file -- smaller,
+# but it has to be decompressed whole to read any of it.
+# (The catalogs of segments and archives, and deciding which ones to read, are up to db_handlers.)
+
+# Number of decompressed archives to keep in memory
+ARCHIVE_CACHE_SIZE = 2
+
+def column_file(path, name):
+    return os.path.join(path, f'{name}.npy')
+
+def mask_file(path, name):
+    return os.path.join(path, f'{name}.mask.npy')
+
+def segment_columns(path):
+    ''' The metadata columns stored in the segment at path '''
+    return sorted(f[:-4] for f in os.listdir(path)
+                  if f.endswith('.npy') and not f.endswith('.mask.npy') and f not in ('data.npy', 'bounds.npy'))
+
+def sort_by_time(packets):
+    ''' packets (a PacketTable), sorted by header_timestamp (missing ones last) '''
+    timestamps = np.array([np.nan if t is None else t for t in packets['header_timestamp']], dtype=np.float64) \
+                 if packets['header_timestamp'].dtype == object else packets['header_timestamp'].astype(np.float64)
+    order = np.argsort(timestamps, kind='stable')
+    if np.any(np.diff(order) < 0):
+        packets = packets.take(order)
+    return packets
+
+def encode_columns(packets):
+    ''' The arrays to store packets (a PacketTable, sorted by time) as, by name (see above) '''
+    arrays = {'data': packets.payload[packets.bounds[0]:packets.bounds[-1]],
+              'bounds': packets.bounds - packets.bounds[0]}
+    for k, v in packets.columns.items():
+        if v.dtype == object:
+            mask = np.array([x is None for x in v], dtype=bool)
+            dtype = COLUMN_TYPES.get(k, object)
+            if dtype is object:
+                # (strings, e.g. fname)
+                v = np.array(['' if x is None else str(x) for x in v])
+            else:
+                v = np.array([0 if x is None else x for x in v], dtype=dtype)
+            if k == 'header_timestamp':
+                # (NaN marks the gaps here; they sort to the end)
+                v[mask] = np.nan
+            elif np.any(mask):
+                arrays[k + '.mask'] = mask
+        arrays[k] = v
+    return arrays
+
+def decode_column(name, values, mask=None):
+    ''' A stored column as it's loaded: an object array with None in any gaps (as the same
+        column comes back from the database), or else a copy of the typed array '''
+    if mask is not None or COLUMN_TYPES.get(name) is object:
+        values = values.astype(object)
+        if mask is not None:
+            values[mask] = None
+        return values
+    return np.array(values)
+
+def select_range(raw, masks, names, t1, t2, dtypes=None, date_added=None, columns=None):
+    '''
+    Pick the packets with t1 < header_timestamp < t2 out of a segment or archive (see read_segment).
+    raw(name) gives the stored array for a column (or 'data' or 'bounds'), masks(name) the mask of
+    its gaps (or None), and names is the list of metadata columns.
+    '''
+    if columns is None:
+        columns = ['data'] + list(names)
+
+    timestamps = raw('header_timestamp')
+    i = 0 if t1 is None else np.searchsorted(timestamps, t1, side='right')
+    j = len(timestamps) if t2 is None else max(i, np.searchsorted(timestamps, t2, side='left'))
+
+    mask = None
+    if dtypes:
+        mask = np.isin(raw('dtype')[i:j], list(dtypes))
+    if date_added is not None:
+        added = raw('added')[i:j] > date_added
+        mask = added if mask is None else mask & added
+
+    table_columns = dict()
+    for k in columns:
+        if k != 'data' and k not in names:
+            # (e.g., the CCSDS header fields, in a segment of CSV packets -- missing, as the
+            # same packets' columns come back NULL from the database)
+            table_columns[k] = np.full(j - i, None, dtype=object)
+        elif k != 'data':
+            gaps = masks(k)
+            table_columns[k] = decode_column(k, raw(k)[i:j], None if gaps is None else gaps[i:j])
+    if 'data' in columns:
+        bounds = raw('bounds')[i:j + 1]
+        payload = raw('data')[bounds[0]:bounds[-1]]
+        packets = PacketTable(table_columns, payload, bounds - bounds[0])
+    else:
+        packets = PacketTable(table_columns, bounds=np.zeros(j - i + 1, dtype=np.int64))
+
+    if mask is not None and not np.all(mask):
+        packets = packets.take(mask)
+    return packets
+
+def fsync_directory(path):
+    ''' Flush a directory's entries (e.g., a new file, or a rename) to disk '''
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_segment(path, packets):
+    '''
+    Write packets (a PacketTable) to a new segment at path (a directory, which mustn't
+    exist yet), sorted by header_timestamp. Returns the sorted PacketTable.
+    '''
+    logger = logging.getLogger('write_segment')
+
+    packets = sort_by_time(packets)
+
+    tmp_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.tmp')
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for k, v in encode_columns(packets).items():
+        with open(column_file(tmp_path, k), 'wb') as f:
+            np.save(f, v)
+            f.flush()
+            os.fsync(f.fileno())
+    fsync_directory(tmp_path)
+
+    os.rename(tmp_path, path)
+    fsync_directory(os.path.dirname(path))
+    logger.debug(f'wrote {len(packets)} packets to {path}')
+    return packets
+
+def load_column(path, name):
+    ''' A whole column of the segment at path (see decode_column) '''
+    gaps = np.load(mask_file(path, name)) if os.path.exists(mask_file(path, name)) else None
+    return decode_column(name, np.load(column_file(path, name), mmap_mode='r'), gaps)
+
+def read_segment(path, t1, t2, dtypes=None, date_added=None, columns=None):
+    '''
+    Load the packets from the segment at path with t1 < header_timestamp < t2 (Unix
+    timestamps; None for no limit -- both None for every packet, even any without
+    a timestamp), of a type in dtypes (default: any), added after date_added (a Unix
+    timestamp; default: any time). columns is the list of columns to load (default: all
+    of them; 'data' for the data segments). Returns a PacketTable, sorted by time. (Its
+    payload is a view onto the memory-mapped file, unless packets had to be picked out.)
+    '''
+    raw = lambda k: np.load(column_file(path, k), mmap_mode='r')
+    masks = lambda k: np.load(mask_file(path, k)) if os.path.exists(mask_file(path, k)) else None
+    return select_range(raw, masks, segment_columns(path), t1, t2, dtypes, date_added, columns)
+
+def remove_segment(path):
+    ''' Delete the segment at path (e.g., once it's been compacted into another) '''
+    shutil.rmtree(path, ignore_errors=True)
+
+def write_archive(path, packets):
+    '''
+    Write packets (a PacketTable) to a new, compressed archive file at path (sorted by
+    header_timestamp), and make it read-only. Returns the sorted PacketTable.
+    '''
+    logger = logging.getLogger('write_archive')
+
+    packets = sort_by_time(packets)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **encode_columns(packets))
+        f.flush()
+        os.fsync(f.fileno())
+    os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    os.rename(tmp_path, path)
+
+    logger.debug(f'archived {len(packets)} packets to {path} ({os.path.getsize(path)} bytes)')
+    return packets
+
+@functools.lru_cache(maxsize=ARCHIVE_CACHE_SIZE)
+def load_archive(path):
+    ''' All the arrays in the archive at path, decompressed (by name) '''
+    with np.load(path, allow_pickle=False) as f:
+        return {k: f[k] for k in f.files}
+
+def read_archive(path, t1, t2, dtypes=None, date_added=None, columns=None):
+    ''' Load packets from the archive at path; as read_segment '''
+    arrays = load_archive(path)
+    names = sorted(k for k in arrays if k not in ('data', 'bounds') and not k.endswith('.mask'))
+    return select_range(arrays.__getitem__, lambda k: arrays.get(k + '.mask'), names, t1, t2, dtypes, date_added, columns)
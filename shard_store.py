@@ -0,0 +1,229 @@
+import numpy as np
+import os
+import stat
+import logging
+import datetime
+
+from db_connections import create_connection, get_connection, close_connections, create_table, table_exists
+from db_connections import database_path
+from packet_identity import packet_hashes, known_packets
+from packet_schema import PACKET_DB_PRAGMAS, sql_create_packets_table, create_packet_indexes, insert_packets
+from time_handlers import unix_to_datetime64, SECONDS_PER_DAY
+
+# Optionally, packets can be kept in one database file per month (or year) -- "shards",
+# next to the main packet database (e.g. packets_2020-06.db, for packets.db) -- so no one
+# file grows forever. The main database keeps the file registry, change feed and so on,
+# the catalog of shards (the shards table), and any packets from before it was sharded.
+# Packets are written to the shard for the period of their header timestamp, each over its
+# own connection (SQLite can only attach 10 databases to one, and a file can span more
+# periods than that). The shards' transactions are left open along with the main database's,
+# and commit_packet_db commits them all together -- so a file's packets go in with its
+# registry entry -- or rollback_packet_db rolls them all back. (The shards go first: if we're
+# interrupted between the commits, the file's entry doesn't make it, so the file is read
+# again next time, and the packets already written are skipped.)
+# Once a period has been over for SHARD_SEAL_DAYS (for stragglers), seal_shards makes its
+# shard read-only; anything else which turns up for that period goes to the current
+# period's shard. Readers look up the shards covering the times they want in the catalog
+# (see packet_stores), and only query those.
+
+# Shard periods, and the numpy datetime unit each one corresponds to
+SHARD_PERIODS = {'month': 'datetime64[M]', 'year': 'datetime64[Y]'}
+# Days to wait after the end of a shard's period before sealing it
+SHARD_SEAL_DAYS = 7
+
+SHARD_FIELDS = ['name', 'path', 'period_end', 't_min', 't_max', 'packet_count', 'sealed']
+
+def shard_periods(timestamps, shard_period):
+    ''' The shard period (e.g., '2020-06' for monthly shards) of each of the given Unix timestamps,
+        and the Unix timestamps of the end of each period '''
+    periods = unix_to_datetime64(timestamps).astype(SHARD_PERIODS[shard_period])
+    ends = (periods + 1).astype('datetime64[us]').astype(np.int64)/1e6
+    return periods.astype(str), ends
+
+def create_shard_catalog(conn):
+    ''' The catalog of shards (see write_to_shards). Empty, unless the database is sharded. '''
+    conn.execute(''' CREATE TABLE IF NOT EXISTS shards (
+                        name TEXT PRIMARY KEY,
+                        path TEXT,
+                        period_end REAL,
+                        t_min REAL,
+                        t_max REAL,
+                        packet_count INTEGER,
+                        sealed INTEGER,
+                        created REAL
+                    ); ''')
+
+def get_shards(database):
+    ''' The catalog of shards of the packet database (a list of dictionaries, in time order),
+        with the full path to each shard '''
+    conn = get_connection(database, readonly=True)
+    if not table_exists(conn, 'shards'):
+        return []
+    root = os.path.dirname(database_path(conn))
+    cur = conn.cursor()
+    cur.execute(f"SELECT {', '.join(SHARD_FIELDS)} FROM shards ORDER BY name")
+    shards = [dict(zip(SHARD_FIELDS, r)) for r in cur.fetchall()]
+    for s in shards:
+        s['path'] = os.path.join(root, s['path'])
+    return shards
+
+def packet_stores(database, t1=None, t2=None):
+    '''
+    Read-only connections to the databases which might hold packets with header timestamps
+    between t1 and t2 (Unix timestamps; None for no limit): the main packet database, and
+    any of its shards which cover part of that time.
+    '''
+    conn = get_connection(database, readonly=True)
+    stores = [conn]
+    for s in get_shards(conn):
+        if s['t_min'] is None or (t2 is not None and s['t_min'] > t2) or (t1 is not None and s['t_max'] < t1):
+            continue
+        stores.append(get_connection(s['path'], readonly=True))
+    return stores
+
+def create_shard(conn, name, period_end):
+    ''' Create the shard for period name (if it doesn't exist yet), and enter it in the
+        catalog of the main database (conn). Returns the path to the shard. '''
+    logger = logging.getLogger('create_shard')
+
+    root, ext = os.path.splitext(database_path(conn))
+    path = f'{root}_{name}{ext}'
+    if not os.path.exists(path):
+        logger.info(f'creating shard {path}')
+        shard = create_connection(path)
+        for pragma in PACKET_DB_PRAGMAS:
+            shard.execute(pragma)
+        create_table(shard, sql_create_packets_table)
+        create_packet_indexes(shard)
+        shard.execute('CREATE UNIQUE INDEX IF NOT EXISTS packets_hash ON packets (hash)')
+        shard.commit()
+        shard.close()
+    conn.execute('''INSERT OR IGNORE INTO shards (name, path, period_end, packet_count, sealed, created)
+                    VALUES(?, ?, ?, 0, 0, ?)''', (name, os.path.basename(path), period_end, datetime.datetime.now().timestamp()))
+    return path
+
+# The shards written to in the open transaction of each main packet database (by path)
+_open_shards = dict()
+
+def open_shard(conn, name, period_end):
+    '''
+    The read-write connection to the shard for period name, creating the shard if need be,
+    for writing packets to in the open transaction of conn (the main packet database's
+    read-write connection) -- commit_packet_db commits it along with conn.
+    '''
+    # (Entered in the catalog as part of the open transaction, every time -- in case that's
+    # rolled back after creating the shard)
+    path = create_shard(conn, name, period_end)
+    shard = get_connection(path)
+    if not shard.in_transaction:
+        # (Not kept from one connection to the next, and can't be changed mid-transaction)
+        shard.execute('PRAGMA synchronous=NORMAL')
+    _open_shards.setdefault(database_path(conn), set()).add(path)
+    return shard
+
+def commit_packet_db(conn):
+    ''' Commit the open transaction of the packet database (conn is its read-write connection),
+        and of any shards written to in it: the shards first, then the main database '''
+    for path in sorted(_open_shards.pop(database_path(conn), ())):
+        get_connection(path).commit()
+    conn.commit()
+
+def rollback_packet_db(conn):
+    ''' Roll back the open transaction of the packet database (conn is its read-write connection),
+        and of any shards written to in it '''
+    for path in sorted(_open_shards.pop(database_path(conn), ())):
+        get_connection(path).rollback()
+    conn.rollback()
+
+def write_to_shards(conn, packets, shard_period):
+    '''
+    Insert packets (a PacketTable) into the shards of the packet database (conn is the main
+    database's connection), by the period of their header timestamps. Packets for sealed periods
+    (and any without a header timestamp) go to the current period's shard instead. Packets we
+    already have -- in the shard, in a sealed shard for their period, or in the main database --
+    are skipped. Doesn't commit; that's left to the caller, with commit_packet_db (which commits
+    the shards along with the main database; or rollback_packet_db). Returns the number of
+    packets written.
+    '''
+    logger = logging.getLogger('write_to_shards')
+
+    now = datetime.datetime.now().timestamp()
+    timestamps = packets['header_timestamp']
+    if timestamps.dtype == object:
+        timestamps = np.array([np.nan if t is None else t for t in timestamps], dtype=np.float64)
+    names, ends = shard_periods(np.where(np.isfinite(timestamps), timestamps, now), shard_period)
+    current_name, current_end = [x[0] for x in shard_periods([now], shard_period)]
+
+    hashes, near_hashes = [np.array(h, dtype=np.int64) for h in packet_hashes(packets, near=True)]
+    keep = np.ones(len(packets), dtype=bool)
+
+    # Anything from before the database was sharded
+    if conn.execute('SELECT 1 FROM packets LIMIT 1').fetchone() is not None:
+        keep &= ~known_packets(conn, 'packets', hashes, near_hashes)
+
+    # Stragglers for sealed periods
+    shards = {s['name']: s for s in get_shards(conn)}
+    for name in np.unique(names):
+        if name != current_name and name in shards and shards[name]['sealed']:
+            in_period = names == name
+            keep[in_period] &= ~known_packets(get_connection(shards[name]['path'], readonly=True), 'packets',
+                                              hashes[in_period], near_hashes[in_period])
+            logger.info(f'shard {name} is sealed; writing {np.sum(keep & in_period)} packets to shard {current_name}')
+            names[in_period] = current_name
+            ends[in_period] = current_end
+
+    num_written = 0
+    for name in np.unique(names[keep]):
+        inds = np.flatnonzero(keep & (names == name))
+        shard = open_shard(conn, name, ends[inds[0]])
+        num = insert_packets(shard, packets[inds], 'packets', hashes[inds], near_hashes[inds], feed=conn)
+        if num > 0:
+            t = timestamps[inds]
+            t_min, t_max = (float(np.nanmin(t)), float(np.nanmax(t))) if np.any(np.isfinite(t)) else (None, None)
+            conn.execute('''UPDATE shards SET t_min = MIN(IFNULL(t_min, ?), ?), t_max = MAX(IFNULL(t_max, ?), ?),
+                            packet_count = packet_count + ? WHERE name = ?''',
+                         (t_min, t_min, t_max, t_max, num, name))
+        num_written += num
+
+    return num_written
+
+def seal_shards(conn, now=None):
+    '''
+    Seal the shards of the packet database (conn is the main database's read-write connection)
+    whose periods ended more than SHARD_SEAL_DAYS ago: fold in the write-ahead log and switch
+    the shard out of WAL mode (so it's a single, self-contained file), update its statistics,
+    make the file read-only, and mark it sealed in the catalog. Commits.
+    Returns the names of the shards sealed.
+    '''
+    logger = logging.getLogger('seal_shards')
+
+    if now is None:
+        now = datetime.datetime.now().timestamp()
+
+    sealed = []
+    for s in get_shards(conn):
+        if s['sealed'] or s['period_end'] + SHARD_SEAL_DAYS*SECONDS_PER_DAY > now:
+            continue
+
+        commit_packet_db(conn)
+        close_connections(s['path'])
+
+        shard = create_connection(s['path'])
+        shard.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        journal_mode = shard.execute('PRAGMA journal_mode=DELETE').fetchone()[0]
+        shard.execute('ANALYZE')
+        shard.commit()
+        shard.close()
+        if journal_mode.lower() != 'delete':
+            # (Someone else has it open)
+            logger.warning(f"couldn't seal shard {s['name']} (in use); will try again next time")
+            continue
+
+        mode = stat.S_IMODE(os.stat(s['path']).st_mode)
+        os.chmod(s['path'], mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+        conn.execute('UPDATE shards SET sealed = 1 WHERE name = ?', (s['name'],))
+        conn.commit()
+        logger.info(f"sealed shard {s['name']} ({s['packet_count']} packets)")
+        sealed.append(s['name'])
+
+    return sealed
@@ -0,0 +1,277 @@
+import numpy as np
+
+from packet_table import make_column, concatenate_columns
+
+
+# Number of frequency bins in each of the E and B channels
+SURVEY_BINS = 512
+
+# Types for the GPS fields from decode_GPS_data. (Anything else gets whatever type
+# numpy infers for it; and as in a PacketTable, a field which some products are
+# missing -- e.g., if we only got the velocity message -- is stored as objects, with
+# None marking the gaps.)
+GPS_TYPES = {
+    'lat': np.float64,
+    'lon': np.float64,
+    'alt': np.float64,
+    'tracked_sats': np.int64,
+    'used_sats': np.int64,
+    'time_status': np.int64,
+    'receiver_status': np.int64,
+    'weeknum': np.float64,
+    'sec_offset': np.float64,
+    'solution_status': np.int64,
+    'solution_type': np.int64,
+    'horiz_speed': np.float64,
+    'vert_speed': np.float64,
+    'ground_track': np.float64,
+    'latency': np.float64,
+    'timestamp': np.float64,
+}
+
+# Types for the other fields of a survey product
+SURVEY_TYPES = {
+    'header_timestamp': np.float64,
+    'exp_num': np.int64,
+}
+
+# How many rows to unpack into dictionaries at a time, when iterating
+ITER_CHUNK_SIZE = 4096
+
+
+def field_names(entries):
+    ''' The keys of a list of dictionaries, in order of appearance '''
+    keys = []
+    for e in entries:
+        for k in e:
+            if k not in keys:
+                keys.append(k)
+    return keys
+
+
+def gps_columns(entries):
+    ''' Typed GPS columns, from a list of GPS dictionaries (an empty one for a product without GPS) '''
+    return {k: make_column([e.get(k) for e in entries], k, GPS_TYPES) for k in field_names(entries)}
+
+
+def present(column):
+    ''' True where a column isn't missing a value '''
+    if column.dtype != object:
+        return np.ones(len(column), dtype=bool)
+    return np.array([v is not None for v in column], dtype=bool)
+
+
+def as_float(column, fill=np.nan):
+    ''' A column as float64, with fill where it's missing a value '''
+    if column.dtype != object:
+        return column.astype(np.float64)
+    return np.array([fill if v is None else v for v in column], dtype=np.float64)
+
+
+class SurveyFrame(object):
+    '''
+    A columnar container for decoded survey products.
+
+    Rather than a list of per-product dictionaries (each holding its own E and B
+    arrays, and a one-element list with a dictionary of GPS fields), the E and B
+    data are stored as (num_products x 512) uint8 matrices, and the header
+    timestamps, experiment numbers, and each of the GPS fields as typed numpy
+    arrays, one entry per product.
+
+    Like a PacketTable, a SurveyFrame behaves like the list of dictionaries, too:
+        len(frame), bool(frame)     number of products
+        for S in frame:             yields product dictionaries: E_data, B_data,
+                                    header_timestamp, exp_num, and GPS (a list of
+                                    one dictionary, of the fields that product has;
+                                    no GPS key, if it has none. Likewise, any other
+                                    field a product is missing is left out.)
+        frame[i]                    the i'th product dictionary
+        frame + other               concatenation (with another frame, or a list of products)
+    and supports columnar access:
+        frame.E, frame.B            the data matrices
+        frame['header_timestamp']   a column array (also 'E_data' and 'B_data')
+        frame.GPS['lat']            a GPS column (see gps(), for floats with NaN for gaps)
+        frame[mask], frame[inds],
+        frame[i:j]                  a new SurveyFrame, with the selected products
+    '''
+
+    def __init__(self, E=None, B=None, columns=None, GPS=None):
+        '''
+        inputs:
+            E, B:       (num_products x 512) uint8 arrays of survey data
+            columns:    dictionary of 1d arrays (header_timestamp, exp_num), one entry per product
+            GPS:        dictionary of 1d arrays of GPS fields, one entry per product
+        '''
+        self.columns = dict(columns) if columns else dict()
+        self.GPS = dict(GPS) if GPS else dict()
+        if E is not None:
+            num_products = len(E)
+        elif self.columns:
+            num_products = len(next(iter(self.columns.values())))
+        else:
+            num_products = 0
+        self.E = np.zeros((num_products, SURVEY_BINS), dtype=np.uint8) if E is None else np.asarray(E, dtype=np.uint8)
+        self.B = np.zeros((num_products, SURVEY_BINS), dtype=np.uint8) if B is None else np.asarray(B, dtype=np.uint8)
+
+        for name, v in [('B', self.B)] + list(self.columns.items()) + list(self.GPS.items()):
+            if len(v) != num_products:
+                raise ValueError(f'column {name} has length {len(v)}; expected {num_products}')
+
+    # ---------------- Construction ----------------
+    @classmethod
+    def from_entries(cls, entries):
+        ''' Build a SurveyFrame from a list of survey product dictionaries (or return a SurveyFrame as-is) '''
+        if isinstance(entries, SurveyFrame):
+            return entries
+        entries = list(entries)
+
+        E = np.array([e['E_data'] for e in entries], dtype=np.uint8).reshape(len(entries), SURVEY_BINS)
+        B = np.array([e['B_data'] for e in entries], dtype=np.uint8).reshape(len(entries), SURVEY_BINS)
+        keys = [k for k in field_names(entries) if k not in ('E_data', 'B_data', 'GPS')]
+        columns = {k: make_column([e.get(k) for e in entries], k, SURVEY_TYPES) for k in keys}
+        GPS = gps_columns([e['GPS'][0] if e.get('GPS') else dict() for e in entries])
+
+        return cls(E, B, columns, GPS)
+
+    @classmethod
+    def concatenate(cls, frames):
+        ''' Join a list of SurveyFrames (or lists of survey products) end to end '''
+        frames = [cls.from_entries(f) for f in frames]
+        frames = [f for f in frames if len(f)]
+        if not frames:
+            return cls()
+        if len(frames) == 1:
+            return frames[0]
+
+        lengths = [len(f) for f in frames]
+        return cls(np.concatenate([f.E for f in frames]),
+                   np.concatenate([f.B for f in frames]),
+                   concatenate_columns([f.columns for f in frames], lengths),
+                   concatenate_columns([f.GPS for f in frames], lengths))
+
+    # ---------------- Properties ----------------
+    def keys(self):
+        return ['E_data', 'B_data'] + list(self.columns.keys())
+
+    def __len__(self):
+        return len(self.E)
+
+    def __repr__(self):
+        return f'SurveyFrame({len(self)} products, columns={list(self.columns.keys())}, GPS={list(self.GPS.keys())})'
+
+    # ---------------- Access ----------------
+    def gps(self, name, fill=np.nan):
+        ''' The GPS field name as a float64 array, with fill wherever it's missing '''
+        if name not in self.GPS:
+            return np.full(len(self), fill, dtype=np.float64)
+        return as_float(self.GPS[name], fill)
+
+    def has_gps(self, *names):
+        ''' True for the products which have all of the GPS fields names (or, with no names, any GPS fields) '''
+        if not names:
+            mask = np.zeros(len(self), dtype=bool)
+            for v in self.GPS.values():
+                mask |= present(v)
+            return mask
+        mask = np.ones(len(self), dtype=bool)
+        for k in names:
+            mask &= present(self.GPS[k]) if k in self.GPS else False
+        return mask
+
+    def set_gps(self, name, rows, values):
+        ''' Overwrite the GPS field name, for the products selected by rows (in place) '''
+        if name not in self.GPS:
+            self.GPS[name] = np.full(len(self), None, dtype=object)
+        self.GPS[name][rows] = values
+
+    def timestamps(self):
+        ''' The GPS timestamp of each product, or its header timestamp where it hasn't got one '''
+        t = self.gps('timestamp')
+        missing = np.isnan(t)
+        t[missing] = as_float(self.columns['header_timestamp'])[missing]
+        return t
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key == 'E_data':
+                return self.E
+            if key == 'B_data':
+                return self.B
+            return self.columns[key]
+
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            if key < 0 or key >= len(self):
+                raise IndexError('survey product index out of range')
+            return next(iter(self.take(slice(key, key + 1))))
+
+        return self.take(key)
+
+    def take(self, key):
+        ''' A new SurveyFrame with the products selected by key (a slice, boolean mask, or index array) '''
+        inds = np.arange(len(self))[key]
+        return SurveyFrame(self.E[inds], self.B[inds],
+                           {k: v[inds] for k, v in self.columns.items()},
+                           {k: v[inds] for k, v in self.GPS.items()})
+
+    def between(self, t1, t2):
+        ''' The products with t1 <= timestamp < t2 (Unix timestamps; see timestamps()) '''
+        t = self.timestamps()
+        return self.take((t >= t1) & (t < t2))
+
+    def sort(self, key='header_timestamp'):
+        '''
+        A new SurveyFrame, sorted (stably) by key: a column name, a GPS field name
+        (missing values sort last), or an array with one sort key per product
+        '''
+        if isinstance(key, str):
+            key = as_float(self.columns[key]) if key in self.columns else self.gps(key)
+        return self.take(np.argsort(key, kind='stable'))
+
+    def unique(self):
+        '''
+        A new SurveyFrame without duplicate products (the same data, timestamps, experiment
+        number and GPS fields), keeping the first of each, in order
+        '''
+        if len(self) == 0:
+            return self
+        parts = [self.E, self.B]
+        for c in (self.columns, self.GPS):
+            for k in sorted(c):
+                v = c[k]
+                if v.dtype == object:
+                    parts.append(present(v).astype(np.uint8)[:, np.newaxis])
+                    v = as_float(v, fill=0)
+                parts.append(np.ascontiguousarray(v).view(np.uint8).reshape(len(self), -1))
+        rows = np.ascontiguousarray(np.hstack(parts))
+        rows = rows.view(np.dtype((np.void, rows.shape[1]))).ravel()
+        _, first = np.unique(rows, return_index=True)
+        return self.take(np.sort(first))
+
+    def __iter__(self):
+        names = list(self.columns.keys())
+        gps_names = list(self.GPS.keys())
+        for chunk_start in range(0, len(self), ITER_CHUNK_SIZE):
+            chunk = slice(chunk_start, min(chunk_start + ITER_CHUNK_SIZE, len(self)))
+            values = [self.columns[k][chunk].tolist() for k in names]
+            gps_values = [self.GPS[k][chunk].tolist() for k in gps_names]
+            for i in range(chunk.stop - chunk.start):
+                S = dict()
+                G = {k: v[i] for k, v in zip(gps_names, gps_values) if v[i] is not None}
+                if G:
+                    S['GPS'] = [G]
+                S['E_data'] = self.E[chunk_start + i]
+                S['B_data'] = self.B[chunk_start + i]
+                S.update((k, v[i]) for k, v in zip(names, values) if v[i] is not None)
+                yield S
+
+    def __add__(self, other):
+        return SurveyFrame.concatenate([self, other])
+
+    def __radd__(self, other):
+        return SurveyFrame.concatenate([other, self])
+
+    def to_entries(self):
+        ''' Unpack into a list of survey product dictionaries '''
+        return list(self)
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# (The modules live at the top of the repository)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from db_connections import close_connections
+
+
+@pytest.fixture(autouse=True)
+def shared_connections():
+    ''' Close the shared database connections after each test '''
+    yield
+    close_connections()
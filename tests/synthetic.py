@@ -0,0 +1,168 @@
+'''
+Synthetic telemetry for the tests: .TLM files (with bad checksums and stretches of
+garbage between frames), KSat .CSV files, and survey packets with GPS blocks.
+'''
+import numpy as np
+import datetime
+import struct
+
+
+def escape(values):
+    ''' HDLC-escape a list of bytes '''
+    out = []
+    for x in values:
+        if x == 0x7E:
+            out += [0x7D, 0x5E]
+        elif x == 0x7D:
+            out += [0x7D, 0x5D]
+        else:
+            out.append(x)
+    return out
+
+
+def make_frame(rng, start_ind, dtype, exp_num, bad_checksum=False):
+    ''' One escaped 512-byte frame (as a list of bytes), with a random data segment
+        (including a few bytes which need escaping) '''
+    while True:
+        data = rng.integers(0, 256, 520).tolist()
+        for k in rng.integers(0, 520, rng.integers(0, 6)):
+            data[k] = int(rng.choice([0x7E, 0x7D]))
+        frame = [0x7E] + escape(list(struct.pack('>I', start_ind)) + [ord(dtype), exp_num])
+        bytecount = 0
+        for x in data:
+            e = escape([x])
+            if len(frame) + len(e) > 506:
+                break
+            frame += e
+            bytecount += 1
+        tail = escape(list(struct.pack('>H', bytecount)) + [0])
+        # (Pad the data segment, so the frame comes out at 512 bytes)
+        pad = 509 - len(frame) - len(tail)
+        if pad < 0:
+            continue
+        frame += [0x11]*pad
+        bytecount += pad
+        frame += escape(list(struct.pack('>H', bytecount)) + [0])
+        if len(frame) != 509:
+            continue
+        checksum = sum(frame[2:509]) % 256
+        if checksum in (0x7E, 0x7D):
+            continue
+        if bad_checksum:
+            checksum = (checksum + 1) % 256
+            if checksum in (0x7E, 0x7D):
+                checksum = 0x01
+        return frame + [checksum, 0, 0x7E]
+
+
+def make_tlm(path, num_frames, seed=0):
+    ''' Write a .TLM file of num_frames frames, each behind a CCSDS header; every 97th frame
+        has a bad checksum, and some are followed by garbage '''
+    rng = np.random.default_rng(seed)
+    out = bytearray(rng.integers(0, 256, 40, dtype=np.uint8).tobytes())
+    for i in range(num_frames):
+        header = bytearray(26)
+        header[0:4] = struct.pack('>I', 534)
+        header[5:8] = bytes([34, 1, 2])
+        header[8:12] = struct.pack('>I', 1234567890 + i)
+        header[12:16] = struct.pack('>I', int(rng.integers(0, 10**9)))
+        header[16:18] = struct.pack('>H', 7)
+        out += header
+        out += bytes(make_frame(rng, int(rng.integers(0, 100000)), 'SEBGI'[i % 5], int(rng.integers(0, 256)),
+                                bad_checksum=(i % 97 == 3)))
+        if i % 50 == 7:
+            out += rng.integers(0, 256, int(rng.integers(1, 700)), dtype=np.uint8).tobytes()
+    with open(path, 'wb') as f:
+        f.write(bytes(out))
+
+
+def make_csv(path, num_rows, seed=1, delimiter=','):
+    ''' Write a KSat .CSV file of num_rows packets (after a preamble), with a few bad checksums,
+        truncated frames, and rows for other targets and packet types mixed in '''
+    rng = np.random.default_rng(seed)
+    t0 = datetime.datetime(2020, 6, 12, 1, 2, 3)
+    lines = ['Some export preamble', 'generated by station',
+             delimiter.join(['TARGET', 'PACKET', 'UTC_TIME', 'DYNAMIC_DATA', 'EXTRA'])]
+    for i in range(num_rows):
+        frame = make_frame(rng, int(rng.integers(0, 100000)), 'SEBGI'[i % 5], int(rng.integers(0, 256)),
+                           bad_checksum=(i % 53 == 5))
+        before = rng.integers(0, 0x7D, int(rng.integers(0, 20)), dtype=np.uint8).tobytes()
+        after = rng.integers(0, 0x7D, int(rng.integers(0, 20)), dtype=np.uint8).tobytes()
+        hex_data = (before + bytes(frame) + after).hex().upper()
+        if i % 67 == 6:
+            hex_data = hex_data[:100]
+        t = t0 + datetime.timedelta(microseconds=int(i*1234567 + rng.integers(0, 1000)))
+        lines.append(delimiter.join(['VPM' if i % 41 != 2 else 'OTHER',
+                                     'PAYLOAD_INTERFACE_RECEIVE_RAW_PAYLOAD_DATA' if i % 43 != 4 else 'SOMETHING_ELSE',
+                                     t.isoformat(timespec='microseconds') + 'Z', hex_data, 'x']))
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def bestpos(rng, week, ms):
+    ''' A BESTPOS log, as bytes '''
+    header = bytes([0xAA, 0x44, 0x12, 0x1C, 0x2A, 0, 0, 0, 0, 0, 0, 0, 0, int(rng.choice([20, 100, 160, 180]))])
+    header += struct.pack('<HII', week, ms, int(rng.integers(0, 2**32))) + bytes(4)
+    body = struct.pack('<IIddd', int(rng.integers(0, 3)), int(rng.integers(0, 60)),
+                       rng.uniform(-90, 90), rng.uniform(-180, 180), rng.uniform(4e5, 5e5))
+    body += bytes(64 - len(body)) + bytes([int(rng.integers(0, 30)), int(rng.integers(0, 30))]) + bytes(6)
+    return header + body + bytes(4)
+
+
+def bestvel(rng, week, ms):
+    ''' A BESTVEL log, as bytes '''
+    header = bytes([0xAA, 0x44, 0x12, 0x1C, 0x63, 0, 0, 0, 0, 0, 0, 0, 0, int(rng.choice([20, 100, 160, 180]))])
+    header += struct.pack('<HII', week, ms, int(rng.integers(0, 2**32))) + bytes(4)
+    body = struct.pack('<IIffddd', int(rng.integers(0, 3)), int(rng.integers(0, 60)), rng.uniform(0, 1),
+                       rng.uniform(0, 1), rng.uniform(7000, 8000), rng.uniform(0, 360), rng.uniform(-10, 10))
+    return header + body + bytes(8)
+
+
+def gps_block(rng, week=None, ms=None, parts=('pos', 'vel')):
+    ''' The 180-byte GPS block of a survey product: a BESTPOS and a BESTVEL log (or either one,
+        with the other left empty) '''
+    if week is None:
+        week = int(rng.integers(2000, 2200))
+    if ms is None:
+        ms = int(rng.integers(0, 604800000))
+    pos = bestpos(rng, week, ms)
+    vel = bestvel(rng, week, ms)
+    block = (pos if 'pos' in parts else bytes(len(pos))) + (vel if 'vel' in parts else bytes(len(vel)))
+    return np.frombuffer(block, dtype=np.uint8).copy()
+
+
+def survey_packets(num_products, seed=5):
+    '''
+    Survey packets (a shuffled list of packet dictionaries) for num_products products, with GPS
+    blocks (some with only one log, or none), exp_num rolling over, and some products with
+    overlapping, missing, duplicated or mis-sized packets.
+    '''
+    rng = np.random.default_rng(seed)
+    week = 2100
+    t = 315964800 + week*604800 - 18 + 2*86400.
+    packets = []
+    for k in range(num_products):
+        product = rng.integers(0, 256, 1212).astype(np.uint8)
+        parts = [('pos', 'vel'), ('pos', 'vel'), ('pos',), ('vel',), ()][k % 5]
+        product[1028:1208] = gps_block(rng, week, int((t - 315964800 - week*604800 + 18)*1000), parts)
+        pieces = [(0, 504), (504, 1008), (1008, 1212)]
+        if k % 7 == 0:
+            pieces = [(0, 600), (500, 1008), (1008, 1212)]
+        if k % 11 == 0:
+            pieces = pieces[:2]
+        if k % 13 == 0:
+            pieces = pieces + [pieces[0]]
+        for i, (a, b) in enumerate(pieces):
+            data = product[a:b].tolist()
+            bytecount = b - a
+            if k % 97 == 0 and i == 1:
+                bytecount += 3
+            if k % 89 == 0 and i == 2:
+                a, bytecount, data = 1100, 112, data[:112]
+            packets.append(dict(data=data, start_ind=a, dtype='S', exp_num=np.uint8(k % 256), bytecount=bytecount,
+                                checksum_verify=True, packet_length=512, fname='x.tlm', header_ns=0,
+                                header_epoch_sec=0, header_reboots=1,
+                                header_timestamp=t + i*0.1 + (k % 5 == 0)*i*10))
+        t += 10
+    order = rng.permutation(len(packets))
+    return [packets[i] for i in order]
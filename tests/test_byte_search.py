@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import reference
+from byte_search import find_sequences, find_sequence, find_sequences_batch
+from data_handlers import ESCAPE_SEQUENCES, BESTPOS_SYNC, BESTVEL_SYNC
+
+SEQUENCES = ESCAPE_SEQUENCES + [BESTPOS_SYNC, BESTVEL_SYNC, [0x7D], [0x7D, 0x7D, 0x7D], [0x11, 0x7D]]
+
+
+def random_bytes(rng, size):
+    ''' Random bytes, mostly from a few values, so there are plenty of (overlapping) matches '''
+    arr = rng.choice(np.array([0x7D, 0x5E, 0x5D, 0x11, 0xAA, 0x44, 0x12, 0x1C, 0x2A, 0x63], dtype=np.uint8), size)
+    # (... and some whole sync words)
+    for k in rng.integers(0, max(size - 5, 1), size//100):
+        arr[k:k + 5] = BESTPOS_SYNC if k % 2 else BESTVEL_SYNC
+    return arr[:size]
+
+
+def expected(arr, seq):
+    seq = np.asarray(seq)
+    if seq.size > arr.size:
+        return np.zeros(0, dtype=np.int64)
+    return reference.find_sequence(arr, seq)
+
+
+@pytest.mark.parametrize('size', [0, 1, 4, 1000, 20000])
+def test_find_sequences(size):
+    rng = np.random.default_rng(size)
+    arr = random_bytes(rng, size)
+    matches = find_sequences(arr, SEQUENCES)
+    assert len(matches) == len(SEQUENCES)
+    for seq, inds in zip(SEQUENCES, matches):
+        assert np.array_equal(inds, expected(arr, seq)), seq
+        assert np.array_equal(find_sequence(arr, np.array(seq)), inds)
+    if size >= 1000:
+        assert len(matches[2]) and len(matches[3])
+
+
+def test_find_sequences_in_floats():
+    # (e.g., a survey product with missing bytes as NaN)
+    rng = np.random.default_rng(3)
+    arr = random_bytes(rng, 5000).astype(np.float64)
+    arr[rng.integers(0, 5000, 500)] = np.nan
+    for seqs in [[BESTPOS_SYNC], [BESTPOS_SYNC, [0x44, 0x12]], SEQUENCES]:
+        for seq, inds in zip(seqs, find_sequences(arr, seqs)):
+            assert np.array_equal(inds, expected(arr, seq)), seq
+
+
+def test_find_sequences_edge_cases():
+    arr = np.array([0x7D, 0x7D, 0x7D], dtype=np.uint8)
+    assert find_sequences(arr, []) == []
+    empty, long, run = find_sequences(arr, [[], [0x7D]*4, [0x7D, 0x7D]])
+    assert len(empty) == 0 and len(long) == 0
+    assert np.array_equal(run, [0, 1])
+
+
+@pytest.mark.parametrize('as_2d', [False, True])
+def test_find_sequences_batch(as_2d):
+    rng = np.random.default_rng(7)
+    if as_2d:
+        buffers = random_bytes(rng, 40*101).reshape(40, 101)
+    else:
+        buffers = [random_bytes(rng, n) for n in rng.integers(0, 300, 40)] + [np.zeros(0, dtype=np.uint8)]
+    matches = find_sequences_batch(buffers, SEQUENCES)
+    assert len(matches) == len(SEQUENCES)
+
+    # (The same as searching each buffer on its own: no matches spanning two buffers)
+    for seq, (buffer_index, offset) in zip(SEQUENCES, matches):
+        per_buffer = [(b, k) for b, buf in enumerate(buffers) for k in expected(np.asarray(buf), seq)]
+        assert list(zip(buffer_index.tolist(), offset.tolist())) == per_buffer, seq
+    assert len(matches[SEQUENCES.index(BESTPOS_SYNC)][0])
+
+
+def test_find_sequences_batch_no_buffers():
+    (buffer_index, offset), = find_sequences_batch([], [BESTPOS_SYNC])
+    assert len(buffer_index) == 0 and len(offset) == 0
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+import data_handlers
+import reference
+from data_handlers import decode_packets_CSV, iter_packets_CSV, new_ingest_state
+from packet_table import PacketTable
+from synthetic import make_csv
+
+
+@pytest.fixture(scope='module', params=[',', '\t'])
+def csv_file(request, tmp_path_factory):
+    root = tmp_path_factory.mktemp('csv')
+    make_csv(str(root / 'synthetic.csv'), 500, delimiter=request.param)
+    return str(root), 'synthetic.csv'
+
+
+def test_decode_packets_CSV(csv_file):
+    expected = reference.decode_packets_CSV(*csv_file)
+    assert len(expected) > 400
+    reference.same_packets(expected, decode_packets_CSV(*csv_file))
+
+
+def test_iter_packets_CSV_in_small_chunks(csv_file, monkeypatch):
+    monkeypatch.setattr(data_handlers, 'CSV_CHUNK_ROWS', 7)
+    batches = list(iter_packets_CSV(*csv_file, batch_size=10))
+    assert all(len(b) <= 10 for b in batches)
+    reference.same_packets(reference.decode_packets_CSV(*csv_file), PacketTable.concatenate(batches))
+
+
+def read_in_runs(csv_file, cuts, tmp_path):
+    ''' Read a copy of the file with iter_packets_CSV as it grows: cut off at each of cuts
+        (byte offsets) in turn, then whole. Checks that every packet is read exactly once. '''
+    with open(os.path.join(*csv_file), 'rb') as f:
+        contents = f.read()
+    fpath = str(tmp_path / 'growing.csv')
+    state = new_ingest_state(fpath)
+    batches = []
+    for cut in list(cuts) + [len(contents)]:
+        with open(fpath, 'wb') as f:
+            f.write(contents[:cut])
+        batches += list(iter_packets_CSV(str(tmp_path), 'growing.csv', state=state))
+
+    expected = [dict(p, fname='growing.csv') for p in reference.decode_packets_CSV(*csv_file)]
+    reference.same_packets(expected, PacketTable.concatenate(batches))
+    assert state['byte_offset'] == len(contents) and state['packet_count'] == len(expected)
+    assert state['count'] == contents.count(b'\n') - 3
+
+
+def rows(csv_file):
+    ''' The rows of the file (after the header row), and the byte offset of each '''
+    with open(os.path.join(*csv_file), 'rb') as f:
+        lines = f.read().split(b'\n')
+    starts = [sum(len(l) + 1 for l in lines[:k]) for k in range(len(lines))]
+    return lines[3:-1], starts[3:-1]
+
+
+def test_append_between_runs(csv_file, tmp_path):
+    # (Whole rows appended each time: none, one, a few, and then many)
+    lines, starts = rows(csv_file)
+    read_in_runs(csv_file, [starts[k] for k in [0, 0, 1, 4, 40, 41, 300]], tmp_path)
+
+
+@pytest.mark.parametrize('where', ['in the hex data', 'after the hex data', 'in the last column', 'before the newline'])
+def test_resume_mid_row(csv_file, tmp_path, monkeypatch, where):
+    # (Runs which stop partway through a row -- the file still being written. Cut off in the
+    #  hex data, the row has no packet yet, and is read again next time; cut off after it,
+    #  the packet's read, and the rest of the row skipped next time)
+    monkeypatch.setattr(data_handlers, 'CSV_CHUNK_ROWS', 16)
+    delimiter = b',' if b'TARGET,' in open(os.path.join(*csv_file), 'rb').read() else b'\t'
+    lines, starts = rows(csv_file)
+    cuts = []
+    for k in [0, 14, 15, 16, 100, 101, 250]:
+        hex_end = lines[k].rindex(delimiter)
+        offset = {'in the hex data': hex_end//2 + 100, 'after the hex data': hex_end,
+                  'in the last column': hex_end + 1, 'before the newline': len(lines[k])}[where]
+        cuts.append(starts[k] + offset)
+    read_in_runs(csv_file, cuts, tmp_path)
+
+
+def test_resume_mid_header(csv_file, tmp_path):
+    lines, starts = rows(csv_file)
+    read_in_runs(csv_file, [0, 10, starts[0] - 20, starts[0] - 1, starts[0] + 5], tmp_path)
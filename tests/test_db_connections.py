@@ -0,0 +1,103 @@
+import os
+import sqlite3
+import multiprocessing
+
+import pytest
+
+import db_connections
+from db_connections import get_connection, close_connections, read_snapshot
+
+
+def parents_connection_reused(db):
+    ''' (In a forked worker) whether get_connection hands back the connection the parent process had '''
+    inherited = db_connections._connections[(os.getppid(), os.path.abspath(db), False)]
+    return get_connection(db) is inherited
+
+
+def test_get_connection_is_shared(tmp_path, monkeypatch):
+    db = str(tmp_path / 'a.db')
+    conn = get_connection(db)
+    assert get_connection(db) is conn
+    assert get_connection(conn) is conn
+    monkeypatch.chdir(tmp_path)
+    assert get_connection('a.db') is conn
+    assert conn.execute('PRAGMA cache_size').fetchone()[0] == -65536
+
+    reader = get_connection(db, readonly=True)
+    assert reader is not conn and get_connection(db, readonly=True) is reader
+    assert get_connection(str(tmp_path / 'b.db')) is not conn
+
+    # (A connection closed by the caller is replaced)
+    conn.close()
+    conn = get_connection(db)
+    conn.execute('CREATE TABLE t (x)')
+    conn.commit()
+    assert get_connection(db) is conn
+
+
+def test_read_only_connection(tmp_path):
+    db = str(tmp_path / 'a.db')
+    # (No database yet: a regular connection, which makes it)
+    reader = get_connection(db, readonly=True)
+    reader.execute('CREATE TABLE t (x)')
+    reader.commit()
+    close_connections(db)
+
+    reader = get_connection(db, readonly=True)
+    assert reader.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    with pytest.raises(sqlite3.OperationalError):
+        reader.execute('INSERT INTO t VALUES (1)')
+
+
+def test_close_connections(tmp_path):
+    a = get_connection(str(tmp_path / 'a.db'))
+    a_reader = get_connection(str(tmp_path / 'a.db'), readonly=True)
+    b = get_connection(str(tmp_path / 'b.db'))
+    close_connections(str(tmp_path / 'a.db'))
+    for conn in [a, a_reader]:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute('SELECT 1')
+    assert b.execute('SELECT 1').fetchone()[0] == 1 and get_connection(str(tmp_path / 'b.db')) is b
+
+    close_connections()
+    with pytest.raises(sqlite3.ProgrammingError):
+        b.execute('SELECT 1')
+    assert db_connections._connections == {}
+
+
+def test_read_snapshot(tmp_path):
+    db = str(tmp_path / 'a.db')
+    writer = get_connection(db)
+    writer.execute('PRAGMA journal_mode=WAL')
+    writer.execute('CREATE TABLE t (x)')
+    writer.execute('INSERT INTO t VALUES (1)')
+    writer.commit()
+
+    with read_snapshot(db) as reader:
+        assert reader is get_connection(db, readonly=True)
+        assert reader.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 1
+        # (The writer isn't held up, and what it writes isn't seen until the snapshot ends)
+        writer.execute('INSERT INTO t VALUES (2)')
+        writer.commit()
+        with read_snapshot(db) as inner:
+            assert inner is reader
+            assert inner.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 1
+        assert reader.in_transaction
+        assert reader.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 1
+    assert not reader.in_transaction
+    assert reader.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 2
+
+    # Nor is a reader held up by a write in progress (it sees the database as of the last commit)
+    writer.execute('PRAGMA busy_timeout=0')
+    writer.execute('INSERT INTO t VALUES (3)')
+    with read_snapshot(db) as reader:
+        assert reader.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 2
+    writer.commit()
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+def test_workers_get_their_own_connections(tmp_path):
+    db = str(tmp_path / 'a.db')
+    get_connection(db)
+    with multiprocessing.get_context('fork').Pool(1) as pool:
+        assert pool.apply(parents_connection_reused, (db,)) is False
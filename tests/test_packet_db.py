@@ -0,0 +1,520 @@
+import os
+import stat
+import sqlite3
+import datetime
+
+import numpy as np
+import pytest
+
+import db_handlers
+import migrate_packet_db
+import reference
+from data_handlers import iter_packets_TLM
+from db_handlers import connect_packet_db, write_to_db, write_stream_to_db, get_packets_within_range
+from db_handlers import iter_packets_within_range, get_packet_arrays, iter_packets_in_windows
+from db_handlers import get_segments, compact_segments, segment_root
+from db_handlers import checkpoint_packet_db, get_schema_version, PACKET_DB_VERSION
+from db_connections import read_snapshot
+from packet_identity import PACKET_TIME_TOLERANCE
+from change_feed import get_dirty_buckets, acknowledge_changes, bucket_spans, processed_until, BUCKET_SECONDS
+from change_feed import PROCESSING_STAGES
+from shard_store import get_shards, seal_shards, commit_packet_db, rollback_packet_db, shard_periods
+from packet_archive import archive_packets, vacuum_packet_db, get_archives
+from packet_schema import sql_create_packets_table
+from packet_table import PacketTable
+from synthetic import make_tlm
+
+# (On the hour)
+T0 = 1.5e9 - 1.5e9 % 3600
+
+
+def packet(i, t, fname='a.TLM', dtype='S', data=None):
+    return dict(data=[i % 256, 1, 2] if data is None else data, start_ind=i, dtype=dtype, exp_num=i % 256,
+                bytecount=3 if data is None else len(data), checksum_verify=True, packet_length=512, fname=fname,
+                header_ns=0, header_epoch_sec=0, header_reboots=1, header_timestamp=t)
+
+
+def utc(t):
+    return datetime.datetime.fromtimestamp(t, tz=datetime.timezone.utc)
+
+
+def count(conn, table='packets'):
+    return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def hash_index_is_unique(conn):
+    return bool([r for r in conn.execute('PRAGMA index_list(packets)') if r[1] == 'packets_hash'][0][2])
+
+
+@pytest.fixture(scope='module')
+def tlm_file(tmp_path_factory):
+    root = tmp_path_factory.mktemp('tlm')
+    make_tlm(str(root / 'synthetic.TLM'), 300)
+    return str(root), 'synthetic.TLM'
+
+
+def test_write_stream_to_db(tmp_path, tlm_file):
+    db = str(tmp_path / 'packets.db')
+    conn = connect_packet_db(db)
+    assert write_stream_to_db(conn, iter_packets_TLM(*tlm_file, batch_size=16)) == 296
+    conn.commit()
+
+    expected = sorted(reference.decode_packets_TLM(*tlm_file), key=lambda p: p['header_timestamp'])
+    reference.same_packets(expected, get_packets_within_range(db, columns=list(expected[0])))
+
+
+@pytest.mark.parametrize('as_table', [False, True])
+def test_write_to_db(tmp_path, as_table):
+    conn = connect_packet_db(str(tmp_path / 'packets.db'))
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    rng = np.random.default_rng(2)
+    packets = [packet(i, T0 + i, data=rng.integers(0, 256, int(rng.integers(1, 505))).tolist()) for i in range(500)]
+    # (CSV packets have a file_index, and no CCSDS header fields)
+    for p in packets[::3]:
+        del p['header_ns'], p['header_epoch_sec'], p['header_reboots']
+        p['file_index'] = p['start_ind']
+    assert write_to_db(conn, PacketTable.from_packets(packets) if as_table else packets) == 500
+    assert write_to_db(conn, []) == 0
+    conn.commit()
+
+    names = ['data', 'start_ind', 'header_ns', 'file_index', 'header_timestamp', 'dtype', 'added']
+    rows = conn.execute(f"SELECT {', '.join(names)} FROM packets ORDER BY header_timestamp").fetchall()
+    assert len(rows) == 500
+    for p, row in zip(packets, rows):
+        r = dict(zip(names, row))
+        assert np.array_equal(np.frombuffer(r['data'], dtype=np.uint8), p['data'])
+        assert (r['start_ind'], r['header_ns'], r['file_index']) == (p['start_ind'], p.get('header_ns'), p.get('file_index'))
+        assert (r['header_timestamp'], r['dtype']) == (p['header_timestamp'], 'S') and r['added'] > T0
+
+
+def test_new_database_is_current(tmp_path):
+    conn = connect_packet_db(str(tmp_path / 'packets.db'))
+    assert get_schema_version(conn) == PACKET_DB_VERSION
+    indexes = {r[1] for r in conn.execute('PRAGMA index_list(packets)')}
+    assert {'packets_dtype_time', 'packets_time', 'packets_added', 'packets_hash'} <= indexes
+    assert hash_index_is_unique(conn)
+    for table in ['files', 'changes', 'stage_cursors', 'shards', 'segments', 'archives', 'archived_hashes']:
+        assert count(conn, table) == 0
+    assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    ''' A packet database from before schema versions (just the packets table, with hashes
+        which changed from run to run), with the same packets in from two files '''
+    db = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(db)
+    conn.execute(sql_create_packets_table)
+    rows = [packet(i, T0 + 10*i) for i in range(20)]
+    # (The same packets, from a .CSV file, with a slightly different timestamp...)
+    rows += [packet(i, T0 + 10*i + 3, fname='b.csv') for i in range(5)]
+    # (... and the same fields and data again, an hour later)
+    rows += [packet(0, T0 + 3600)]
+    conn.executemany('''INSERT INTO packets (data, start_ind, dtype, exp_num, bytecount, checksum_verify, packet_length,
+                        fname, header_timestamp, header_ns, header_epoch_sec, header_reboots, hash, added)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                     [(bytes(p['data']), p['start_ind'], p['dtype'], p['exp_num'], p['bytecount'], 1, 512, p['fname'],
+                       p['header_timestamp'], 0, 0, 1, k, 1e9 + k) for k, p in enumerate(rows)])
+    conn.commit()
+    conn.close()
+    return db
+
+
+def test_migrate_legacy_database(legacy_db):
+    assert migrate_packet_db.migrate(legacy_db) == PACKET_DB_VERSION
+
+    conn = connect_packet_db(legacy_db)
+    assert get_schema_version(conn) == PACKET_DB_VERSION
+    # (Nothing deleted -- and the duplicates leave the hash index non-unique -- and the
+    #  files registered from the packets table)
+    assert count(conn) == 26
+    assert not hash_index_is_unique(conn)
+    assert sorted(r[0] for r in conn.execute('SELECT fname FROM files')) == ['a.TLM', 'b.csv']
+    assert conn.execute('SELECT SUM(count) FROM changes').fetchone()[0] == 26
+    assert [r[0] for r in conn.execute('SELECT version FROM schema_version')] == list(range(1, PACKET_DB_VERSION + 1))
+
+    assert migrate_packet_db.migrate(legacy_db) == PACKET_DB_VERSION
+
+
+def test_remove_duplicates(legacy_db):
+    migrate_packet_db.migrate(legacy_db)
+    assert migrate_packet_db.deduplicate(legacy_db) == 5
+    conn = connect_packet_db(legacy_db)
+    assert count(conn) == 26
+
+    assert migrate_packet_db.deduplicate(legacy_db, delete=True) == 5
+    assert count(conn) == 21
+    assert hash_index_is_unique(conn)
+    assert 'b.csv' not in [r[0] for r in conn.execute('SELECT fname FROM packets')]
+    assert migrate_packet_db.deduplicate(legacy_db) == 0
+
+
+def test_packet_identity(tmp_path):
+    conn = connect_packet_db(str(tmp_path / 'packets.db'))
+    assert write_to_db(conn, [packet(i, T0 + 100*i) for i in range(50)]) == 50
+
+    # The same packets, from another file, with timestamps up to a minute off
+    offsets = [-59, -30, 0, 1, 30, 59]
+    copies = [packet(i, T0 + 100*i + offsets[i % len(offsets)], fname='b.csv') for i in range(50)]
+    assert write_to_db(conn, copies) == 0
+    # ... or twice in one batch
+    assert write_to_db(conn, [packet(100, T0 + 7), packet(100, T0 + 8, fname='b.csv')]) == 1
+
+    # The same fields and data, some time later, are a different packet
+    assert write_to_db(conn, [packet(i, T0 + 100*i + 180) for i in range(50)]) == 50
+    assert write_to_db(conn, [packet(i, T0 + 100*i + 3600) for i in range(50)]) == 50
+    conn.commit()
+    assert len(get_packets_within_range(conn)) == 151
+
+
+@pytest.mark.parametrize('apart', [-59, 1, 59, 90, -90, 150, 180, 400])
+def test_packet_identity_window_alignment(tmp_path, apart):
+    # A packet at each second of a time window (T0 is at the start of one), and then a copy
+    # of each, apart seconds later: which copies are taken for the packet already stored?
+    width = 2*PACKET_TIME_TOLERANCE
+    assert T0 % width == 0
+    conn = connect_packet_db(str(tmp_path / 'packets.db'))
+    write_to_db(conn, [packet(k, T0 + k) for k in range(width)])
+    write_to_db(conn, [packet(k, T0 + k + apart, fname='b.csv') for k in range(width)])
+    kept = {r[0] for r in conn.execute("SELECT start_ind FROM packets WHERE fname = 'b.csv'")}
+
+    if abs(apart) < PACKET_TIME_TOLERANCE:
+        assert kept == set()
+    elif abs(apart) >= 3*PACKET_TIME_TOLERANCE:
+        assert kept == set(range(width))
+    elif apart == 90:
+        # (The first copy is looked up only if it's in the first 90 s of its window)
+        assert kept == set(range(90, width))
+    elif apart == -90:
+        assert kept == set(range(0, 30))
+    else:
+        assert 0 < len(kept) < width
+
+
+@pytest.fixture
+def mixed_db(tmp_path):
+    ''' A database of 1000 packets of every type, with data segments of every length '''
+    db = str(tmp_path / 'packets.db')
+    conn = connect_packet_db(db)
+    rng = np.random.default_rng(8)
+    packets = [packet(i, T0 + i, dtype='SEBGI'[i % 5], data=rng.integers(0, 256, 1 + i % 504).tolist())
+               for i in range(1000)]
+    write_to_db(conn, packets)
+    conn.commit()
+    return db, packets
+
+
+def test_get_packets_within_range(mixed_db):
+    db, packets = mixed_db
+    P = get_packets_within_range(db, dtype=['E', 'B'], t1=utc(T0 + 100), t2=utc(T0 + 200))
+    expected = [p for p in packets if p['dtype'] in 'EB' and T0 + 100 < p['header_timestamp'] < T0 + 200]
+    assert len(P) == 40
+    reference.same_packets(expected, [{k: p[k] for k in expected[0]} for p in P])
+    assert len(get_packets_within_range(db, date_added=utc(2e9))) == 0
+
+    # (Just some of the columns: no data segments at all, without 'data')
+    P = get_packets_within_range(db, dtype='S', columns=['header_timestamp', 'exp_num'])
+    assert sorted(P.columns) == ['exp_num', 'header_timestamp'] and P.payload.size == 0 and len(P) == 200
+    assert np.array_equal(P['header_timestamp'], [p['header_timestamp'] for p in packets if p['dtype'] == 'S'])
+    with pytest.raises(ValueError):
+        get_packets_within_range(db, columns=['header_timestamp', 'nonsense'])
+
+
+@pytest.mark.parametrize('batch_size', [1, 7, 1000, 5000])
+def test_iter_packets_within_range(mixed_db, batch_size):
+    db, packets = mixed_db
+    batches = list(iter_packets_within_range(db, dtype=['S', 'G'], t1=utc(T0 + 10), batch_size=batch_size))
+    assert all(len(b) == batch_size for b in batches[:-1]) and 0 < len(batches[-1]) <= batch_size
+    expected = get_packets_within_range(db, dtype=['S', 'G'], t1=utc(T0 + 10))
+    assert len(expected) == 395
+    reference.same_packets(list(expected), PacketTable.concatenate(batches))
+
+
+def test_get_packet_arrays(mixed_db):
+    db, packets = mixed_db
+    arrays = get_packet_arrays(db, ['data', 'header_timestamp', 'bytecount'], dtype='B')
+    expected = [p for p in packets if p['dtype'] == 'B']
+    assert sorted(arrays) == ['bytecount', 'data', 'header_timestamp', 'lengths']
+    assert arrays['data'].shape == (200, 503) and arrays['data'].dtype == np.uint8
+    for row, n, p in zip(arrays['data'], arrays['lengths'], expected):
+        assert n == len(p['data']) and np.array_equal(row[:n], p['data']) and not np.any(row[n:])
+    assert np.array_equal(arrays['header_timestamp'], [p['header_timestamp'] for p in expected])
+
+    # (Cut short, or padded out to a given width)
+    assert get_packet_arrays(db, ['data'], dtype='B', payload_width=600)['data'].shape == (200, 600)
+    arrays = get_packet_arrays(db, ['data'], dtype='B', payload_width=10)
+    assert np.array_equal(arrays['data'], [p['data'][:10] + [0]*(10 - len(p['data'][:10])) for p in expected])
+    assert 'lengths' not in get_packet_arrays(db, ['dtype'])
+
+
+def test_change_feed(tmp_path):
+    db = str(tmp_path / 'packets.db')
+    conn = connect_packet_db(db)
+    assert T0 % BUCKET_SECONDS == 0
+    packets = [packet(i, T0 + 60*i, dtype='SB'[i % 2]) for i in range(180)]
+    write_to_db(conn, packets)
+    conn.commit()
+
+    buckets, seq = get_dirty_buckets(db, 'process_survey_data', dtypes=['S'])
+    assert buckets == [T0, T0 + BUCKET_SECONDS, T0 + 2*BUCKET_SECONDS]
+    acknowledge_changes(db, 'process_survey_data', seq)
+    assert get_dirty_buckets(db, 'process_survey_data', dtypes=['S'])[0] == []
+
+    # (Packets we already had don't count as changes)
+    write_to_db(conn, packets)
+    write_to_db(conn, [packet(i, T0 + 5*BUCKET_SECONDS + i, dtype='B') for i in range(3)])
+    conn.commit()
+    assert get_dirty_buckets(db, 'process_survey_data', dtypes=['S'])[0] == []
+    assert get_dirty_buckets(db, 'process_survey_data')[0] == [T0 + 5*BUCKET_SECONDS]
+    # (A stage without a cursor sees everything -- or everything since it last ran)
+    assert len(get_dirty_buckets(db, 'process_burst_data', dtypes=['B'])[0]) == 4
+    assert get_dirty_buckets(db, 'process_burst_data', since=2e9)[0] == []
+
+
+def test_bucket_spans():
+    assert bucket_spans([]) == []
+    B = BUCKET_SECONDS
+    assert bucket_spans([T0 + 3*B, T0, T0 + B]) == [(T0, T0 + 2*B), (T0 + 3*B, T0 + 4*B)]
+    assert bucket_spans([T0, T0 + 2*B], margin=B/2) == [(T0 - B/2, T0 + 3.5*B)]
+
+
+@pytest.mark.parametrize('order', [1, -1])
+def test_iter_packets_in_windows(mixed_db, monkeypatch, order):
+    db, packets = mixed_db
+    # (Overlapping, nested, touching, apart, empty, and past the end)
+    windows = [(T0 + 10, T0 + 50), (T0 + 40, T0 + 80), (T0 + 45, T0 + 46), (T0 + 80, T0 + 90),
+               (T0 + 300, T0 + 400), (T0 + 500.5, T0 + 500.7), (T0 + 990, T0 + 2000)][::order]
+    queries = []
+    def counting(*args, **kwargs):
+        queries.append(kwargs)
+        return get_packets_within_range(*args, **kwargs)
+    monkeypatch.setattr(db_handlers, 'get_packets_within_range', counting)
+
+    found = list(iter_packets_in_windows(db, windows, dtype=['E', 'B', 'G']))
+    assert len(found) == len(windows)
+    for (t1, t2), P in zip(windows, found):
+        expected = get_packets_within_range(db, dtype=['E', 'B', 'G'], t1=utc(t1), t2=utc(t2))
+        assert P['start_ind'].tolist() == expected['start_ind'].tolist()
+        assert len(P) == len([p for p in packets if p['dtype'] in 'EBG' and t1 < p['header_timestamp'] < t2])
+    # (One range scan per separate stretch of time)
+    assert len(queries) == 4
+
+    found = list(iter_packets_in_windows(db, windows, columns=['exp_num']))
+    assert [len(P) for P in found] == [len(get_packets_within_range(db, t1=utc(t1), t2=utc(t2))) for t1, t2 in windows]
+    assert found[0].payload.size == 0
+
+
+# (More periods than SQLite can attach to one connection)
+@pytest.mark.parametrize('months', [12, 24])
+def test_batch_spanning_many_shards(tmp_path, months):
+    db = str(tmp_path / 'packets.db')
+    conn = connect_packet_db(db)
+    packets = PacketTable.from_packets([packet(i, T0 + (i % months)*31*86400. + i) for i in range(20*months)])
+    assert write_to_db(conn, packets, shard_period='month') == len(packets)
+    # (Nothing's committed until the caller commits)
+    assert len(get_packets_within_range(db)) == 0
+    commit_packet_db(conn)
+    assert write_to_db(conn, packets, shard_period='month') == 0
+    commit_packet_db(conn)
+
+    shards = get_shards(db)
+    assert len(shards) == months
+    assert sum(s['packet_count'] for s in shards) == len(packets)
+    assert sum(count(sqlite3.connect(s['path'])) for s in shards) == len(packets)
+    assert count(conn) == 0
+    assert len(get_packets_within_range(db)) == len(packets)
+    assert conn.execute('SELECT SUM(count) FROM changes').fetchone()[0] == len(packets)
+
+
+def test_failed_file_leaves_no_shard_packets(tmp_path):
+    db = str(tmp_path / 'packets.db')
+    conn = connect_packet_db(db)
+    packets = PacketTable.from_packets([packet(i, T0 + (i % 24)*31*86400. + i) for i in range(480)])
+    write_to_db(conn, packets[:100], shard_period='month')
+    commit_packet_db(conn)
+
+    # (A file which fails partway through: all of it is rolled back, from every shard)
+    assert write_to_db(conn, packets[100:], shard_period='month') == 380
+    rollback_packet_db(conn)
+    assert len(get_packets_within_range(db)) == 100
+    assert conn.execute('SELECT SUM(count) FROM changes').fetchone()[0] == 100
+    assert sum(s['packet_count'] for s in get_shards(db)) == 100
+
+    # ... and goes in whole when it's read again
+    assert write_to_db(conn, packets, shard_period='month') == 380
+    commit_packet_db(conn)
+    assert len(get_packets_within_range(db)) == 480
+
+
+def test_seal_shards(tmp_path):
+    db = str(tmp_path / 'packets.db')
+    conn = connect_packet_db(db)
+    packets = [packet(i, T0 + (i % 3)*31*86400. + i) for i in range(300)]
+    write_to_db(conn, packets[:200], shard_period='month')
+    commit_packet_db(conn)
+
+    assert len(seal_shards(conn)) == 3
+    assert seal_shards(conn) == []
+    for s in get_shards(db):
+        assert s['sealed'] and not os.path.exists(s['path'] + '-wal')
+        assert not stat.S_IMODE(os.stat(s['path']).st_mode) & stat.S_IWUSR
+        assert sqlite3.connect(s['path']).execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+
+    # Late packets for sealed periods go to the current period's shard -- less any we already have
+    assert write_to_db(conn, packets, shard_period='month') == 100
+    commit_packet_db(conn)
+    current = shard_periods([datetime.datetime.now().timestamp()], 'month')[0][0]
+    shards = {s['name']: s for s in get_shards(db)}
+    assert len(shards) == 4 and shards[current]['packet_count'] == 100 and not shards[current]['sealed']
+    assert len(get_packets_within_range(db)) == 300
+
+
+def test_segments(tmp_path):
+    db = str(tmp_path / 'packets.db')
+    conn = connect_packet_db(db)
+    packets = [packet(i, T0 + i, dtype='SB'[i % 2]) for i in range(300)]
+    write_to_db(conn, packets[:100])
+    # (One segment per batch)
+    assert write_stream_to_db(conn, [packets[100:200], packets[200:]], store='segments') == 200
+    conn.commit()
+    assert len(get_segments(db)) == 2 and count(conn) == 100
+
+    # (Packets we have already, in a segment or the database, are skipped)
+    assert write_to_db(conn, packets, store='segments') == 0
+
+    # The stores read back as one, in time order -- with the columns neither stores as missing values
+    P = get_packets_within_range(db, dtype='B', t1=utc(T0 + 50), t2=utc(T0 + 250))
+    assert P['start_ind'].tolist() == list(range(51, 250, 2))
+    assert all(x is None for x in P['file_index'])
+    assert np.array_equal(P['header_timestamp'], T0 + np.arange(51, 250, 2))
+    assert [len(b) for b in iter_packets_within_range(db, batch_size=60)] == [60, 40]*3
+    assert conn.execute('SELECT SUM(count) FROM changes').fetchone()[0] == 300
+
+
+def test_compact_segments_leaves_recent_files(tmp_path):
+    db = str(tmp_path / 'packets.db')
+    conn = connect_packet_db(db)
+    for k in range(3):
+        write_to_db(conn, [packet(i, T0 + i + 1e4*k, data=[i % 256, k]) for i in range(100)], store='segments')
+        conn.commit()
+    # (A segment which hasn't been committed yet, and one still being written)
+    write_to_db(conn, [packet(i, T0 + i + 1e5, data=[i % 256, 9]) for i in range(100)], store='segments')
+    conn.rollback()
+    root = segment_root(conn)
+    os.makedirs(os.path.join(root, '.in_progress.tmp'))
+    files = sorted(os.listdir(root))
+    assert len(files) == 5
+
+    assert compact_segments(conn) == 3
+    remaining = os.listdir(root)
+    assert set(files) < set(remaining) and len(remaining) == 6
+    assert len(get_packets_within_range(db)) == 300
+
+    # (Old enough, the left-over segments go -- but not the one being written)
+    for f in remaining:
+        os.utime(os.path.join(root, f), (1e9, 1e9))
+    compact_segments(conn)
+    assert len(os.listdir(root)) == 2
+    assert '.in_progress.tmp' in os.listdir(root)
+    P = get_packets_within_range(db)
+    assert len(P) == 300
+    assert np.all(P['header_ns'] == 0)
+
+
+def test_checkpoint_packet_db(tmp_path):
+    db = str(tmp_path / 'packets.db')
+    conn = connect_packet_db(db)
+    packets = [packet(i, T0 + (i % 2)*31*86400. + i) for i in range(200)]
+    write_to_db(conn, packets[:100], shard_period='month')
+    commit_packet_db(conn)
+    paths = [db] + [s['path'] for s in get_shards(db)]
+    assert len(paths) == 3 and all(os.path.getsize(p + '-wal') > 0 for p in paths)
+
+    # (Commits anything outstanding, first)
+    write_to_db(conn, packets, shard_period='month')
+    assert checkpoint_packet_db(conn)
+    assert all(os.path.getsize(p + '-wal') == 0 for p in paths)
+    assert len(get_packets_within_range(db)) == 200
+
+    # A reader in the middle of a snapshot keeps (part of) the log; we don't wait for it
+    with read_snapshot(db):
+        write_to_db(conn, [packet(i, T0 + 1e4 + i) for i in range(100)])
+        conn.commit()
+        assert not checkpoint_packet_db(conn)
+        assert len(get_packets_within_range(db)) == 200
+    assert os.path.getsize(db + '-wal') > 0
+    assert len(get_packets_within_range(db)) == 300
+    assert checkpoint_packet_db(conn)
+    assert os.path.getsize(db + '-wal') == 0
+
+
+def test_migration_enables_incremental_vacuum(legacy_db):
+    assert sqlite3.connect(legacy_db).execute('PRAGMA auto_vacuum').fetchone()[0] == 0
+    migrate_packet_db.migrate(legacy_db)
+    conn = connect_packet_db(legacy_db)
+    assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    assert count(conn) == 26
+
+
+def test_archive_waits_for_every_stage(tmp_path):
+    db = str(tmp_path / 'packets.db')
+    conn = connect_packet_db(db)
+    write_to_db(conn, [packet(i, T0 + BUCKET_SECONDS*i) for i in range(100)])
+    conn.commit()
+
+    assert processed_until(conn) is None
+    assert archive_packets(conn, 2e9) == 0
+    for stage in PROCESSING_STAGES[:-1]:
+        acknowledge_changes(db, stage, get_dirty_buckets(db, stage)[1])
+        assert processed_until(conn) is None
+        assert archive_packets(conn, 2e9) == 0
+    assert count(conn) == 100
+
+    acknowledge_changes(db, PROCESSING_STAGES[-1], get_dirty_buckets(db, PROCESSING_STAGES[-1])[1])
+    assert processed_until(conn) is not None
+    assert archive_packets(conn, 2e9) == 100
+    assert count(conn) == 0
+    assert len(get_packets_within_range(db)) == 100
+
+
+# (Shard periods: July, August and September 2017. Sealed, the August and September shards
+#  aren't over by the cutoff (August 23rd), so only July's is archived -- whole)
+@pytest.mark.parametrize('sealed', [False, True])
+def test_archive_packets(tmp_path, sealed):
+    db = str(tmp_path / 'packets.db')
+    conn = connect_packet_db(db)
+    main = [packet(i, T0 + 3600*i, data=[i % 256] * 400) for i in range(100)]
+    sharded = [packet(i + 1000, T0 + (i % 3)*31*86400. + i) for i in range(300)]
+    write_to_db(conn, main)
+    write_to_db(conn, sharded, shard_period='month')
+    commit_packet_db(conn)
+    if sealed:
+        assert len(seal_shards(conn)) == 3
+    shard_paths = [s['path'] for s in get_shards(db)]
+    expected = get_packets_within_range(db)
+    assert len(expected) == 400
+
+    assert archive_packets(conn, T0 + 40*86400, processed_only=False) == (200 if sealed else 300)
+    assert count(conn) == 0
+    archives = get_archives(db)
+    assert [a['name'] for a in archives] == (['2017-07', '2017-07_1'] if sealed else ['2017-07', '2017-07_1', '2017-08'])
+    assert sum(a['packet_count'] for a in archives) == count(conn, 'archived_hashes') == (200 if sealed else 300)
+    shards = get_shards(db)
+    if sealed:
+        assert len(shards) == 2 and not os.path.exists(shard_paths[0])
+    else:
+        assert [s['packet_count'] for s in shards] == [0, 0, 100]
+        assert [count(sqlite3.connect(p)) for p in shard_paths] == [0, 0, 100]
+
+    # The packets read back the same (from the archive, for the times it covers) ...
+    reference.same_packets(expected.to_packets(), get_packets_within_range(db))
+    # ... and aren't taken in again
+    assert write_to_db(conn, main) == 0
+    assert write_to_db(conn, sharded, shard_period='month') == 0
+    commit_packet_db(conn)
+    assert archive_packets(conn, T0 + 40*86400, processed_only=False) == 0
+
+    # (The space the packets took up goes back to the file system)
+    assert conn.execute('PRAGMA freelist_count').fetchone()[0] > 0
+    vacuum_packet_db(conn)
+    assert conn.execute('PRAGMA freelist_count').fetchone()[0] == 0
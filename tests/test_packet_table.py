@@ -0,0 +1,73 @@
+import numpy as np
+
+from packet_table import PacketTable, rebatch
+
+
+def packets(n, rng, csv=False):
+    ''' Packet dictionaries, like the TLM decoder's (or the CSV decoder's: file_index, and no CCSDS header fields) '''
+    out = []
+    for i in range(n):
+        p = dict(data=rng.integers(0, 256, int(rng.integers(0, 505))).tolist(), start_ind=int(rng.integers(0, 10**5)),
+                 dtype='SEBGI'[i % 5], exp_num=i % 256, checksum_verify=True, packet_length=512,
+                 fname='b.csv' if csv else 'a.TLM', header_timestamp=1.5e9 + rng.uniform(0, 1e4))
+        p['bytecount'] = len(p['data'])
+        if csv:
+            p['file_index'] = i
+        else:
+            p.update(header_ns=int(rng.integers(0, 10**9)), header_epoch_sec=i, header_reboots=3)
+        out.append(p)
+    return out
+
+
+def test_round_trip():
+    rng = np.random.default_rng(4)
+    expected = packets(300, rng) + packets(200, rng, csv=True)
+    table = PacketTable.from_packets(expected)
+    assert len(table) == 500 and table.payload.dtype == np.uint8
+    assert table['header_timestamp'].dtype == np.float64 and table['dtype'].dtype == 'U1'
+
+    # (Columns some packets don't have are filled in with None)
+    for p, q in zip(expected, table.to_packets()):
+        assert q == {k: p.get(k) for k in q}
+        assert set(q) - set(p) <= {'file_index', 'header_ns', 'header_epoch_sec', 'header_reboots'}
+    assert table[-1]['file_index'] == 199 and table[0]['file_index'] is None
+    assert PacketTable.from_packets(table) is table
+
+
+def test_selection():
+    rng = np.random.default_rng(5)
+    expected = packets(400, rng)
+    table = PacketTable.from_packets(expected)
+
+    assert table[10:20].to_packets() == expected[10:20]
+    S = table.where(dtype='S')
+    assert S.to_packets() == [p for p in expected if p['dtype'] == 'S']
+    EB = table.where(dtype=['E', 'B'], exp_num=6)
+    assert EB.to_packets() == [p for p in expected if p['dtype'] in 'EB' and p['exp_num'] == 6]
+    by_time = table.sort()
+    assert by_time.to_packets() == sorted(expected, key=lambda p: p['header_timestamp'])
+
+    matrix, lengths = by_time.payload_matrix(width=504, fill=255)
+    for row, n, p in zip(matrix, lengths, by_time):
+        assert np.array_equal(row[:n], p['data']) and np.all(row[n:] == 255)
+
+
+def test_concatenate():
+    rng = np.random.default_rng(6)
+    parts = [packets(n, rng, csv=(n % 2 == 1)) for n in [0, 7, 100, 1, 0, 30]]
+    table = PacketTable.concatenate([PacketTable.from_packets(p) if k % 2 else p for k, p in enumerate(parts)])
+    assert len(PacketTable.concatenate([])) == 0
+    assert table.to_packets() == [{k: p.get(k) for k in table.keys()} for part in parts for p in part]
+    assert (table[:50] + table[50:]).to_packets() == table.to_packets()
+
+
+def test_rebatch():
+    rng = np.random.default_rng(7)
+    parts = [packets(n, rng) for n in [0, 7, 100, 1, 0, 30, 64]]
+    expected = [p for part in parts for p in part]
+    for batch_size in [1, 8, 64, 1000]:
+        batches = list(rebatch(parts, batch_size))
+        assert [len(b) for b in batches] == [batch_size]*(len(expected)//batch_size) + \
+                                           ([len(expected) % batch_size] if len(expected) % batch_size else [])
+        assert PacketTable.concatenate(batches).to_packets() == expected
+    assert list(rebatch([], 10)) == []
@@ -0,0 +1,121 @@
+import os
+import tempfile
+
+import pytest
+
+import reference
+from data_handlers import new_ingest_state
+from db_handlers import connect_packet_db, write_stream_to_db, get_file_registry, write_file_record, get_files_covering
+from packet_table import PacketTable
+from process_packets import iter_decoded_files, find_telemetry_files
+from synthetic import make_tlm, make_csv
+
+
+@pytest.fixture
+def telemetry(tmp_path):
+    ''' A directory of telemetry files, and the packets the reference decoders get from each '''
+    root = str(tmp_path / 'telemetry')
+    os.makedirs(root)
+    for k in range(4):
+        make_tlm(os.path.join(root, f'file_{k}.tlm'), 50 + 40*k, seed=k)
+        make_csv(os.path.join(root, f'file_{k}.csv'), 60 + 30*k, seed=k)
+    expected = {fname: (reference.decode_packets_TLM if fname.endswith('.tlm') else reference.decode_packets_CSV)(root, fname)
+                for fname in os.listdir(root)}
+    return root, expected
+
+
+@pytest.mark.parametrize('num_workers', [1, 3])
+def test_iter_decoded_files(telemetry, tmp_path, monkeypatch, num_workers):
+    root, expected = telemetry
+    # (Somewhere to see the workers' temporary files)
+    spill = tmp_path / 'spill'
+    os.makedirs(spill)
+    monkeypatch.setattr(tempfile, 'tempdir', str(spill))
+
+    tasks = [(root, fname, new_ingest_state(os.path.join(root, fname))) for fname in sorted(os.listdir(root))]
+    if num_workers > 1:
+        # (A file which is gone by the time it's decoded is left out)
+        tasks.append((root, 'missing.csv', new_ingest_state(os.path.join(root, 'missing.csv'))))
+    decoded = dict()
+    for fname, batches, state in iter_decoded_files(tasks, num_workers, batch_size=16):
+        batches = list(batches)
+        assert all(len(b) <= 16 for b in batches)
+        decoded[fname] = PacketTable.concatenate(batches)
+        assert state['packet_count'] == len(decoded[fname]) and state['byte_offset'] > 0
+
+    # (The spill files are gone once their batches have been read)
+    assert os.listdir(spill) == []
+    assert sorted(decoded) == sorted(expected)
+    for fname in expected:
+        reference.same_packets(expected[fname], decoded[fname])
+
+
+def ingest(conn, tasks):
+    ''' Read the files, as process_packets does: each file's packets and registry entry in one transaction '''
+    num_written = 0
+    for fname, batches, state in iter_decoded_files(tasks):
+        num_written += write_stream_to_db(conn, batches)
+        write_file_record(conn, fname, state)
+        conn.commit()
+    return num_written
+
+
+def test_find_telemetry_files(telemetry, tmp_path):
+    root, expected = telemetry
+    conn = connect_packet_db(str(tmp_path / 'packets.db'))
+    with open(os.path.join(root, 'notes.txt'), 'w') as f:
+        f.write('not telemetry')
+
+    tasks = find_telemetry_files([root], get_file_registry(conn))
+    assert sorted(t[1] for t in tasks) == sorted(expected)
+    assert all(state['byte_offset'] == 0 for root, fname, state in tasks)
+    assert sorted(t[1] for t in find_telemetry_files([root], do_CSV=False)) == sorted(f for f in expected if f.endswith('.tlm'))
+    assert ingest(conn, tasks) == sum(len(p) for p in expected.values())
+
+    # (Nothing's changed)
+    registry = get_file_registry(conn)
+    assert sorted(r['fname'] for r in registry.values()) == sorted(expected)
+    assert find_telemetry_files([root], registry) == []
+
+    # A file which has grown is picked up where we left off; one which has been touched
+    # (but not changed) is looked at again, with nothing new in it
+    make_tlm(str(tmp_path / 'more.tlm'), 30, seed=10)
+    more = reference.decode_packets_TLM(str(tmp_path), 'more.tlm')
+    path = os.path.join(root, 'file_0.tlm')
+    with open(path, 'ab') as f:
+        with open(tmp_path / 'more.tlm', 'rb') as g:
+            f.write(g.read())
+    os.utime(os.path.join(root, 'file_1.csv'), (2e9, 2e9))
+    tasks = find_telemetry_files([root], registry)
+    assert sorted(t[1] for t in tasks) == ['file_0.tlm', 'file_1.csv']
+    assert dict((t[1], t[2]) for t in tasks)['file_0.tlm']['byte_offset'] == registry[path]['byte_offset'] > 0
+    assert ingest(conn, tasks) == len(more)
+    registry = get_file_registry(conn)
+    assert registry[path]['packet_count'] == len(expected['file_0.tlm']) + len(more)
+    assert find_telemetry_files([root], registry) == []
+
+    # Files which have been replaced (different contents, or shorter) are left alone
+    with open(os.path.join(root, 'file_2.csv'), 'r+b') as f:
+        f.write(b'X')
+    with open(os.path.join(root, 'file_1.tlm'), 'r+b') as f:
+        f.truncate(1000)
+    assert find_telemetry_files([root], registry) == []
+
+    # ... as are files registered by name only (from before the registry kept paths)
+    conn.execute("UPDATE files SET path = fname, size = NULL WHERE fname = 'file_0.csv'")
+    assert find_telemetry_files([root], get_file_registry(conn)) == []
+
+
+def test_get_files_covering(telemetry, tmp_path):
+    root, expected = telemetry
+    db = str(tmp_path / 'packets.db')
+    conn = connect_packet_db(db)
+    ingest(conn, find_telemetry_files([root]))
+
+    for fname, packets in expected.items():
+        t = sorted(p['header_timestamp'] for p in packets)
+        assert os.path.join(root, fname) in [r[0] for r in get_files_covering(db, t[len(t)//2])]
+        covering = get_files_covering(db, t[0], t[-1])
+        assert (os.path.join(root, fname), t[0], t[-1]) in covering
+        assert [r[1] for r in covering] == sorted(r[1] for r in covering)
+    assert get_files_covering(db, 0, 1) == []
@@ -0,0 +1,79 @@
+import os
+import stat
+
+import numpy as np
+import pytest
+
+from packet_table import PacketTable
+from segment_store import write_segment, read_segment, load_column, segment_columns, write_archive, read_archive
+
+
+@pytest.fixture
+def packets():
+    ''' TLM and CSV packets (so with gaps in the columns each doesn't have), one without a timestamp, shuffled '''
+    rng = np.random.default_rng(9)
+    P = []
+    for i in range(300):
+        p = dict(data=rng.integers(0, 256, int(rng.integers(0, 505))).tolist(), start_ind=i, dtype='SEBGI'[i % 5],
+                 exp_num=i % 256, bytecount=0, checksum_verify=True, packet_length=512, fname=f'f{i % 3}',
+                 header_timestamp=1.5e9 + i, added=1e9 + i)
+        if i % 4:
+            p.update(header_ns=i, header_epoch_sec=i, header_reboots=1)
+        else:
+            p['file_index'] = i
+        P.append(p)
+    P[7]['header_timestamp'] = None
+    return [P[k] for k in rng.permutation(len(P))]
+
+
+def as_expected(packets, keys):
+    ''' packets sorted by time (missing last), with just the keys given (None where they're missing) '''
+    packets = sorted(packets, key=lambda p: np.inf if p['header_timestamp'] is None else p['header_timestamp'])
+    return [{k: p.get(k) for k in keys} for p in packets]
+
+
+def test_round_trip(tmp_path, packets):
+    path = str(tmp_path / 'segment')
+    sorted_packets = write_segment(path, PacketTable.from_packets(packets))
+    assert not [f for f in os.listdir(tmp_path) if f.endswith('.tmp')]
+    assert 'header_ns' in segment_columns(path) and os.path.exists(os.path.join(path, 'header_ns.mask.npy'))
+
+    P = read_segment(path, None, None).to_packets()
+    # (The packet without a timestamp comes last, with NaN for its timestamp)
+    assert np.isnan(P[-1]['header_timestamp']) and P[-1]['start_ind'] == 7
+    assert P[:-1] == as_expected(packets, P[0].keys())[:-1] == sorted_packets.to_packets()[:-1]
+    assert load_column(path, 'file_index').tolist() == [p['file_index'] for p in as_expected(packets, ['file_index'])]
+
+
+def test_read_segment_selection(tmp_path, packets):
+    path = str(tmp_path / 'segment')
+    write_segment(path, PacketTable.from_packets(packets))
+
+    P = read_segment(path, 1.5e9 + 10, 1.5e9 + 200, dtypes=['S', 'B'], date_added=1e9 + 100)
+    expected = [p for p in packets if p['header_timestamp'] is not None and 1.5e9 + 10 < p['header_timestamp'] < 1.5e9 + 200
+                and p['dtype'] in 'SB' and p['added'] > 1e9 + 100]
+    assert len(P) == 39 and P.to_packets() == as_expected(expected, P.keys())
+
+    # (Just some columns -- or ones this segment doesn't store, which come back missing)
+    P = read_segment(path, 1.5e9 + 10, 1.5e9 + 1000, columns=['exp_num', 'hash'])
+    assert sorted(P.columns) == ['exp_num', 'hash'] and P.payload.size == 0 and len(P) == 289
+    assert all(h is None for h in P['hash'])
+    assert len(read_segment(path, 1.5e9 + 500, 1.5e9 + 1000)) == 0
+
+
+def test_archive_round_trip(tmp_path, packets):
+    path = str(tmp_path / 'archive.npz')
+    write_archive(path, PacketTable.from_packets(packets))
+    assert os.listdir(tmp_path) == ['archive.npz']
+    assert not stat.S_IMODE(os.stat(path).st_mode) & stat.S_IWUSR
+
+    # (Read back as from a segment)
+    P = read_archive(path, None, None).to_packets()
+    assert np.isnan(P[-1]['header_timestamp']) and P[-1]['start_ind'] == 7
+    assert P[:-1] == as_expected(packets, P[0].keys())[:-1]
+    segment = str(tmp_path / 'segment')
+    write_segment(segment, PacketTable.from_packets(packets))
+    assert read_archive(path, 1.5e9 + 10, 1.5e9 + 200, dtypes=['S', 'B'], date_added=1e9 + 100).to_packets() == \
+           read_segment(segment, 1.5e9 + 10, 1.5e9 + 200, dtypes=['S', 'B'], date_added=1e9 + 100).to_packets()
+    P = read_archive(path, 1.5e9 + 10, 1.5e9 + 1000, columns=['exp_num', 'hash'])
+    assert sorted(P.columns) == ['exp_num', 'hash'] and len(P) == 289
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+import reference
+from data_handlers import decode_GPS_data, decode_survey_GPS, decode_survey_data, BESTPOS_SYNC, BESTVEL_SYNC
+from packet_table import PacketTable
+from survey_frame import SurveyFrame, gps_columns
+from synthetic import gps_block, survey_packets
+
+
+def same_value(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    if isinstance(a, float) and np.isnan(a):
+        return isinstance(b, float) and np.isnan(b)
+    return a == b
+
+
+def same_columns(expected, columns):
+    assert sorted(columns) == sorted(expected)
+    for k in expected:
+        assert columns[k].dtype == expected[k].dtype, k
+        assert all(same_value(a, b) for a, b in zip(expected[k].tolist(), columns[k].tolist())), k
+
+
+@pytest.fixture(scope='module')
+def packets():
+    return survey_packets(1500)
+
+
+@pytest.mark.parametrize('as_table', [False, True])
+def test_decode_survey_data(packets, as_table):
+    expected, expected_unused = reference.decode_survey_data(packets)
+    S_data, unused = decode_survey_data(PacketTable.from_packets(packets) if as_table else packets)
+    assert isinstance(S_data, SurveyFrame)
+    assert len(S_data) == len(expected) > 1000
+
+    for d, S in zip(expected, S_data):
+        assert np.array_equal(S['E_data'], d['E_data']) and S['E_data'].dtype == np.uint8
+        assert np.array_equal(S['B_data'], d['B_data'])
+        assert S['header_timestamp'] == d['header_timestamp']
+        assert S['exp_num'] == d['exp_num']
+        G, expected_G = S.get('GPS', [{}])[0], (d['GPS'][0] if d['GPS'] else {})
+        assert sorted(G) == sorted(expected_G)
+        assert all(same_value(G[k], expected_G[k]) for k in G), (G, expected_G)
+    assert sum('GPS' in S for S in S_data) > len(S_data)//2
+
+    reference.same_packets(expected_unused, unused)
+
+
+def test_decode_survey_data_separation_time(packets):
+    expected, expected_unused = reference.decode_survey_data(packets, separation_time=0.05)
+    S_data, unused = decode_survey_data(packets, separation_time=0.05)
+    assert len(S_data) == len(expected)
+    assert len(unused) == len(expected_unused)
+
+
+def test_decode_survey_data_no_survey_packets():
+    S_data, unused = decode_survey_data([])
+    assert len(S_data) == 0 and len(unused) == 0
+
+
+def per_block(blocks):
+    ''' The GPS columns for survey GPS blocks, decoded one at a time with decode_GPS_data '''
+    GPS = []
+    for block in blocks:
+        try:
+            G = decode_GPS_data(block)
+        except Exception:
+            G = []
+        GPS.append(G[0] if G else dict())
+    return gps_columns(GPS)
+
+
+def malformed(blocks, rng):
+    blocks = blocks.copy()
+    for i in range(len(blocks)):
+        kind = i % 12
+        if kind == 0:
+            blocks[i, 140:145] = BESTPOS_SYNC
+        elif kind == 1:
+            blocks[i, 104] = 0
+        elif kind == 2:
+            blocks[i, 0] = 0
+        elif kind == 3:
+            blocks[i] = np.roll(blocks[i], 2)
+        elif kind == 4:
+            blocks[i] = rng.integers(0, 256, 180)
+        elif kind == 5:
+            blocks[i, 14] ^= 1
+        elif kind == 6:
+            blocks[i, 170:175] = BESTVEL_SYNC
+        elif kind == 7:
+            blocks[i] = 0
+        elif kind == 8:
+            blocks[i, 50:55] = BESTVEL_SYNC
+        elif kind == 9:
+            blocks[i, 104:] = 0
+            blocks[i, 176:180] = BESTVEL_SYNC[:4]
+    return blocks
+
+
+def test_decode_survey_GPS():
+    rng = np.random.default_rng(25)
+    blocks = np.array([gps_block(rng) for _ in range(240)])
+    same_columns(per_block(blocks), decode_survey_GPS(blocks))
+
+    bad = malformed(blocks, rng)
+    same_columns(per_block(bad), decode_survey_GPS(bad))
+    bad = bad[bad[:, 0] != 0xAA]
+    same_columns(per_block(bad), decode_survey_GPS(bad))
+
+    same_columns(per_block(blocks[:0]), decode_survey_GPS(blocks[:0]))
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import reference
+from survey_frame import SurveyFrame
+from synthetic import survey_packets
+
+
+@pytest.fixture(scope='module')
+def products():
+    ''' Survey product dictionaries, as decode_survey_data made them before SurveyFrame '''
+    return reference.decode_survey_data(survey_packets(200))[0]
+
+
+def same_products(expected, frame):
+    ''' Check frame (a SurveyFrame, or a list of survey products) against the product dictionaries
+        expected (products without GPS fields have no GPS key, rather than an empty list) '''
+    frame = list(frame)
+    assert len(frame) == len(expected)
+    for d, S in zip(expected, frame):
+        assert sorted(S) == sorted(k for k in d if k != 'GPS' or d['GPS'])
+        assert np.array_equal(S['E_data'], d['E_data']) and np.array_equal(S['B_data'], d['B_data'])
+        assert S['header_timestamp'] == d['header_timestamp'] and S['exp_num'] == d['exp_num']
+        assert S.get('GPS', []) == d['GPS']
+
+
+def test_round_trip(products):
+    frame = SurveyFrame.from_entries(products)
+    assert len(frame) == len(products) > 100
+    assert frame.E.shape == (len(products), 512) and frame.E.dtype == np.uint8
+    assert frame['header_timestamp'].dtype == np.float64
+    same_products(products, frame)
+    same_products(products, frame.to_entries())
+    same_products(products[-1:], [frame[-1]])
+    assert SurveyFrame.from_entries(frame) is frame
+
+    with pytest.raises(IndexError):
+        frame[len(frame)]
+    with pytest.raises(ValueError):
+        SurveyFrame(frame.E, frame.B[1:])
+    assert len(SurveyFrame()) == 0 and len(SurveyFrame.from_entries([])) == 0
+
+
+def test_selection(products):
+    frame = SurveyFrame.from_entries(products)
+    same_products(products[10:20], frame[10:20])
+    mask = frame['exp_num'] % 2 == 0
+    same_products([d for d, m in zip(products, mask) if m], frame[mask])
+    same_products(products[::-1], frame.sort(-frame['header_timestamp']))
+
+    # (GPS fields, with gaps where products haven't got them)
+    has_gps = frame.has_gps()
+    assert has_gps.tolist() == [bool(d['GPS']) for d in products]
+    lat = frame.gps('lat')
+    assert np.array_equal(np.isnan(lat), ~frame.has_gps('lat'))
+    assert lat[has_gps & ~np.isnan(lat)].tolist() == [d['GPS'][0]['lat'] for d in products if d['GPS'] and 'lat' in d['GPS'][0]]
+    assert np.all(np.isnan(frame.gps('no such field')))
+    t = frame.timestamps()
+    assert np.array_equal(t[~has_gps], frame['header_timestamp'][~has_gps])
+
+    t1, t2 = np.percentile(t, [25, 75])
+    same_products([d for d, s in zip(products, t) if t1 <= s < t2], frame.between(t1, t2))
+
+
+def test_concatenate(products):
+    frame = SurveyFrame.from_entries(products)
+    same_products(products, SurveyFrame.concatenate([frame[:50], products[50:100], frame[100:]]))
+    same_products(products + products[:10], frame + products[:10])
+    same_products(products[:10] + products, products[:10] + frame)
+    # (Without GPS, or any other columns, on one side: the gaps are filled in)
+    bare = SurveyFrame(frame.E[:5], frame.B[:5])
+    assert len(bare + frame) == len(frame) + 5 and not np.any((bare + frame).has_gps()[:5])
+
+    same_products(products, (frame + frame[::3]).unique())
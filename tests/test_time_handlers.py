@@ -0,0 +1,83 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from time_handlers import gps_to_unix, gps_week_to_unix, leap_seconds, unix_to_datetime, datetime_to_unix
+from time_handlers import iso_to_unix, day_buckets, LEAP_SECONDS, GPS_EPOCH, SECONDS_PER_WEEK
+
+UTC = datetime.timezone.utc
+
+
+def gps_seconds(d):
+    ''' Seconds since the GPS epoch at (naive UTC) datetime d, not counting leap seconds '''
+    return (d.replace(tzinfo=UTC) - GPS_EPOCH).total_seconds()
+
+
+def test_leap_second_table():
+    dates = [d for d, offset in LEAP_SECONDS]
+    assert dates == sorted(dates) and all(d.day == 1 and d.month in (1, 7) for d in dates)
+    assert [offset for d, offset in LEAP_SECONDS] == list(range(1, len(LEAP_SECONDS) + 1))
+    assert LEAP_SECONDS[-1] == (datetime.datetime(2017, 1, 1), 18)
+
+
+def test_gps_to_unix_known_times():
+    assert gps_to_unix(0) == datetime.datetime(1980, 1, 6, tzinfo=UTC).timestamp()
+    # (2020-01-01 00:00:00 UTC, with GPS 18 s ahead)
+    assert gps_to_unix(1261872018) == datetime.datetime(2020, 1, 1, tzinfo=UTC).timestamp()
+    assert gps_to_unix(1261872018, 250000000) == datetime.datetime(2020, 1, 1, 0, 0, 0, 250000, tzinfo=UTC).timestamp()
+    assert gps_week_to_unix(2086, 259218) == datetime.datetime(2020, 1, 1, tzinfo=UTC).timestamp()
+
+
+@pytest.mark.parametrize('d, offset', LEAP_SECONDS)
+def test_gps_to_unix_across_leap_seconds(d, offset):
+    # (The GPS second at which the new offset starts is midnight; the one before is the
+    #  inserted 23:59:60, which Unix time can't tell from midnight)
+    midnight = d.replace(tzinfo=UTC).timestamp()
+    s = gps_seconds(d) + offset
+    assert leap_seconds(s) == offset and leap_seconds(s - 1) == offset - 1
+    assert list(gps_to_unix([s - 2, s - 1, s, s + 1])) == [midnight - 1, midnight, midnight, midnight + 1]
+    week, seconds_of_week = divmod(s + 0.5, SECONDS_PER_WEEK)
+    assert gps_week_to_unix(week, seconds_of_week) == midnight + 0.5
+
+
+def test_gps_to_unix_matches_datetime():
+    # (Against the datetime arithmetic the decoders used to do, with the offset of the day)
+    rng = np.random.default_rng(0)
+    epoch_sec = rng.integers(0, 1.5e9, 2000)
+    ns = rng.integers(0, 10**9, 2000)
+    unix = gps_to_unix(epoch_sec, ns)
+    for s, n, t in zip(epoch_sec, ns, unix):
+        offset = int(leap_seconds(s))
+        expected = GPS_EPOCH - datetime.timedelta(seconds=offset) + datetime.timedelta(seconds=int(s) + int(n)*1e-9)
+        assert t == expected.timestamp()
+    week_unix = gps_week_to_unix(epoch_sec // SECONDS_PER_WEEK, epoch_sec % SECONDS_PER_WEEK + ns*1e-9)
+    assert np.allclose(week_unix, unix, rtol=0, atol=2e-6)
+
+
+def test_unix_to_datetime():
+    rng = np.random.default_rng(1)
+    t = np.concatenate([rng.uniform(0, 2e9, 1000), np.round(rng.uniform(0, 2e9, 100)*2e6)/2e6, [0., 1.5e9]])
+    dates = unix_to_datetime(t)
+    assert dates.dtype == object and dates.shape == t.shape
+    assert list(dates) == [datetime.datetime.fromtimestamp(x, tz=UTC).replace(tzinfo=None) for x in t]
+    assert unix_to_datetime(1.5e9) == datetime.datetime(2017, 7, 14, 2, 40)
+    assert np.allclose(datetime_to_unix(dates), t, rtol=0, atol=1e-6)
+
+
+def test_iso_to_unix():
+    times = ['2020-06-12T01:02:03', '2020-06-12T01:02:03.456', '2020-06-12T01:02:03.456789',
+             '2020-06-12 01:02:03.5', '2020-06-12T01:02', 'nonsense', '2020-02-30T00:00:00', '']
+    unix, valid = iso_to_unix(times)
+    assert list(valid) == [True]*5 + [False]*3
+    for t, u in zip(times[:5], unix):
+        assert u == datetime.datetime.fromisoformat(t).replace(tzinfo=UTC).timestamp()
+    assert np.all(np.isnan(unix[5:]))
+
+
+def test_day_buckets():
+    t = np.array([1.5e9, 1.5e9 + 86400, 1.5e9 + 10, 1.5e9 - 86400*3])
+    days, inverse = day_buckets(t)
+    assert days == [datetime.datetime(2017, 7, 11, tzinfo=UTC), datetime.datetime(2017, 7, 14, tzinfo=UTC),
+                    datetime.datetime(2017, 7, 15, tzinfo=UTC)]
+    assert list(inverse) == [1, 2, 1, 0]
@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import pytest
+
+import reference
+from data_handlers import decode_packets_TLM, iter_packets_TLM, find_shard_boundaries, new_ingest_state, PACKET_SIZE
+from packet_table import PacketTable
+from synthetic import make_tlm
+
+
+@pytest.fixture(scope='module')
+def tlm_file(tmp_path_factory):
+    root = tmp_path_factory.mktemp('tlm')
+    make_tlm(str(root / 'synthetic.TLM'), 600)
+    return str(root), 'synthetic.TLM'
+
+
+@pytest.fixture(scope='module')
+def expected(tlm_file):
+    return reference.decode_packets_TLM(*tlm_file)
+
+
+def test_reference_sees_bad_checksums(tlm_file, expected):
+    # (Every 97th frame has a bad checksum, and is dropped)
+    assert len(expected) == 600 - 7
+
+
+def test_decode_packets_TLM(tlm_file, expected):
+    packets = decode_packets_TLM(*tlm_file)
+    assert isinstance(packets, PacketTable)
+    reference.same_packets(expected, packets)
+
+
+# (Windows down to the smallest allowed, so plenty of packets straddle a window boundary)
+@pytest.mark.parametrize('window_size', [1, 3000, 4096, 1 << 20])
+def test_iter_packets_TLM(tlm_file, expected, window_size):
+    batches = list(iter_packets_TLM(*tlm_file, window_size=window_size, batch_size=None))
+    reference.same_packets(expected, PacketTable.concatenate(batches))
+
+
+@pytest.mark.parametrize('window_size, batch_size', [(4096, 7), (3000, 100), (1 << 20, 1000)])
+def test_iter_packets_TLM_in_batches(tlm_file, expected, window_size, batch_size):
+    batches = list(iter_packets_TLM(*tlm_file, window_size=window_size, batch_size=batch_size))
+    assert all(len(b) == batch_size for b in batches[:-1]) and 0 < len(batches[-1]) <= batch_size
+    reference.same_packets(expected, PacketTable.concatenate(batches))
+
+
+@pytest.mark.parametrize('shard_size', [1, 20000, 1 << 20])
+def test_decode_packets_TLM_in_parallel(tlm_file, expected, shard_size):
+    reference.same_packets(expected, decode_packets_TLM(*tlm_file, num_workers=3, shard_size=shard_size))
+
+
+def test_iter_packets_TLM_in_parallel(tlm_file, expected):
+    batches = iter_packets_TLM(*tlm_file, window_size=20000, batch_size=50, num_workers=3)
+    reference.same_packets(expected, PacketTable.concatenate(list(batches)))
+
+
+def test_find_shard_boundaries(tlm_file):
+    fpath = os.path.join(*tlm_file)
+    with open(fpath, 'rb') as f:
+        data = np.frombuffer(f.read(), dtype=np.uint8)
+    boundaries = find_shard_boundaries(fpath, 20000)
+    assert boundaries[0] == 0 and boundaries[-1] == len(data) and np.all(np.diff(boundaries) > 0)
+    assert len(boundaries) > len(data)//20000
+    # (Every boundary after the first is the start of a packet)
+    for b in boundaries[1:-1]:
+        assert data[b] == 0x7E and data[b + PACKET_SIZE - 1] == 0x7E
+        assert not np.any(data[b + 1:b + PACKET_SIZE - 1] == 0x7E)
+
+
+@pytest.mark.parametrize('num_workers', [1, 3])
+def test_iter_packets_TLM_as_file_grows(tlm_file, expected, tmp_path, num_workers):
+    # (Read a copy of the file as it's written, cut off anywhere: partway through a packet or a
+    #  CCSDS header, or not at all since last time)
+    with open(os.path.join(*tlm_file), 'rb') as f:
+        contents = f.read()
+    fpath = str(tmp_path / 'growing.TLM')
+    state = new_ingest_state(fpath)
+    batches = []
+    rng = np.random.default_rng(num_workers)
+    for cut in sorted(rng.integers(0, len(contents), 12).tolist() + [0, 100, 100]) + [len(contents)]:
+        with open(fpath, 'wb') as f:
+            f.write(contents[:cut])
+        batches += list(iter_packets_TLM(str(tmp_path), 'growing.TLM', window_size=5000, batch_size=40,
+                                         num_workers=num_workers, state=state))
+
+    reference.same_packets([dict(p, fname='growing.TLM') for p in expected], PacketTable.concatenate(batches))
+    assert state['size'] == len(contents) and state['packet_count'] == len(expected)
+    assert state['t_min'] == min(p['header_timestamp'] for p in expected)
+    assert state['t_max'] == max(p['header_timestamp'] for p in expected)
@@ -0,0 +1,168 @@
+import numpy as np
+import datetime
+import re
+
+
+# Array-in, array-out time conversions.
+# Timestamps everywhere in the pipeline are Unix timestamps (float seconds, UTC).
+# The payload reports time in GPS seconds (CCSDS headers: seconds + nanoseconds since
+# the GPS epoch; Novatel logs: GPS week + seconds into the week), and GPS time doesn't
+# account for leap seconds.
+
+GPS_EPOCH = datetime.datetime(1980,1,6,0,0, tzinfo=datetime.timezone.utc)
+GPS_EPOCH_UNIX = int(GPS_EPOCH.timestamp())
+SECONDS_PER_WEEK = 7*24*60*60
+SECONDS_PER_DAY = 24*60*60
+
+# The usual ISO timestamp format (e.g., UTC_TIME in CSV files, less the trailing Z), which we can parse in bulk
+ISO_TIMESTAMP = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{3}(\d{3})?)?$')
+
+# (UTC date, GPS - UTC offset in seconds from that date on).
+# Add a row here whenever the IERS announces a new leap second.
+LEAP_SECONDS = [
+    (datetime.datetime(1981,7,1), 1),
+    (datetime.datetime(1982,7,1), 2),
+    (datetime.datetime(1983,7,1), 3),
+    (datetime.datetime(1985,7,1), 4),
+    (datetime.datetime(1988,1,1), 5),
+    (datetime.datetime(1990,1,1), 6),
+    (datetime.datetime(1991,1,1), 7),
+    (datetime.datetime(1992,7,1), 8),
+    (datetime.datetime(1993,7,1), 9),
+    (datetime.datetime(1994,7,1), 10),
+    (datetime.datetime(1996,1,1), 11),
+    (datetime.datetime(1997,7,1), 12),
+    (datetime.datetime(1999,1,1), 13),
+    (datetime.datetime(2006,1,1), 14),
+    (datetime.datetime(2009,1,1), 15),
+    (datetime.datetime(2012,7,1), 16),
+    (datetime.datetime(2015,7,1), 17),
+    (datetime.datetime(2017,1,1), 18),
+]
+
+# The same table, in GPS seconds (the first GPS second at which each offset applies)
+LEAP_GPS_SECONDS = np.array([(d.replace(tzinfo=datetime.timezone.utc) - GPS_EPOCH).total_seconds() + offset
+                             for d, offset in LEAP_SECONDS])
+LEAP_OFFSETS = np.array([0] + [offset for d, offset in LEAP_SECONDS])
+
+
+def leap_seconds(gps_seconds):
+    ''' GPS - UTC offset (in seconds) at each of the given times (in GPS seconds) '''
+    return LEAP_OFFSETS[np.searchsorted(LEAP_GPS_SECONDS, gps_seconds, side='right')]
+
+
+def to_microseconds(seconds):
+    '''
+    Splits float seconds into integer microseconds, rounding the fractional part
+    the same way as datetime.timedelta and datetime.utcfromtimestamp do (to the
+    nearest microsecond, half to even) -- so we match the datetime arithmetic exactly.
+    '''
+    seconds = np.asarray(seconds, dtype=np.float64)
+    whole = np.trunc(seconds)
+    return whole.astype(np.int64)*1000000 + np.round((seconds - whole)*1e6).astype(np.int64)
+
+
+def gps_to_unix(epoch_sec, nanoseconds=0):
+    '''
+    Converts GPS time (seconds + nanoseconds since the GPS epoch, as in the
+    CCSDS headers) to Unix timestamps, correcting for leap seconds.
+    '''
+    epoch_sec = np.asarray(epoch_sec)
+    secs = epoch_sec + np.asarray(nanoseconds)*1e-9
+    us = to_microseconds(secs) + (GPS_EPOCH_UNIX - leap_seconds(epoch_sec))*1000000
+    return us/1e6
+
+
+def gps_week_to_unix(week, seconds_of_week):
+    '''
+    Converts GPS time (week number + seconds into the week, as in the Novatel logs)
+    to Unix timestamps, correcting for leap seconds.
+    '''
+    week = np.asarray(week).astype(np.int64)
+    seconds_of_week = np.asarray(seconds_of_week, dtype=np.float64)
+    us = week*SECONDS_PER_WEEK*1000000 + to_microseconds(seconds_of_week) + \
+         (GPS_EPOCH_UNIX - leap_seconds(week*SECONDS_PER_WEEK + seconds_of_week))*1000000
+    return us/1e6
+
+
+def unix_to_datetime64(timestamps):
+    ''' Unix timestamps -> numpy datetime64[us] (UTC) '''
+    return to_microseconds(timestamps).astype('datetime64[us]')
+
+
+def unix_to_datetime(timestamps):
+    '''
+    Unix timestamps -> naive UTC datetimes; an array-at-once version of
+    datetime.datetime.utcfromtimestamp. Takes a scalar or a list / array, and
+    returns the same shape (an object array of datetimes, for array inputs).
+    '''
+    dt64 = unix_to_datetime64(timestamps)
+    if dt64.ndim == 0:
+        return dt64.item()
+    return dt64.astype(object)
+
+
+def datetime_to_unix(dates):
+    ''' Naive UTC datetimes (or datetime64s) -> Unix timestamps '''
+    us = np.asarray(dates, dtype='datetime64[us]').astype(np.int64)
+    return us/1e6
+
+
+def iso_to_unix(timestamps):
+    '''
+    Converts a list of ISO-format UTC times (e.g., '2020-06-12T01:02:03.000132') to Unix timestamps,
+    as datetime.fromisoformat(t).replace(tzinfo=datetime.timezone.utc).timestamp() would.
+    Standard-format times are parsed all at once with numpy; anything else, one at a time.
+    outputs:
+        unix_times:     array of Unix timestamps (nan where we couldn't parse the time)
+        valid:          False for times which couldn't be parsed
+    '''
+    unix_times = np.full(len(timestamps), np.nan)
+    valid = np.zeros(len(timestamps), dtype=bool)
+
+    standard = np.fromiter((ISO_TIMESTAMP.match(t) is not None for t in timestamps), dtype=bool, count=len(timestamps))
+    inds = np.flatnonzero(standard)
+    try:
+        us = np.array([timestamps[i] for i in inds], dtype='datetime64[us]').astype(np.int64)
+        unix_times[inds] = us/1e6
+        valid[inds] = True
+    except ValueError:
+        # (e.g., a date which doesn't exist) -- do them all the slow way
+        inds = np.zeros(0, dtype=np.int64)
+
+    for i in np.setdiff1d(np.arange(len(timestamps)), inds):
+        try:
+            unix_times[i] = datetime.datetime.fromisoformat(timestamps[i]).replace(tzinfo=datetime.timezone.utc).timestamp()
+            valid[i] = True
+        except (ValueError, TypeError):
+            pass
+
+    return unix_times, valid
+
+
+def day_start(timestamps):
+    ''' Unix timestamps of the start of the (UTC) day containing each of the given timestamps '''
+    return np.floor(np.asarray(timestamps, dtype=np.float64)/SECONDS_PER_DAY)*SECONDS_PER_DAY
+
+
+def day_buckets(timestamps):
+    '''
+    Groups Unix timestamps by UTC day.
+    outputs:
+        days:       sorted list of the (UTC-aware) datetimes of the start of each day present
+        inverse:    index into days, for each of the timestamps
+    '''
+    starts, inverse = np.unique(day_start(timestamps), return_inverse=True)
+    days = [datetime.datetime.fromtimestamp(t, tz=datetime.timezone.utc) for t in starts]
+    return days, inverse
+
+
+def merge_intervals(intervals):
+    ''' Merge (start, end) intervals into a sorted list of non-overlapping (start, end) intervals '''
+    merged = []
+    for t1, t2 in sorted(intervals):
+        if merged and t1 <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], t2))
+        else:
+            merged.append((t1, t2))
+    return merged